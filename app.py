@@ -1,24 +1,118 @@
 import asyncio
 import logging
+import signal
+from typing import Awaitable, Callable, List, Optional
 
 from config import Config
-from database import db
+from database import ChangeListener, db, pool_stats, query_instrumentation
+from prices_api import PriceFeed
+from redis_pool import close_redis, create_redis
+from startup import StartupProfile
 from telegram_bot import TelegramBotService
 
 
-async def main(config: Config, loop: asyncio.AbstractEventLoop):
+shutdown_callbacks: List[Callable[[], Awaitable]] = []
+
+
+async def main(config: Config, loop: asyncio.AbstractEventLoop, profile: Optional[StartupProfile] = None):
+    profile = profile or StartupProfile()
     logging.info('%s started', config.app_name)
+    query_instrumentation.configure(
+        trace_sample_rate=config.query_trace_sample_rate,
+        stats_sample_rate=config.query_stats_sample_rate
+    )
+    profile.mark('tracing')
     logging.debug('Open PostgreSQL connection %s', config.pg_connection)
-    await db.set_bind(config.pg_connection, loop=loop)
-    pass_host, port_db = (config.redis_connection[config.redis_connection.find(":") + 4:]).split(':')
-    redis_password, redis_host = pass_host.split('@')
-    redis_port, redis_db = port_db.split('/')
+    await db.set_bind(
+        config.pg_connection,
+        loop=loop,
+        min_size=config.pg_pool_min_size,
+        max_size=config.pg_pool_max_size,
+        statement_cache_size=config.pg_statement_cache_size,
+        max_inactive_connection_lifetime=config.pg_max_inactive_connection_lifetime,
+        command_timeout=config.pg_command_timeout
+    )
+    profile.mark('db bind')
+    await db.warm_up(config.pg_pool_min_size)
+    profile.mark('db warm up')
+    redis = await create_redis(
+        config.redis_connection,
+        min_size=config.redis_pool_min_size,
+        max_size=config.redis_pool_max_size,
+        connect_timeout=config.redis_connect_timeout,
+        keepalive=config.redis_keepalive,
+        unix_socket=config.redis_unix_socket
+    )
+    profile.mark('redis connect')
+    change_listener = ChangeListener(loop=loop)
     telegram_bot_service = TelegramBotService(
-        redis_host=redis_host,
-        redis_port=redis_port,
-        redis_db=redis_db,
-        redis_password=redis_password,
+        redis=redis,
         config=config.telegram_bot_service_config,
+        change_listener=change_listener,
         loop=loop
     )
-    loop.create_task(telegram_bot_service.run_bot_task())
+    change_listener.start()
+    # Callbacks run in order, the Redis pool is closed after the FSM storage flushed through it
+    shutdown_callbacks.extend([telegram_bot_service.close, change_listener.stop, lambda: close_redis(redis)])
+    loop.add_signal_handler(signal.SIGUSR1, dump_stats, telegram_bot_service, redis)
+    telegram_bot_service.metrics.add_collector('db_pool', pool_stats.dump)
+    telegram_bot_service.metrics.add_collector('redis_pool', redis.connection.stats)
+    await telegram_bot_service.run_bot_task(startup_mark=profile.mark)
+    profile.report()
+    if config.prices_url and config.telegram_bot_service_config.role != 'worker':
+        price_feed = PriceFeed(config.prices_url, interval=config.prices_sync_interval, loop=loop)
+        price_feed.start()
+        # Stopped first, the sync uses the database and notifies the catalog listener
+        shutdown_callbacks.insert(0, price_feed.close)
+
+
+async def shutdown():
+    for callback in shutdown_callbacks:
+        try:
+            await callback()
+        except Exception:
+            logging.exception('Shutdown step %s failed', callback)
+    shutdown_callbacks.clear()
+
+
+def dump_db_stats():
+    logging.info(
+        'pool in_use=%(in_use)s waiting=%(waiting)s max_waiting=%(max_waiting)s acquired=%(acquired)s '
+        'timeouts=%(acquire_timeouts)s acquire p50=%(acquire_p50).4fs p95=%(acquire_p95).4fs p99=%(acquire_p99).4fs',
+        pool_stats.dump()
+    )
+    for stats in query_instrumentation.dump():
+        logging.info(
+            'count=%(count)s sampled=%(sampled)s rows_avg=%(rows_avg).1f avg=%(time_avg).4fs '
+            'p50=%(p50).4fs p95=%(p95).4fs p99=%(p99).4fs %(query)s',
+            stats
+        )
+
+
+def dump_outbound_stats(telegram_bot_service: TelegramBotService):
+    logging.info(
+        'outbound queue_depth=%(queue_depth)s active_chats=%(active_chats)s sent=%(sent)s failed=%(failed)s '
+        'retried=%(retried)s latency p50=%(latency_p50).4fs p95=%(latency_p95).4fs p99=%(latency_p99).4fs',
+        telegram_bot_service.outbox.stats()
+    )
+
+
+def dump_redis_stats(redis):
+    logging.info(
+        'redis size=%(size)s free=%(free)s max_size=%(max_size)s commands=%(commands)s acquired=%(acquired)s '
+        'waiting=%(waiting)s max_waiting=%(max_waiting)s command p50=%(command_p50).4fs p99=%(command_p99).4fs '
+        'acquire p50=%(acquire_p50).4fs p99=%(acquire_p99).4fs',
+        redis.connection.stats()
+    )
+
+
+def dump_stats(telegram_bot_service: TelegramBotService, redis):
+    dump_db_stats()
+    dump_redis_stats(redis)
+    dump_outbound_stats(telegram_bot_service)
+    logging.info('admin notifications sent=%(sent)s failed=%(failed)s', telegram_bot_service.notifier.stats())
+    logging.info(
+        'fsm storage size=%(size)s hits=%(hits)s misses=%(misses)s dirty=%(dirty)s redis_reads=%(redis_reads)s '
+        'redis_flushes=%(redis_flushes)s',
+        telegram_bot_service.storage.stats()
+    )
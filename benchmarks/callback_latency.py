@@ -0,0 +1,80 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, List
+
+import click
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.types import CallbackQuery
+
+from telegram_bot.callbacks import CallbackResponder
+from telegram_bot.outbound import OutboundDispatcher
+
+from .fake_bot_api import MESSAGE, TOKEN, USER, FakeBotAPI
+
+
+def callback_query(index: int) -> CallbackQuery:
+    return CallbackQuery(**{'id': str(index), 'chat_instance': '1', 'data': 'book', 'from': USER, 'message': MESSAGE})
+
+
+async def legacy_tap(bot: Bot, query: CallbackQuery, db_latency: float, **_):
+    await query.answer(cache_time=60)
+    await bot.answer_callback_query(query.id)
+    await query.message.edit_reply_markup(reply_markup=None)
+    await asyncio.sleep(db_latency)
+    await bot.send_message(query.from_user.id, 'Выберите интересующий вас инвентарь:')
+
+
+async def pipelined_tap(bot: Bot, query: CallbackQuery, db_latency: float, responder: CallbackResponder):
+    await responder.ack(query, asyncio.sleep(db_latency), cache_time=60)
+    await responder.reply(query, 'Выберите интересующий вас инвентарь:')
+
+
+async def measure(tap: Callable[..., Awaitable], bot: Bot, taps: int, db_latency: float, **kwargs) -> List[float]:
+    latencies = []
+    for index in range(taps):
+        query = callback_query(index)
+        started = time.perf_counter()
+        await tap(bot, query, db_latency, **kwargs)
+        latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+
+async def run(taps: int, api_latency: float, db_latency: float, port: int):
+    api = FakeBotAPI(api_latency)
+    bot = Bot(TOKEN, server=TelegramAPIServer.from_base(await api.start(port)))
+    # The benchmark taps one chat far faster than Telegram allows, so the per-chat limit is lifted
+    outbox = OutboundDispatcher(bot, chat_rate=1000, chat_burst=1000, global_rate=1000)
+    # Outbox workers start outside any update context, as in the service; only the taps see the current bot
+    outbox.start()
+    Bot.set_current(bot)
+    try:
+        variants = {
+            'sequential': (legacy_tap, {}),
+            'pipelined': (pipelined_tap, {'responder': CallbackResponder(bot, outbox)}),
+            'edit in place': (pipelined_tap, {'responder': CallbackResponder(bot, outbox, edit_in_place=True)}),
+        }
+        for name, (tap, kwargs) in variants.items():
+            api.requests.clear()
+            latencies = await measure(tap, bot, taps, db_latency, **kwargs)
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            calls = sum(api.requests.values()) / taps
+            click.echo(f'{name:>14}: p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  {calls:.1f} API calls per tap')
+    finally:
+        await outbox.close()
+        await bot.session.close()
+        await api.stop()
+
+
+@click.command(help='Run from the repository root: python -m benchmarks.callback_latency')
+@click.option('--taps', type=int, default=200, help='Callback taps per variant')
+@click.option('--api_latency', type=float, default=0.05, help='Fake Bot API response delay, sec')
+@click.option('--db_latency', type=float, default=0.005, help='Simulated DB query time, sec')
+@click.option('--port', type=int, default=8081, help='Fake Bot API port')
+def main(taps: int, api_latency: float, db_latency: float, port: int):
+    asyncio.get_event_loop().run_until_complete(run(taps, api_latency, db_latency, port))
+
+
+if __name__ == '__main__':
+    main()
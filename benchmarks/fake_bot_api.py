@@ -0,0 +1,42 @@
+import asyncio
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+CHAT = {'id': 227448700, 'type': 'private', 'first_name': 'Test'}
+USER = {'id': 227448700, 'is_bot': False, 'first_name': 'Test'}
+MESSAGE = {'message_id': 1, 'date': 0, 'chat': CHAT, 'text': 'menu'}
+
+
+class FakeBotAPI:
+    """Answers every Bot API method after a fixed delay and counts the requests, per method and chat."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self.chat_requests: Counter = Counter()
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, port: int) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', port).start()
+        return f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        chat_id = (await request.post()).get('chat_id')
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if chat_id is not None:
+            self.chat_requests[method, int(chat_id)] += 1
+        await asyncio.sleep(self.latency)
+        result = True if method in ('answercallbackquery', 'answerinlinequery') else MESSAGE
+        return web.json_response({'ok': True, 'result': result})
@@ -0,0 +1,60 @@
+import random
+import time
+from typing import Dict, List
+
+import click
+
+from telegram_bot.search import SearchIndex
+
+
+WORDS = ('велосипед', 'горный', 'детский', 'самокат', 'электро', 'сапборд', 'палатка', 'лыжи', 'сноуборд',
+         'ролики', 'шлем', 'коньки', 'байдарка', 'гамак', 'мангал', 'спальник', 'рюкзак', 'тент', 'fatbike', 'kids')
+CATEGORIES = ('Велосипеды', 'Зимний спорт', 'Водный спорт', 'Туризм', 'Защита')
+QUERIES = ('в', 'вел', 'велосипед горн', 'дет сам', 'велосипдед', 'сноубрд детский', 'fat', 'шлем 42', 'zzz')
+
+
+def synthetic_documents(items: int, revision: int = 0) -> Dict[str, str]:
+    rnd = random.Random(1)
+    documents = {}
+    for i in range(items):
+        name = ' '.join(rnd.sample(WORDS, 3))
+        category = CATEGORIES[i % len(CATEGORIES)]
+        documents[f'item_{i}'] = f'{name} {i % 97 + revision * (i % 100 == 0)} {category}'
+    return documents
+
+
+def percentiles(latencies: List[float]) -> str:
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    return f'p50 {p50:6.2f} ms  p99 {p99:6.2f} ms'
+
+
+@click.command(help='Build the inline search index over synthetic items and time queries. '
+                    'Run from the repository root: python -m benchmarks.inline_search')
+@click.option('--items', type=int, default=100000, help='Indexed items')
+@click.option('--repeat', type=int, default=50, help='Runs of every query')
+def main(items: int, repeat: int):
+    index: SearchIndex[str] = SearchIndex()
+    documents = synthetic_documents(items)
+    started = time.perf_counter()
+    index.sync(documents)
+    click.echo(f'{"build":>16}: {time.perf_counter() - started:6.2f} s for {len(index)} items')
+
+    documents = synthetic_documents(items, revision=1)
+    started = time.perf_counter()
+    changed, removed = index.sync(documents)
+    elapsed = time.perf_counter() - started
+    click.echo(f'{"1% changed sync":>16}: {elapsed:6.2f} s, {changed} reindexed, {removed} removed')
+
+    for query in QUERIES:
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = index.search(query, limit=50)
+            latencies.append(time.perf_counter() - started)
+        click.echo(f'{query:>16}: {percentiles(latencies)}  {len(results)} results')
+
+
+if __name__ == '__main__':
+    main()
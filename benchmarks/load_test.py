@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+import click
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from database import Admin, Item, NotificationDelivery, Order, User, db, query_instrumentation
+from redis_pool import close_redis, create_redis
+from telegram_bot import TelegramBotService, TelegramBotServiceConfig
+from telegram_bot.keyboard import ORDERS_PAGE_PREFIX
+
+from .fake_bot_api import TOKEN, FakeBotAPI
+
+
+APP_NAME = 'loadtest'
+# Synthetic chats are far above the ids Telegram hands out to real users, the admin is the first of them
+FIRST_TELEGRAM_ID = 9000000000
+ADMIN_TELEGRAM_ID = FIRST_TELEGRAM_ID
+ITEMS = 20
+
+# Bot API methods every step must have called, the run fails if one is missing
+EXPECTED_CALLS = {
+    'start': ('sendmessage',),
+    'registration': ('sendmessage',),
+    'menu': ('sendmessage',),
+    'inline search': ('answerinlinequery',),
+    'book': ('answercallbackquery', 'sendmessage'),
+    'category': ('answercallbackquery', 'editmessagetext'),
+    'subcategory': ('answercallbackquery', 'editmessagetext'),
+    'item': ('answercallbackquery', 'sendmessage'),
+    'done': ('answercallbackquery', 'sendmessage'),
+    'cancel': ('answercallbackquery', 'sendmessage'),
+    'admin menu': ('sendmessage',),
+    'show orders': ('answercallbackquery', 'sendmessage'),
+    'orders filter': ('answercallbackquery', 'editmessagereplymarkup'),
+}
+# Answers carry no chat id, they are only counted in total
+UNBOUND_METHODS = ('answercallbackquery', 'answerinlinequery')
+
+_update_ids = itertools.count(1)
+
+
+def message_update(telegram_id: int, text: str) -> Update:
+    chat = {'id': telegram_id, 'type': 'private', 'first_name': 'Load'}
+    user = {'id': telegram_id, 'is_bot': False, 'first_name': 'Load'}
+    message = {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split(' ')[0])}]
+    return Update(**{'update_id': next(_update_ids), 'message': message})
+
+
+def callback_update(telegram_id: int, data: str) -> Update:
+    chat = {'id': telegram_id, 'type': 'private', 'first_name': 'Load'}
+    user = {'id': telegram_id, 'is_bot': False, 'first_name': 'Load'}
+    message = {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': 'menu'}
+    callback_query = {'id': str(next(_update_ids)), 'chat_instance': '1', 'data': data, 'from': user,
+                      'message': message}
+    return Update(**{'update_id': next(_update_ids), 'callback_query': callback_query})
+
+
+def inline_update(telegram_id: int, query: str) -> Update:
+    user = {'id': telegram_id, 'is_bot': False, 'first_name': 'Load'}
+    inline_query = {'id': str(next(_update_ids)), 'from': user, 'query': query, 'offset': ''}
+    return Update(**{'update_id': next(_update_ids), 'inline_query': inline_query})
+
+
+def customer_flow(index: int, telegram_id: int, paths: List[Tuple[str, str, str]]) -> List[tuple]:
+    category, subcategory, item = paths[index % len(paths)]
+    return [
+        ('start', message_update(telegram_id, '/start')),
+        ('registration', message_update(telegram_id, f'Нагрузочный Тест Пользователь +7902{index:07d} 175 80')),
+        ('menu', message_update(telegram_id, '/menu')),
+        ('inline search', inline_update(telegram_id, f'инвентарь {APP_NAME}_{index % ITEMS}'[:12 + index % 8])),
+        ('book', callback_update(telegram_id, 'book')),
+        ('category', callback_update(telegram_id, category)),
+        ('subcategory', callback_update(telegram_id, subcategory)),
+        ('item', callback_update(telegram_id, item)),
+        ('done' if index % 2 else 'cancel', callback_update(telegram_id, 'done' if index % 2 else 'cancel')),
+    ]
+
+
+def admin_flow() -> List[tuple]:
+    return [
+        ('admin menu', message_update(ADMIN_TELEGRAM_ID, '/menu')),
+        ('show orders', callback_update(ADMIN_TELEGRAM_ID, 'show_orders')),
+        ('orders filter', callback_update(ADMIN_TELEGRAM_ID, f'{ORDERS_PAGE_PREFIX}:c:n')),
+        ('orders filter', callback_update(ADMIN_TELEGRAM_ID, f'{ORDERS_PAGE_PREFIX}:t:n')),
+    ]
+
+
+async def seed() -> List[str]:
+    if await Admin.query.where(Admin.telegram_id == str(ADMIN_TELEGRAM_ID)).gino.first() is None:
+        await Admin.create(telegram_id=str(ADMIN_TELEGRAM_ID), name='Нагрузочный тест')
+    items = [f'{APP_NAME}_{index}' for index in range(ITEMS)]
+    existing = {row[0] for row in await db.select([Item.data]).where(Item.data.in_(items)).gino.all()}
+    rows = [
+        {'data': data, 'name': f'Инвентарь {data}', 'price': Decimal(100 + index), 'rental_time': 1,
+         'rental_unit': 'час'}
+        for index, data in enumerate(items) if data not in existing
+    ]
+    if rows:
+        await Item.insert().gino.status(*rows)
+    return items
+
+
+async def cleanup(telegram_ids: List[str], items: List[str], redis):
+    await NotificationDelivery.delete.where(NotificationDelivery.telegram_id.in_(telegram_ids)).gino.status()
+    await Order.delete.where(Order.telegram_id.in_(telegram_ids)).gino.status()
+    await User.delete.where(User.telegram_id.in_(telegram_ids)).gino.status()
+    await Admin.delete.where(Admin.telegram_id == str(ADMIN_TELEGRAM_ID)).gino.status()
+    await Item.delete.where(Item.data.in_(items)).gino.status()
+    keys = await redis.keys(f'{APP_NAME}:*')
+    if keys:
+        await redis.delete(*keys)
+
+
+async def replay(service: TelegramBotService, steps: List[tuple], latencies: Dict[str, List[float]]):
+    for name, update in steps:
+        started = time.perf_counter()
+        await service.dispatcher.updates_handler.notify(update)
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+
+def update_chat(update: Update) -> int:
+    return (update.message or update.callback_query or update.inline_query).from_user.id
+
+
+def missing_calls(flows: List[List[tuple]], api: FakeBotAPI) -> Counter:
+    expected: Counter = Counter()
+    for steps in flows:
+        for name, update in steps:
+            for method in EXPECTED_CALLS[name]:
+                expected[method, None if method in UNBOUND_METHODS else update_chat(update)] += 1
+    sent = api.chat_requests + Counter({(method, None): api.requests.get(method, 0) for method in UNBOUND_METHODS})
+    return Counter({key: count - sent[key] for key, count in expected.items() if count > sent[key]})
+
+
+async def drain(outbox, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while outbox.stats()['active_chats'] and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def percentiles(latencies: List[float]) -> str:
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    return f'p50 {p50:7.1f} ms  p99 {p99:7.1f} ms'
+
+
+async def run(pg_connection: str, redis_connection: str, users: int, concurrency: int, api_latency: float,
+              port: int):
+    api = FakeBotAPI(api_latency)
+    api_url = await api.start(port)
+    await db.set_bind(pg_connection, min_size=concurrency, max_size=concurrency)
+    redis = await create_redis(redis_connection, max_size=concurrency)
+    telegram_ids = [str(FIRST_TELEGRAM_ID + index) for index in range(users + 1)]
+    items = await seed()
+    service = TelegramBotService(redis, config=TelegramBotServiceConfig(
+        app_name=APP_NAME,
+        token=TOKEN,
+        api_server=api_url,
+        # Synthetic users reply faster than Telegram allows, the harness measures handlers and not rate limits
+        outbound_global_rate=100000,
+        outbound_chat_rate=1000,
+        outbound_chat_burst=1000
+    ))
+    try:
+        # As in the service the outbox workers start outside any update context
+        await service.start_handlers()
+
+        tree = (await service.catalog.snapshot()).tree
+        paths = [tree.locate(data) for data in items]
+        flows = [customer_flow(index, FIRST_TELEGRAM_ID + index, paths) for index in range(1, users + 1)]
+        for flow in flows[::10]:
+            flow.extend(admin_flow())
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: Dict[str, List[float]] = {}
+
+        async def user(steps: List[tuple]):
+            # Like the update workers, each user task has the current bot and dispatcher in its own context
+            Bot.set_current(service.dispatcher.bot)
+            Dispatcher.set_current(service.dispatcher)
+            async with semaphore:
+                await replay(service, steps, latencies)
+
+        queries = query_instrumentation.queries
+        commands = redis.connection.commands
+        started = time.perf_counter()
+        await asyncio.gather(*(user(steps) for steps in flows))
+        elapsed = time.perf_counter() - started
+        queries = query_instrumentation.queries - queries
+        commands = redis.connection.commands - commands
+
+        updates = sum(len(steps) for steps in flows)
+        click.echo(f'{updates} updates from {users} users in {elapsed:.2f} s: {updates / elapsed:.1f} updates/s')
+        click.echo(f'{"all handlers":>14}: {percentiles(sum(latencies.values(), []))}')
+        for name, step_latencies in latencies.items():
+            click.echo(f'{name:>14}: {percentiles(step_latencies)}  ({len(step_latencies)} updates)')
+        click.echo(f'DB queries per update: {queries / updates:.2f}')
+        click.echo(f'Redis commands per update: {commands / updates:.2f}')
+        click.echo(f'Bot API calls per update: {sum(api.requests.values()) / updates:.2f}')
+
+        await drain(service.outbox)
+        failed = service.outbox.failed
+        missing = missing_calls(flows, api)
+        if failed or missing:
+            raise click.ClickException(f'Outbox requests failed: {failed}, missing Bot API calls: {dict(missing)}')
+    finally:
+        await service.close()
+        await cleanup(telegram_ids, items, redis)
+        await close_redis(redis)
+        await db.pop_bind().close()
+        await api.stop()
+
+
+@click.command(help='Replay synthetic users through the bot handlers against a fake Bot API. '
+                    'Run from the repository root against a scratch database and Redis: python -m benchmarks.load_test')
+@click.option('--users', type=int, default=200, help='Synthetic users, every tenth also runs the admin menus')
+@click.option('--concurrency', type=int, default=20, help='Users replayed at the same time')
+@click.option('--api_latency', type=float, default=0.05, help='Fake Bot API response delay, sec')
+@click.option('--port', type=int, default=8082, help='Fake Bot API port')
+@click.argument('pg_connection', envvar='PG_CONNECTION', type=str)
+@click.argument('redis_connection', envvar='REDIS_CONNECTION', type=str)
+def main(users: int, concurrency: int, api_latency: float, port: int, pg_connection: str, redis_connection: str):
+    asyncio.get_event_loop().run_until_complete(
+        run(pg_connection, redis_connection, users, concurrency, api_latency, port)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import time
+
+import click
+from aiohttp import web
+
+from database import db
+from prices_api import PriceFeed
+
+
+def synthetic_feed(items: int, revision: int):
+    return [
+        {
+            'value': 100 + i % 50 + revision * (i % 10 == 0),
+            'timeEntity': {'time': 1 + i % 3, 'name': 'час'},
+            'categoryEntity': {'name': f'Категория {i % 20}'},
+            'subCategoryEntity': {
+                'name': f'Подкатегория {i % 200}',
+                'categories': {'name': f'Инвентарь {i}'}
+            }
+        }
+        for i in range(items)
+    ]
+
+
+async def run(pg_connection: str, items: int, port: int):
+    state = {'revision': 0}
+
+    async def prices(request: web.Request) -> web.Response:
+        return web.Response(body=json.dumps(synthetic_feed(items, state['revision'])), content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/prices', prices)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+
+    await db.set_bind(pg_connection)
+    try:
+        feed = PriceFeed(f'http://127.0.0.1:{port}/prices')
+        for title, revision in (('initial load', 0), ('unchanged resync', 0), ('10% changed resync', 1)):
+            state['revision'] = revision
+            started = time.perf_counter()
+            stats = await feed.sync()
+            click.echo(f'{title:<20} {time.perf_counter() - started:6.2f} s  {stats}')
+    finally:
+        await db.pop_bind().close()
+        await runner.cleanup()
+
+
+@click.command(help='Sync a synthetic price feed from a local stub server. '
+                    'Run from the repository root against a scratch database: python -m benchmarks.price_feed')
+@click.option('--items', type=int, default=50000, help='Items in the feed')
+@click.option('--port', type=int, default=8089, help='Stub server port')
+@click.argument('pg_connection', envvar='PG_CONNECTION', type=str)
+def main(items: int, port: int, pg_connection: str):
+    asyncio.get_event_loop().run_until_complete(run(pg_connection, items, port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from collections import Counter
+from typing import List
+
+import click
+
+from redis_pool import close_redis, create_redis
+from telegram_bot.reminders import ReminderScheduler
+
+
+KEY_PREFIX = 'benchmark:reminders'
+
+
+class CountingOutbox:
+    """Stands in for the outbox and counts deliveries per chat, so double-fired reminders show up."""
+
+    def __init__(self):
+        self.delivered: Counter = Counter()
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        self.delivered[chat_id] += 1
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(True)
+        return future
+
+
+def percentiles(latencies: List[float]) -> str:
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    return f'p50 {p50:6.2f} ms  p99 {p99:6.2f} ms'
+
+
+async def run(redis_connection: str, pending: int, due: int, replicas: int, batch_size: int, concurrency: int):
+    redis = await create_redis(redis_connection, max_size=concurrency)
+    outbox = CountingOutbox()
+    schedulers = [
+        ReminderScheduler(redis, outbox, key_prefix=KEY_PREFIX, batch_size=batch_size) for _ in range(replicas)
+    ]
+    try:
+        now = time.time()
+        # Future timers only make the sorted set large, due ones fire during the run
+        jobs = [(f'pending:{i}', now + 86400 + i, i) for i in range(pending)]
+        jobs += [(f'due:{i}', now - due + i, pending + i) for i in range(due)]
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+
+        async def schedule(job_id: str, fire_at: float, chat_id: int):
+            async with semaphore:
+                started = time.perf_counter()
+                await schedulers[0].schedule(job_id, fire_at, chat_id, 'Напоминание')
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(schedule(*job) for job in jobs))
+        elapsed = time.perf_counter() - started
+        click.echo(f'{"schedule":>8}: {len(jobs) / elapsed:8.0f} timers/s  {percentiles(latencies)}')
+
+        latencies = []
+
+        async def poll(scheduler: ReminderScheduler):
+            while True:
+                started = time.perf_counter()
+                claimed = await scheduler.poll()
+                latencies.append(time.perf_counter() - started)
+                if not claimed:
+                    return
+
+        started = time.perf_counter()
+        await asyncio.gather(*(poll(scheduler) for scheduler in schedulers))
+        elapsed = time.perf_counter() - started
+        delivered = sum(outbox.delivered.values())
+        duplicates = sum(count - 1 for count in outbox.delivered.values() if count > 1)
+        click.echo(f'{"poll":>8}: {delivered / elapsed:8.0f} timers/s  {percentiles(latencies)} '
+                   f'per batch of {batch_size} with {await schedulers[0].pending()} pending')
+        click.echo(f'Delivered {delivered} of {due} due timers by {replicas} pollers, {duplicates} duplicates')
+    finally:
+        await redis.delete(f'{KEY_PREFIX}:due', f'{KEY_PREFIX}:in_flight', f'{KEY_PREFIX}:jobs')
+        await close_redis(redis)
+
+
+@click.command(help='Schedule many reminders and drain the due ones with several pollers. '
+                    'Run from the repository root against a scratch Redis: python -m benchmarks.reminders')
+@click.option('--pending', type=int, default=300000, help='Timers due tomorrow')
+@click.option('--due', type=int, default=20000, help='Timers already due')
+@click.option('--replicas', type=int, default=4, help='Pollers claiming the due timers concurrently')
+@click.option('--batch_size', type=int, default=100, help='Timers claimed per poll')
+@click.option('--concurrency', type=int, default=50, help='Concurrent schedule calls and Redis connections')
+@click.argument('redis_connection', envvar='REDIS_CONNECTION', type=str)
+def main(pending: int, due: int, replicas: int, batch_size: int, concurrency: int, redis_connection: str):
+    asyncio.get_event_loop().run_until_complete(
+        run(redis_connection, pending, due, replicas, batch_size, concurrency)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import timeit
+import uuid
+from base64 import b64encode
+from datetime import datetime, timedelta
+from decimal import Decimal
+from enum import Enum
+from typing import Dict
+
+import click
+import msgpack
+from gino.crud import CRUDModel
+
+from database import Order
+
+
+def legacy_to_dict(self, del_hiden_keys: bool = True) -> Dict:
+    data = {}
+    for key in list(self.__dict__.get('__values__', {}).keys()) + list(self.__dict__.keys()):
+        if key.startswith('_') or (del_hiden_keys and key in getattr(self, '__hiden_keys__', [])):
+            continue
+        value = getattr(self, key, None)
+        if isinstance(value, uuid.UUID):
+            value = str(value)
+        elif isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat(' ')
+        elif isinstance(value, timedelta):
+            value = value.total_seconds()
+        elif isinstance(value, Enum):
+            value = value.value
+        elif isinstance(value, bytes):
+            value = b64encode(value).decode()
+        elif isinstance(value, CRUDModel):
+            value = value.to_dict()
+        data[key] = value
+    return data
+
+
+@click.command(help='Run from the repository root: python -m benchmarks.to_dict')
+@click.option('--rows', type=int, default=10000, help='Rows per run')
+@click.option('--repeat', type=int, default=5, help='Runs per variant')
+def main(rows: int, repeat: int):
+    now = datetime.utcnow()
+    orders = [
+        Order(
+            id=str(uuid.uuid4()),
+            telegram_id=str(227448700 + i),
+            ordered_item=f'Велосипед {i}',
+            status='in treatment',
+            create_datetime=now,
+            update_datetime=now
+        )
+        for i in range(rows)
+    ]
+    assert legacy_to_dict(orders[0]) == orders[0].to_dict()
+
+    variants = {
+        'legacy to_dict': lambda: [legacy_to_dict(order) for order in orders],
+        'to_dict': lambda: [order.to_dict() for order in orders],
+        'to_dicts': lambda: Order.to_dicts(orders),
+        'legacy + msgpack.packb': lambda: msgpack.packb([legacy_to_dict(order) for order in orders]),
+        'to_msgpack': lambda: Order.to_msgpack(orders),
+    }
+    for name, variant in variants.items():
+        best = min(timeit.repeat(variant, number=1, repeat=repeat))
+        click.echo(f'{name:<24} {best * 1000:8.1f} ms  {best / rows * 1e6:6.2f} us/row')
+
+
+if __name__ == '__main__':
+    main()
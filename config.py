@@ -1,20 +1,34 @@
 import os
 from dataclasses import dataclass, field
-from typing import Dict
-
-import toml
+from functools import lru_cache
+from typing import Any, Dict, Optional
 
 from telegram_bot import TelegramBotServiceConfig, default_telegram_bot_service_config
 
 
 app_root = os.path.abspath(os.path.dirname(__file__))
-pyproject_info = toml.load(os.path.join(app_root, 'pyproject.toml'))
-poetry_info = pyproject_info['tool']['poetry']
 
-app_name = poetry_info['name']
-app_version = poetry_info['version']
-default_input_exchange = app_name
-default_output_exchange = app_name
+
+@lru_cache(maxsize=None)
+def poetry_info() -> Dict[str, Any]:
+    import toml
+
+    return toml.load(os.path.join(app_root, 'pyproject.toml'))['tool']['poetry']
+
+
+_poetry_attributes = {
+    'app_name': 'name',
+    'app_version': 'version',
+    'default_input_exchange': 'name',
+    'default_output_exchange': 'name'
+}
+
+
+def __getattr__(name: str) -> Any:
+    # Project metadata is read from pyproject.toml on first access instead of at import
+    if name in _poetry_attributes:
+        return poetry_info()[_poetry_attributes[name]]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def logging_params(debug: bool = False) -> Dict:
@@ -42,10 +56,30 @@ class Config:
 
     telegram_bot_service_config: TelegramBotServiceConfig = default_telegram_bot_service_config
 
-    app_name: str = app_name
-    app_version: str = app_version
+    app_name: str = field(default_factory=lambda: poetry_info()['name'])
+    app_version: str = field(default_factory=lambda: poetry_info()['version'])
     logging_params: Dict = field(default_factory=logging_params)
 
+    pg_pool_min_size: int = 5
+    pg_pool_max_size: int = 20
+    pg_statement_cache_size: int = 100
+    pg_max_inactive_connection_lifetime: float = 300.0
+    pg_command_timeout: Optional[float] = 60.0
+
+    prices_url: Optional[str] = None
+    prices_sync_interval: float = 3600
+
+    redis_pool_min_size: int = 1
+    redis_pool_max_size: int = 10
+    redis_connect_timeout: Optional[float] = 5.0
+    redis_keepalive: Optional[int] = 60
+    redis_unix_socket: Optional[str] = None
+
+    query_trace_sample_rate: float = 0.1
+    query_stats_sample_rate: float = 1.0
+
+    profile_startup: bool = False
+
     develop: bool = True
     debug: bool = False
     docker: bool = False
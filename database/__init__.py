@@ -1,11 +1,23 @@
-from .models import Admin, BaseModel, User, Item, Order, db
+from .listener import ChangeListener
+from .models import (
+    Admin, BaseModel, Category, SubCategory, User, Item, NotificationDelivery, Order, QueryScope, current_query_scope,
+    db, pool_stats, query_instrumentation
+)
 
 
 __all__ = [
     'Admin',
     'BaseModel',
+    'Category',
+    'SubCategory',
+    'ChangeListener',
     'User',
     'Item',
+    'NotificationDelivery',
     'Order',
-    'db'
+    'db',
+    'pool_stats',
+    'query_instrumentation',
+    'QueryScope',
+    'current_query_scope'
 ]
\ No newline at end of file
@@ -0,0 +1,26 @@
+"""orders create_datetime index for reports
+
+Revision ID: 5b2e8d7a1c43
+Revises: f15c39e04d7d
+Create Date: 2026-10-18 19:05:12.604117
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8d7a1c43'
+down_revision = 'f15c39e04d7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('orders_create_datetime_id_idx', 'orders', ['create_datetime', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('orders_create_datetime_id_idx', table_name='orders', postgresql_concurrently=True)
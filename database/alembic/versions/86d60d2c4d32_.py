@@ -0,0 +1,39 @@
+"""telegram_id and items.data indexes
+
+Revision ID: 86d60d2c4d32
+Revises: c272604cb33f
+Create Date: 2026-10-18 12:20:05.913377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '86d60d2c4d32'
+down_revision = 'c272604cb33f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('admins_telegram_id_idx', 'admins', ['telegram_id'], unique=True,
+                        postgresql_concurrently=True)
+        op.create_index('users_telegram_id_idx', 'users', ['telegram_id'], unique=True,
+                        postgresql_concurrently=True, postgresql_where=sa.text('telegram_id IS NOT NULL'))
+        op.create_index('items_data_idx', 'items', ['data'], unique=True,
+                        postgresql_concurrently=True)
+        op.create_index('orders_telegram_id_create_datetime_idx', 'orders', ['telegram_id', 'create_datetime'],
+                        postgresql_concurrently=True, postgresql_where=sa.text('telegram_id IS NOT NULL'))
+        op.create_index('orders_status_create_datetime_id_idx', 'orders', ['status', 'create_datetime', 'id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('orders_status_create_datetime_id_idx', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('orders_telegram_id_create_datetime_idx', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('items_data_idx', table_name='items', postgresql_concurrently=True)
+        op.drop_index('users_telegram_id_idx', table_name='users', postgresql_concurrently=True)
+        op.drop_index('admins_telegram_id_idx', table_name='admins', postgresql_concurrently=True)
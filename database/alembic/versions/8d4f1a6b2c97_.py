@@ -0,0 +1,27 @@
+"""orders rental duration
+
+Revision ID: 8d4f1a6b2c97
+Revises: 5b2e8d7a1c43
+Create Date: 2026-10-18 21:12:40.318529
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4f1a6b2c97'
+down_revision = '5b2e8d7a1c43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('orders', sa.Column('rental_time', sa.Integer(), nullable=True, comment='Rental Duration'))
+    op.add_column('orders', sa.Column('rental_unit', sa.String(), server_default='', nullable=False,
+                                      comment='Rental Duration Unit'))
+
+
+def downgrade():
+    op.drop_column('orders', 'rental_unit')
+    op.drop_column('orders', 'rental_time')
@@ -0,0 +1,36 @@
+"""notify items changes
+
+Revision ID: 992a85d9cafb
+Revises: f9c93bdab6f7
+Create Date: 2026-10-18 10:12:40.118204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '992a85d9cafb'
+down_revision = 'f9c93bdab6f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE OR REPLACE FUNCTION notify_items_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('items_changed', TG_OP);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE TRIGGER items_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON items
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_items_changed()
+    """)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER IF EXISTS items_changed ON items')
+    op.execute('DROP FUNCTION IF EXISTS notify_items_changed()')
@@ -0,0 +1,47 @@
+"""notify identities changes
+
+Revision ID: c272604cb33f
+Revises: 992a85d9cafb
+Create Date: 2026-10-18 11:03:17.542871
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c272604cb33f'
+down_revision = '992a85d9cafb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE OR REPLACE FUNCTION notify_identities_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            IF OLD.telegram_id IS NOT NULL THEN
+                PERFORM pg_notify('identities_changed', OLD.telegram_id);
+            END IF;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            IF NEW.telegram_id IS NOT NULL THEN
+                PERFORM pg_notify('identities_changed', NEW.telegram_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+    for table in ('admins', 'users'):
+        op.execute(f"""
+        CREATE TRIGGER {table}_identities_changed
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE notify_identities_changed()
+        """)
+
+
+def downgrade():
+    for table in ('admins', 'users'):
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_identities_changed ON {table}')
+    op.execute('DROP FUNCTION IF EXISTS notify_identities_changed()')
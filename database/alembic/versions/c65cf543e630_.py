@@ -0,0 +1,83 @@
+"""numeric prices and categories
+
+Revision ID: c65cf543e630
+Revises: 86d60d2c4d32
+Create Date: 2026-10-18 14:41:52.270913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c65cf543e630'
+down_revision = '86d60d2c4d32'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('categories',
+    sa.Column('name', sa.String(), nullable=False, comment='Category Name'),
+    sa.Column('id', postgresql.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False, comment='ID'),
+    sa.Column('create_datetime', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='UTC create datetime'),
+    sa.Column('update_datetime', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='UTC update datetime'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name', name='categories_name_key')
+    )
+    op.create_table('subcategories',
+    sa.Column('category_id', postgresql.UUID(), nullable=False, comment='Category ID'),
+    sa.Column('name', sa.String(), nullable=False, comment='Subcategory Name'),
+    sa.Column('id', postgresql.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False, comment='ID'),
+    sa.Column('create_datetime', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='UTC create datetime'),
+    sa.Column('update_datetime', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='UTC update datetime'),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('category_id', 'name', name='subcategories_category_id_name_key')
+    )
+
+    op.add_column('items', sa.Column('rental_time', sa.Integer(), nullable=True, comment='Rental Duration'))
+    op.add_column('items', sa.Column('rental_unit', sa.String(), server_default='', nullable=False, comment='Rental Duration Unit'))
+    op.add_column('items', sa.Column('category_id', postgresql.UUID(), nullable=True, comment='Category ID'))
+    op.add_column('items', sa.Column('subcategory_id', postgresql.UUID(), nullable=True, comment='Subcategory ID'))
+    op.create_foreign_key('items_category_id_fkey', 'items', 'categories', ['category_id'], ['id'], ondelete='SET NULL')
+    op.create_foreign_key('items_subcategory_id_fkey', 'items', 'subcategories', ['subcategory_id'], ['id'],
+                          ondelete='SET NULL')
+
+    # Prices were stored as "<value> за <time> <unit>" strings
+    op.execute(r"""
+    UPDATE items SET
+        rental_time = substring(price from 'за ([0-9]+)')::integer,
+        rental_unit = COALESCE(substring(price from 'за [0-9]+ (.+)$'), '')
+    """)
+    op.alter_column('items', 'price', server_default=None)
+    op.alter_column('items', 'price', type_=sa.Numeric(12, 2), existing_nullable=False, postgresql_using=(
+        r"COALESCE(NULLIF(replace(substring(price from '[0-9]+(?:[.,][0-9]+)?'), ',', '.'), '')::numeric, 0)"
+    ))
+    op.alter_column('items', 'price', server_default='0')
+
+    op.create_index('items_price_idx', 'items', ['price', 'id'])
+    op.create_index('items_category_id_price_idx', 'items', ['category_id', 'price', 'id'])
+    op.create_index('items_subcategory_id_price_idx', 'items', ['subcategory_id', 'price', 'id'])
+
+
+def downgrade():
+    op.drop_index('items_subcategory_id_price_idx', table_name='items')
+    op.drop_index('items_category_id_price_idx', table_name='items')
+    op.drop_index('items_price_idx', table_name='items')
+
+    op.alter_column('items', 'price', server_default=None)
+    op.alter_column('items', 'price', type_=sa.String(), existing_nullable=False, postgresql_using=(
+        "price::text || CASE WHEN rental_time IS NULL THEN '' ELSE ' за ' || rental_time || ' ' || rental_unit END"
+    ))
+    op.alter_column('items', 'price', server_default='')
+
+    op.drop_constraint('items_subcategory_id_fkey', 'items', type_='foreignkey')
+    op.drop_constraint('items_category_id_fkey', 'items', type_='foreignkey')
+    op.drop_column('items', 'subcategory_id')
+    op.drop_column('items', 'category_id')
+    op.drop_column('items', 'rental_unit')
+    op.drop_column('items', 'rental_time')
+    op.drop_table('subcategories')
+    op.drop_table('categories')
@@ -0,0 +1,41 @@
+"""admin roles and notification deliveries
+
+Revision ID: f15c39e04d7d
+Revises: c65cf543e630
+Create Date: 2026-10-18 16:12:40.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f15c39e04d7d'
+down_revision = 'c65cf543e630'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('admins', sa.Column('role', sa.String(), server_default='admin', nullable=False, comment='Admin role'))
+
+    op.create_table('notification_deliveries',
+    sa.Column('order_id', postgresql.UUID(), nullable=True, comment='Order ID'),
+    sa.Column('telegram_id', sa.String(), nullable=False, comment='Recipient Telegram ID'),
+    sa.Column('status', sa.String(), nullable=False, comment='Delivery status: sent or failed'),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False, comment='Send attempts'),
+    sa.Column('error', sa.String(), nullable=True, comment='Last send error'),
+    sa.Column('id', postgresql.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False, comment='ID'),
+    sa.Column('create_datetime', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='UTC create datetime'),
+    sa.Column('update_datetime', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='UTC update datetime'),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('notification_deliveries_order_id_idx', 'notification_deliveries', ['order_id'])
+
+
+def downgrade():
+    op.drop_index('notification_deliveries_order_id_idx', table_name='notification_deliveries')
+    op.drop_table('notification_deliveries')
+    op.drop_column('admins', 'role')
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from .models import db
+
+
+logger = logging.getLogger('database.listener')
+
+ChangeCallback = Callable[[Optional[str]], None]
+
+
+class ChangeListener:
+    """Postgres LISTEN/NOTIFY subscriber on a dedicated pooled connection.
+
+    Callbacks receive the notification payload, or ``None`` right after (re)connect, when
+    notifications may have been missed and subscribers should drop everything they cached.
+    """
+
+    def __init__(
+        self,
+        heartbeat_interval: float = 30.0,
+        reconnect_delay: float = 5.0,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._heartbeat_interval = heartbeat_interval
+        self._reconnect_delay = reconnect_delay
+        self._callbacks: Dict[str, List[ChangeCallback]] = defaultdict(list)
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, channel: str, callback: ChangeCallback):
+        self._callbacks[channel].append(callback)
+
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('LISTEN connection lost, reconnect in %s s', self._reconnect_delay)
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _listen(self):
+        connection = await db.acquire(lazy=False)
+        raw_connection = await connection.get_raw_connection()
+        try:
+            for channel in self._callbacks:
+                await raw_connection.add_listener(channel, self._on_notification)
+            logger.info('Listening for %s', ', '.join(self._callbacks))
+            for channel in self._callbacks:
+                self._dispatch(channel, None)
+            while True:
+                await asyncio.sleep(self._heartbeat_interval)
+                await raw_connection.execute('SELECT 1')
+        finally:
+            if not raw_connection.is_closed():
+                for channel in self._callbacks:
+                    await raw_connection.remove_listener(channel, self._on_notification)
+            await connection.release()
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        self._dispatch(channel, payload)
+
+    def _dispatch(self, channel: str, payload: Optional[str]):
+        for callback in self._callbacks.get(channel, ()):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception('Change callback for %s failed', channel)
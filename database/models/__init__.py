@@ -1,6 +1,9 @@
 from .admin import Admin
 from .base_model import BaseModel
-from .db import db
+from .categories import Category, SubCategory
+from .db import db, pool_stats, query_instrumentation
+from .instrumentation import QueryScope, current_query_scope
+from .notifications import NotificationDelivery
 from .users import User
 from .items import Item
 from .orders import Order
@@ -8,8 +11,15 @@ from .orders import Order
 __all__ = [
     'Admin',
     'BaseModel',
+    'Category',
+    'SubCategory',
     'db',
     'User',
     'Order',
-    'Item'
+    'Item',
+    'NotificationDelivery',
+    'pool_stats',
+    'query_instrumentation',
+    'QueryScope',
+    'current_query_scope'
 ]
@@ -5,7 +5,8 @@ from .db import db
 class Admin(BaseModel):
     __tablename__ = 'admins'
 
-    role = 'admin'
-
     telegram_id = db.Column(db.String(), nullable=False, comment='Admin Telegram ID')
     name = db.Column(db.String(), nullable=False, default='', server_default='', comment='Admin name')
+    role = db.Column(db.String(), nullable=False, default='admin', server_default='admin', comment='Admin role')
+
+    _telegram_id_idx = db.Index('admins_telegram_id_idx', 'telegram_id', unique=True)
@@ -0,0 +1,17 @@
+from .base_model import BaseModel
+from .db import db
+
+
+class Category(BaseModel):
+    __tablename__ = 'categories'
+
+    name = db.Column(db.String(), nullable=False, unique=True, comment='Category Name')
+
+
+class SubCategory(BaseModel):
+    __tablename__ = 'subcategories'
+
+    category_id = db.Column(db.ForeignKey('categories.id', ondelete='CASCADE'), nullable=False, comment='Category ID')
+    name = db.Column(db.String(), nullable=False, comment='Subcategory Name')
+
+    _category_id_name_key = db.UniqueConstraint('category_id', 'name', name='subcategories_category_id_name_key')
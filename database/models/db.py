@@ -1,18 +1,25 @@
+import asyncio
 import sys
+import time
 import uuid
 from base64 import b64encode
 from datetime import datetime, timedelta
 from decimal import Decimal
 from enum import Enum
-from typing import Dict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
-from ddtrace import tracer
+import msgpack
+import sqlalchemy as sa
 from gino.crud import CRUDModel as _CRUDModel
+from gino.dialects import asyncpg as asyncpg_dialect
 from gino.dialects.asyncpg import AsyncpgDialect
 from gino.dialects.asyncpg import DBAPICursor as _DBAPICursor
+from gino.dialects.asyncpg import Pool as _Pool
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.types import TypeDecorator
 
+from .instrumentation import PoolStats, QueryInstrumentation
+
 
 if 'sanic' in sys.modules:
     from gino.ext.sanic import Gino as _Gino
@@ -20,52 +27,160 @@ else:
     from gino import Gino as _Gino
 
 
+query_instrumentation = QueryInstrumentation()
+pool_stats = PoolStats()
+
+
 class DBAPICursor(_DBAPICursor):
     async def async_execute(self, query, timeout, args, limit=0, many=False):
-        with tracer.trace('postgres.query', service='postgres') as span:
-            span.set_tag('query', query)
-            span.set_tag('args', [str(arg)[:100] for arg in args])
-            result = await super().async_execute(query, timeout, args, limit=0, many=False)
+        trace = query_instrumentation.sample_trace()
+        if not trace and not query_instrumentation.sample_stats():
+            query_instrumentation.count(query)
+            return await super().async_execute(query, timeout, args, limit=limit, many=many)
+
+        started = time.perf_counter()
+        if trace:
+            with query_instrumentation.tracer.trace('postgres.query', service='postgres') as span:
+                span.set_tag('query', query)
+                span.set_tag('args', [str(arg)[:100] for arg in args])
+                result = await super().async_execute(query, timeout, args, limit=limit, many=many)
+        else:
+            result = await super().async_execute(query, timeout, args, limit=limit, many=many)
+        rows = len(result) if isinstance(result, list) else 0
+        query_instrumentation.record(query, time.perf_counter() - started, rows)
         return result
 
 
 AsyncpgDialect.cursor_cls = DBAPICursor
 
 
+class Pool(_Pool):
+    async def acquire(self, *, timeout=None):
+        pool_stats.waiting += 1
+        pool_stats.max_waiting = max(pool_stats.max_waiting, pool_stats.waiting)
+        started = time.perf_counter()
+        try:
+            connection = await super().acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            pool_stats.acquire_timeouts += 1
+            raise
+        finally:
+            pool_stats.waiting -= 1
+        pool_stats.acquire_latencies.append(time.perf_counter() - started)
+        pool_stats.acquired += 1
+        pool_stats.in_use += 1
+        return connection
+
+    async def release(self, conn):
+        pool_stats.in_use -= 1
+        await super().release(conn)
+
+
+asyncpg_dialect.Pool = Pool
+
+
 class NDArray(TypeDecorator):
     impl = postgresql.BYTEA
 
 
+def _serialize_value(value):
+    if isinstance(value, uuid.UUID):
+        value = str(value)
+    elif isinstance(value, Decimal):
+        value = float(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat(' ')
+    elif isinstance(value, timedelta):
+        value = value.total_seconds()
+    elif isinstance(value, Enum):
+        value = value.value
+    elif isinstance(value, bytes):
+        value = b64encode(value).decode()
+    elif isinstance(value, _CRUDModel):
+        value = value.to_dict()
+    return value
+
+
+def _none_safe(serialize: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def serializer(value):
+        return None if value is None else serialize(value)
+    return serializer
+
+
+def _column_serializer(column_type) -> Optional[Callable[[Any], Any]]:
+    if isinstance(column_type, TypeDecorator):
+        column_type = column_type.impl
+    if isinstance(column_type, postgresql.UUID):
+        return _none_safe(str)
+    if isinstance(column_type, sa.Numeric) and column_type.asdecimal:
+        return _none_safe(float)
+    if isinstance(column_type, sa.DateTime):
+        return _none_safe(lambda value: value.isoformat(' '))
+    if isinstance(column_type, sa.Interval):
+        return _none_safe(lambda value: value.total_seconds())
+    if isinstance(column_type, sa.Enum) and column_type.enum_class is not None:
+        return _none_safe(lambda value: value.value)
+    if isinstance(column_type, sa.LargeBinary):
+        return _none_safe(lambda value: b64encode(value).decode())
+    if isinstance(column_type, (sa.String, sa.Integer, sa.Boolean)):
+        return None
+    return _serialize_value
+
+
+_serializers: Dict[Tuple[type, bool], Tuple[Tuple[str, Optional[Callable[[Any], Any]]], ...]] = {}
+
+
 class CRUDModel(_CRUDModel):
     __hiden_keys__ = ()
 
+    @classmethod
+    def _serializer(cls, del_hiden_keys: bool):
+        serializer = _serializers.get((cls, del_hiden_keys))
+        if serializer is None:
+            hiden_keys = set(getattr(cls, '__hiden_keys__', ())) if del_hiden_keys else set()
+            serializer = _serializers[cls, del_hiden_keys] = tuple(
+                (column.name, _column_serializer(column.type))
+                for column in cls.__table__.columns
+                if not column.name.startswith('_') and column.name not in hiden_keys
+            )
+        return serializer
+
     def to_dict(self, del_hiden_keys: bool = True) -> Dict:
         data = {}
-        for key in list(self.__dict__.get('__values__', {}).keys()) + list(self.__dict__.keys()):
-            if key.startswith('_') or (del_hiden_keys and key in getattr(self, '__hiden_keys__', [])):
+        values = self.__dict__.get('__values__', {})
+        for key, serialize in self._serializer(del_hiden_keys):
+            if key in values:
+                value = values[key]
+                data[key] = value if serialize is None else serialize(value)
+        for key, value in self.__dict__.items():
+            if key.startswith('_') or key in data or (del_hiden_keys and key in getattr(self, '__hiden_keys__', [])):
                 continue
-            value = getattr(self, key, None)
-            if isinstance(value, uuid.UUID):
-                value = str(value)
-            elif isinstance(value, Decimal):
-                value = float(value)
-            elif isinstance(value, datetime):
-                value = value.isoformat(' ')
-            elif isinstance(value, timedelta):
-                value = value.total_seconds()
-            elif isinstance(value, Enum):
-                value = value.value
-            elif isinstance(value, bytes):
-                value = b64encode(value).decode()
-            elif isinstance(value, _CRUDModel):
-                value = value.to_dict()
-            data[key] = value
+            data[key] = _serialize_value(value)
         return data
 
+    @classmethod
+    def to_dicts(cls, rows: Iterable['CRUDModel'], del_hiden_keys: bool = True) -> List[Dict]:
+        return [row.to_dict(del_hiden_keys) for row in rows]
+
+    @classmethod
+    def to_msgpack(cls, rows: Sequence['CRUDModel'], del_hiden_keys: bool = True) -> bytes:
+        packer = msgpack.Packer()
+        chunks = [packer.pack_array_header(len(rows))]
+        chunks.extend(packer.pack(row.to_dict(del_hiden_keys)) for row in rows)
+        return b''.join(chunks)
+
 
 class Gino(_Gino):
     model_base_classes = (CRUDModel,)
     NDArray = NDArray
 
+    async def warm_up(self, size: int):
+        connections = [await self.acquire(lazy=False) for _ in range(size)]
+        try:
+            await asyncio.gather(*(connection.scalar('SELECT 1') for connection in connections))
+        finally:
+            for connection in connections:
+                await connection.release()
+
 
 db = Gino()
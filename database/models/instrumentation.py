@@ -0,0 +1,151 @@
+import random
+import re
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional
+
+
+_whitespace_re = re.compile(r'\s+')
+_param_list_re = re.compile(r'\$\d+(?:\s*,\s*\$\d+)+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str:
+    return _param_list_re.sub('$n, ...', _whitespace_re.sub(' ', query).strip())
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class QueryScope:
+    """Counts the queries of one unit of work, e.g. a bot update, set through ``current_query_scope``."""
+
+    __slots__ = ('queries',)
+
+    def __init__(self):
+        self.queries = 0
+
+
+current_query_scope: ContextVar[Optional[QueryScope]] = ContextVar('current_query_scope', default=None)
+
+
+class QueryShapeStats:
+    __slots__ = ('count', 'sampled', 'rows', 'total_time', 'latencies')
+
+    def __init__(self, reservoir_size: int):
+        self.count = 0
+        self.sampled = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.latencies: Deque[float] = deque(maxlen=reservoir_size)
+
+
+class QueryInstrumentation:
+    def __init__(
+        self,
+        trace_sample_rate: float = 0.1,
+        stats_sample_rate: float = 1.0,
+        max_shapes: int = 1000,
+        reservoir_size: int = 1024
+    ):
+        self.trace_sample_rate = trace_sample_rate
+        self.stats_sample_rate = stats_sample_rate
+        self.max_shapes = max_shapes
+        self.reservoir_size = reservoir_size
+        self._shapes: Dict[str, QueryShapeStats] = {}
+        self.tracer = None
+        self.queries = 0
+
+    def configure(
+        self,
+        trace_sample_rate: Optional[float] = None,
+        stats_sample_rate: Optional[float] = None,
+        max_shapes: Optional[int] = None
+    ):
+        if trace_sample_rate is not None:
+            self.trace_sample_rate = trace_sample_rate
+        if self.trace_sample_rate > 0 and self.tracer is None:
+            # ddtrace takes long to import, it is only loaded once tracing is enabled
+            from ddtrace import tracer
+            self.tracer = tracer
+        if stats_sample_rate is not None:
+            self.stats_sample_rate = stats_sample_rate
+        if max_shapes is not None:
+            self.max_shapes = max_shapes
+
+    def sample_trace(self) -> bool:
+        return self.tracer is not None and self.trace_sample_rate > 0 and random.random() < self.trace_sample_rate
+
+    def sample_stats(self) -> bool:
+        return self.stats_sample_rate > 0 and random.random() < self.stats_sample_rate
+
+    def count(self, query: str) -> Optional[QueryShapeStats]:
+        self.queries += 1
+        scope = current_query_scope.get()
+        if scope is not None:
+            scope.queries += 1
+        shape = normalize_query(query)
+        stats = self._shapes.get(shape)
+        if stats is None:
+            if len(self._shapes) >= self.max_shapes:
+                return None
+            stats = self._shapes[shape] = QueryShapeStats(self.reservoir_size)
+        stats.count += 1
+        return stats
+
+    def record(self, query: str, elapsed: float, rows: int):
+        stats = self.count(query)
+        if stats is None:
+            return
+        stats.sampled += 1
+        stats.rows += rows
+        stats.total_time += elapsed
+        stats.latencies.append(elapsed)
+
+    def reset(self):
+        self._shapes.clear()
+        self.queries = 0
+
+    def dump(self) -> List[Dict]:
+        result = []
+        for shape, stats in self._shapes.items():
+            latencies = sorted(stats.latencies)
+            result.append({
+                'query': shape,
+                'count': stats.count,
+                'sampled': stats.sampled,
+                'rows_avg': stats.rows / stats.sampled if stats.sampled else 0.0,
+                'time_avg': stats.total_time / stats.sampled if stats.sampled else 0.0,
+                'p50': percentile(latencies, 0.5),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99)
+            })
+        result.sort(key=lambda item: item['time_avg'] * item['count'], reverse=True)
+        return result
+
+
+class PoolStats:
+    def __init__(self, reservoir_size: int = 1024):
+        self.in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.acquire_timeouts = 0
+        self.acquire_latencies: Deque[float] = deque(maxlen=reservoir_size)
+
+    def dump(self) -> Dict:
+        latencies = sorted(self.acquire_latencies)
+        return {
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'acquired': self.acquired,
+            'acquire_timeouts': self.acquire_timeouts,
+            'acquire_p50': percentile(latencies, 0.5),
+            'acquire_p95': percentile(latencies, 0.95),
+            'acquire_p99': percentile(latencies, 0.99)
+        }
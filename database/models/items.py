@@ -1,7 +1,6 @@
-from typing import Set
+from decimal import Decimal
+from typing import Optional, Set, Tuple
 
-from datetime import datetime
-from sqlalchemy.sql import func
 from .base_model import BaseModel
 from .db import db
 
@@ -11,7 +10,17 @@ class Item(BaseModel):
 
     data = db.Column(db.String(), nullable=False, default='', server_default='', comment='Item ENG Name')
     name = db.Column(db.String(), nullable=False, default='', server_default='', comment='Item RU Name')
-    price = db.Column(db.String(), nullable=False, default='', server_default='', comment='Item Price')
+    price = db.Column(db.Numeric(12, 2), nullable=False, default=Decimal(0), server_default='0', comment='Item Price')
+    rental_time = db.Column(db.Integer(), nullable=True, comment='Rental Duration')
+    rental_unit = db.Column(db.String(), nullable=False, default='', server_default='', comment='Rental Duration Unit')
+    category_id = db.Column(db.ForeignKey('categories.id', ondelete='SET NULL'), nullable=True, comment='Category ID')
+    subcategory_id = db.Column(db.ForeignKey('subcategories.id', ondelete='SET NULL'), nullable=True,
+                               comment='Subcategory ID')
+
+    _data_idx = db.Index('items_data_idx', 'data', unique=True)
+    _price_idx = db.Index('items_price_idx', 'price', 'id')
+    _category_id_price_idx = db.Index('items_category_id_price_idx', 'category_id', 'price', 'id')
+    _subcategory_id_price_idx = db.Index('items_subcategory_id_price_idx', 'subcategory_id', 'price', 'id')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -24,3 +33,39 @@ class Item(BaseModel):
     @applications.setter
     def add_application(self, application):
         self._applications.add(application)
+
+    @property
+    def rental_text(self) -> str:
+        return f'{self.rental_time} {self.rental_unit}' if self.rental_time else ''
+
+    @property
+    def title(self) -> str:
+        return f'{self.name} ({self.rental_text})' if self.rental_time else self.name
+
+    @property
+    def price_text(self) -> str:
+        price = f'{self.price.normalize():f}'
+        return f'{price} за {self.rental_text}' if self.rental_time else price
+
+    @classmethod
+    def catalog_page_query(
+        cls,
+        category_id: Optional[str] = None,
+        subcategory_id: Optional[str] = None,
+        min_price: Optional[Decimal] = None,
+        max_price: Optional[Decimal] = None,
+        after: Optional[Tuple[Decimal, str]] = None,
+        limit: int = 20
+    ):
+        query = cls.query
+        if subcategory_id is not None:
+            query = query.where(cls.subcategory_id == subcategory_id)
+        elif category_id is not None:
+            query = query.where(cls.category_id == category_id)
+        if min_price is not None:
+            query = query.where(cls.price >= min_price)
+        if max_price is not None:
+            query = query.where(cls.price <= max_price)
+        if after is not None:
+            query = query.where(db.tuple_(cls.price, cls.id) > db.tuple_(*after))
+        return query.order_by(cls.price, cls.id).limit(limit)
@@ -0,0 +1,16 @@
+from sqlalchemy.dialects.postgresql import UUID
+
+from .base_model import BaseModel
+from .db import db
+
+
+class NotificationDelivery(BaseModel):
+    __tablename__ = 'notification_deliveries'
+
+    order_id = db.Column(UUID(), db.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True, comment='Order ID')
+    telegram_id = db.Column(db.String(), nullable=False, comment='Recipient Telegram ID')
+    status = db.Column(db.String(), nullable=False, comment='Delivery status: sent or failed')
+    attempts = db.Column(db.Integer(), nullable=False, default=0, server_default='0', comment='Send attempts')
+    error = db.Column(db.String(), nullable=True, comment='Last send error')
+
+    _order_id_idx = db.Index('notification_deliveries_order_id_idx', 'order_id')
@@ -1,4 +1,5 @@
-from typing import Set
+from datetime import datetime
+from typing import Optional, Set
 
 from .base_model import BaseModel
 from .db import db
@@ -7,9 +8,27 @@ from .db import db
 class Order(BaseModel):
     __tablename__ = 'orders'
 
+    DRAFT = 'draft'
+    IN_TREATMENT = 'in treatment'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    CANCELED = 'canceled'
+    TRANSITIONS = {
+        DRAFT: (IN_TREATMENT,),
+        IN_TREATMENT: (IN_PROGRESS, DONE, CANCELED),
+        IN_PROGRESS: (DONE, CANCELED)
+    }
+
     telegram_id = db.Column(db.String(), nullable=True, comment='User Telegram ID')
     ordered_item = db.Column(db.String(), nullable=False, default='', server_default='', comment='Ordered Item Name RU')
     status = db.Column(db.String(), nullable=False, default='', server_default='', comment='Order Status')
+    rental_time = db.Column(db.Integer(), nullable=True, comment='Rental Duration')
+    rental_unit = db.Column(db.String(), nullable=False, default='', server_default='', comment='Rental Duration Unit')
+
+    _telegram_id_idx = db.Index('orders_telegram_id_create_datetime_idx', 'telegram_id', 'create_datetime',
+                                postgresql_where=db.text('telegram_id IS NOT NULL'))
+    _status_idx = db.Index('orders_status_create_datetime_id_idx', 'status', 'create_datetime', 'id')
+    _create_datetime_idx = db.Index('orders_create_datetime_id_idx', 'create_datetime', 'id')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -22,3 +41,27 @@ class Order(BaseModel):
     @applications.setter
     def add_application(self, application):
         self._applications.add(application)
+
+    @classmethod
+    async def transition(cls, order_id: Optional[str], status: str, new_status: str) -> Optional['Order']:
+        """Moves the order to ``new_status`` in one primary key lookup if it is still in ``status``.
+
+        Returns ``None`` if the order is gone, was moved by someone else or the transition is not allowed.
+        """
+        if order_id is None or new_status not in cls.TRANSITIONS.get(status, ()):
+            return None
+        return await cls.update.values(status=new_status, update_datetime=datetime.utcnow()).where(
+            (cls.id == order_id) & (cls.status == status)
+        ).returning(*cls.__table__.columns).gino.load(cls).first()
+
+    @classmethod
+    async def discard_draft(cls, order_id: Optional[str]) -> bool:
+        if order_id is None:
+            return False
+        status, _ = await cls.delete.where((cls.id == order_id) & (cls.status == cls.DRAFT)).gino.status()
+        return status == 'DELETE 1'
+
+    @classmethod
+    def stale_drafts_query(cls, before: datetime, limit: int):
+        stale = db.select([cls.id]).where((cls.status == cls.DRAFT) & (cls.create_datetime < before)).limit(limit)
+        return cls.delete.where(cls.id.in_(stale))
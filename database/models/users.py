@@ -13,6 +13,9 @@ class User(BaseModel):
     weight = db.Column(db.String(), nullable=False, default='', server_default='', comment='User Weight')
     height = db.Column(db.String(), nullable=False, default='', server_default='', comment='User Height')
 
+    _telegram_id_idx = db.Index('users_telegram_id_idx', 'telegram_id', unique=True,
+                                postgresql_where=db.text('telegram_id IS NOT NULL'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._applications = set()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, List, Tuple
+from uuid import uuid4
+
+import click
+
+from database import Item, Order, db
+from telegram_bot.identity import identity_query
+from telegram_bot.keyboard import encode_orders_cursor, order_details_query, orders_page_query
+from telegram_bot.reports import orders_report_query
+
+
+def hot_queries() -> List[Tuple[str, object]]:
+    telegram_id = '227448700'
+    cursor = encode_orders_cursor(datetime.utcnow(), str(uuid4()))
+    return [
+        ('identity', identity_query(telegram_id)),
+        ('item_by_data', Item.query.where(Item.data == 'bike')),
+        ('items_by_price', Item.catalog_page_query(min_price=Decimal(100), max_price=Decimal(500))),
+        ('items_in_category', Item.catalog_page_query(category_id=str(uuid4()), after=(Decimal(100), str(uuid4())))),
+        ('items_in_subcategory', Item.catalog_page_query(subcategory_id=str(uuid4()))),
+        ('order_by_telegram_id', Order.query.where(Order.telegram_id == telegram_id)),
+        ('order_details', order_details_query(str(uuid4()))),
+        ('order_transition', Order.update.values(status=Order.IN_TREATMENT).where(
+            (Order.id == str(uuid4())) & (Order.status == Order.DRAFT)
+        )),
+        ('stale_drafts', Order.stale_drafts_query(datetime.utcnow(), 500)),
+        ('orders_report', orders_report_query(datetime.utcnow() - timedelta(days=1), datetime.utcnow())),
+        ('orders_first_page', orders_page_query(Order.IN_TREATMENT)),
+        ('orders_next_page', orders_page_query(Order.IN_TREATMENT, cursor, forward=True)),
+        ('orders_prev_page', orders_page_query(Order.IN_TREATMENT, cursor, forward=False)),
+    ]
+
+
+def iter_plan_nodes(plan: Dict) -> Iterator[Dict]:
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from iter_plan_nodes(child)
+
+
+async def explain_all(pg_connection: str) -> int:
+    await db.set_bind(pg_connection)
+    failures = 0
+    try:
+        async with db.acquire() as connection:
+            raw_connection = await connection.get_raw_connection()
+            # Small test tables are always cheaper to scan, so force the planner to show whether an index is usable
+            await raw_connection.execute('SET enable_seqscan = off')
+            for name, query in hot_queries():
+                sql, params = db.bind.compile(query)
+                result = await raw_connection.fetchval(f'EXPLAIN (FORMAT JSON) {sql}', *params)
+                plan = json.loads(result)[0]['Plan']
+                seq_scans = [node.get('Relation Name', '?') for node in iter_plan_nodes(plan)
+                             if node['Node Type'] == 'Seq Scan']
+                if seq_scans:
+                    failures += 1
+                    click.echo(f'FAIL {name}: seq scan on {", ".join(seq_scans)}')
+                    click.echo(sql)
+                else:
+                    click.echo(f'ok   {name}: {plan["Node Type"]}')
+    finally:
+        await db.pop_bind().close()
+    return failures
+
+
+@click.command()
+@click.argument('pg_connection', envvar='PG_CONNECTION', type=str)
+def main(pg_connection: str):
+    failures = asyncio.get_event_loop().run_until_complete(explain_all(pg_connection))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
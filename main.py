@@ -1,14 +1,19 @@
+# Imported first, the startup profile measures the imports below
+from startup import StartupProfile
+
 import asyncio
 import logging
 import logging.config
-import aioredis
+import multiprocessing
+import re
 import signal
+from dataclasses import replace
 from typing import Dict
 
 import click
 
 import app
-from config import Config, app_name, logging_params
+from config import Config, logging_params, poetry_info
 from telegram_bot import TelegramBotServiceConfig
 
 
@@ -21,11 +26,109 @@ def exception_handler(loop: asyncio.AbstractEventLoop, context: Dict):
     stop_loop(loop)
 
 
+def run(config: Config, loop: asyncio.AbstractEventLoop):
+    logging.config.dictConfig(config.logging_params)
+    profile = StartupProfile(config.profile_startup)
+    profile.mark('imports')
+
+    loop.set_exception_handler(exception_handler)
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_loop, loop)
+
+    loop.create_task(app.main(config, loop, profile))
+    loop.run_forever()
+    loop.run_until_complete(app.shutdown())
+
+
+def run_worker(config: Config):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    run(config, loop)
+
+
+def start_workers(config: Config):
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for worker_index in range(config.telegram_bot_service_config.workers):
+        service_config = config.telegram_bot_service_config
+        worker_config = replace(config, telegram_bot_service_config=replace(
+            service_config,
+            role='worker',
+            worker_index=worker_index,
+            # Every worker serves its own metrics on the ports following the ingress one
+            metrics_port=service_config.metrics_port + worker_index + 1 if service_config.metrics_port else None
+        ))
+        process = context.Process(target=run_worker, args=(worker_config,), name=f'worker-{worker_index}')
+        process.start()
+        processes.append(process)
+    return processes
+
+
 @click.command()
 @click.option('--environment', envvar='ENVIRONMENT', type=str, default='production', help='Sentry environment')
 @click.option('--docker', envvar='IS_DOCKER', is_flag=True, default=False, help='Docker режим')
 @click.option('--debug', envvar='DEBUG', is_flag=True, default=False, help='Debug режим')
 @click.option('--develop', envvar='DEVELOP', is_flag=True, default=True, help='Develop режим')
+@click.option('--pg_pool_min_size', envvar='PG_POOL_MIN_SIZE', type=int, default=5,
+              help='Минимальный размер пула PostgreSQL')
+@click.option('--pg_pool_max_size', envvar='PG_POOL_MAX_SIZE', type=int, default=20,
+              help='Максимальный размер пула PostgreSQL')
+@click.option('--pg_statement_cache_size', envvar='PG_STATEMENT_CACHE_SIZE', type=int, default=100,
+              help='Размер кэша prepared statements на соединение')
+@click.option('--pg_max_inactive_connection_lifetime', envvar='PG_MAX_INACTIVE_CONNECTION_LIFETIME', type=float,
+              default=300.0, help='Время жизни простаивающего соединения, сек')
+@click.option('--pg_command_timeout', envvar='PG_COMMAND_TIMEOUT', type=float, default=60.0,
+              help='Таймаут SQL запроса, сек')
+@click.option('--redis_pool_min_size', envvar='REDIS_POOL_MIN_SIZE', type=int, default=1,
+              help='Минимальный размер пула Redis')
+@click.option('--redis_pool_max_size', envvar='REDIS_POOL_MAX_SIZE', type=int, default=10,
+              help='Максимальный размер пула Redis')
+@click.option('--redis_connect_timeout', envvar='REDIS_CONNECT_TIMEOUT', type=float, default=5.0,
+              help='Таймаут подключения к Redis, сек')
+@click.option('--redis_keepalive', envvar='REDIS_KEEPALIVE', type=int, default=60,
+              help='TCP keepalive соединений Redis, сек (0 - выключен)')
+@click.option('--redis_unix_socket', envvar='REDIS_UNIX_SOCKET', type=str, default=None,
+              help='Путь к unix сокету Redis вместо хоста и порта из URL')
+@click.option('--prices_url', envvar='PRICES_URL', type=str, default=None,
+              help='URL API цен, без него синхронизация каталога отключена')
+@click.option('--prices_sync_interval', envvar='PRICES_SYNC_INTERVAL', type=float, default=3600,
+              help='Интервал синхронизации каталога, сек')
+@click.option('--query_trace_sample_rate', envvar='QUERY_TRACE_SAMPLE_RATE', type=float, default=0.1,
+              help='Доля SQL запросов, попадающих в трейсинг')
+@click.option('--query_stats_sample_rate', envvar='QUERY_STATS_SAMPLE_RATE', type=float, default=1.0,
+              help='Доля SQL запросов, попадающих в статистику (дамп по SIGUSR1)')
+@click.option('--mode', envvar='TELEGRAM_BOT_MODE', type=click.Choice(['polling', 'webhook']), default='polling',
+              help='Получение обновлений: long polling или webhook')
+@click.option('--webhook_url', envvar='WEBHOOK_URL', type=str, default=None, help='Публичный URL webhook')
+@click.option('--webhook_host', envvar='WEBHOOK_HOST', type=str, default='0.0.0.0', help='Адрес webhook сервера')
+@click.option('--webhook_port', envvar='WEBHOOK_PORT', type=int, default=8080, help='Порт webhook сервера')
+@click.option('--webhook_path', envvar='WEBHOOK_PATH', type=str, default='/webhook', help='Путь webhook сервера')
+@click.option('--webhook_secret', envvar='WEBHOOK_SECRET', type=str, default=None,
+              help='Секрет webhook (1-256 символов A-Z, a-z, 0-9, _ и -), Telegram передает его в каждом запросе')
+@click.option('--update_workers', envvar='UPDATE_WORKERS', type=int, default=16,
+              help='Количество параллельных обработчиков обновлений в webhook режиме')
+@click.option('--update_queue_size', envvar='UPDATE_QUEUE_SIZE', type=int, default=1000,
+              help='Максимальная очередь необработанных обновлений')
+@click.option('--workers', envvar='WORKERS', type=int, default=0,
+              help='Количество процессов-обработчиков; обновления распределяются через Redis Streams')
+@click.option('--stream_partitions', envvar='STREAM_PARTITIONS', type=int, default=64,
+              help='Количество партиций Redis Streams (не меньше числа процессов)')
+@click.option('--order_notification_role', envvar='ORDER_NOTIFICATION_ROLE', type=str, default=None,
+              help='Роль администраторов, получающих заявки (по умолчанию все)')
+@click.option('--order_draft_ttl', envvar='ORDER_DRAFT_TTL', type=int, default=3600,
+              help='Через сколько секунд удаляются неподтвержденные заявки')
+@click.option('--reminder_lead', envvar='REMINDER_LEAD', type=int, default=3600,
+              help='За сколько секунд до окончания аренды напоминать клиенту')
+@click.option('--inline_cache_time', envvar='INLINE_CACHE_TIME', type=int, default=300,
+              help='Сколько секунд Telegram кэширует результаты inline поиска')
+@click.option('--callback_edit_in_place', envvar='CALLBACK_EDIT_IN_PLACE', is_flag=True, default=False,
+              help='Навигация по кнопкам редактирует сообщение вместо отправки нового')
+@click.option('--metrics_host', envvar='METRICS_HOST', type=str, default='127.0.0.1',
+              help='Адрес сервера метрик Prometheus')
+@click.option('--metrics_port', envvar='METRICS_PORT', type=int, default=None,
+              help='Порт сервера метрик Prometheus /metrics (по умолчанию выключен)')
+@click.option('--profile_startup', envvar='PROFILE_STARTUP', is_flag=True, default=False,
+              help='Логировать время этапов запуска')
 @click.option('--telegram_bot_proxy', envvar='TELEGRAM_BOT_PROXY', type=str, default=None, help='Telegram Proxy')
 @click.argument('telegram_bot_token', envvar='TELEGRAM_BOT_TOKEN', type=str)
 @click.argument('pg_connection', envvar='PG_CONNECTION', type=str)
@@ -35,35 +138,107 @@ def main(
     docker: bool,
     debug: bool,
     develop: bool,
+    pg_pool_min_size: int,
+    pg_pool_max_size: int,
+    pg_statement_cache_size: int,
+    pg_max_inactive_connection_lifetime: float,
+    pg_command_timeout: float,
+    redis_pool_min_size: int,
+    redis_pool_max_size: int,
+    redis_connect_timeout: float,
+    redis_keepalive: int,
+    redis_unix_socket: str,
+    prices_url: str,
+    prices_sync_interval: float,
+    query_trace_sample_rate: float,
+    query_stats_sample_rate: float,
+    mode: str,
+    webhook_url: str,
+    webhook_host: str,
+    webhook_port: int,
+    webhook_path: str,
+    webhook_secret: str,
+    update_workers: int,
+    update_queue_size: int,
+    workers: int,
+    stream_partitions: int,
+    order_notification_role: str,
+    order_draft_ttl: int,
+    reminder_lead: int,
+    inline_cache_time: int,
+    callback_edit_in_place: bool,
+    metrics_host: str,
+    metrics_port: int,
+    profile_startup: bool,
     telegram_bot_proxy: str,
     telegram_bot_token: str,
     pg_connection: str,
     redis_connection: str
 ):
+    if mode == 'webhook' and not webhook_url:
+        raise click.BadParameter('webhook mode requires --webhook_url', param_hint='--webhook_url')
+    if mode == 'webhook' and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', webhook_secret or ''):
+        raise click.BadParameter('webhook mode requires 1-256 characters A-Z, a-z, 0-9, _ and -',
+                                 param_hint='--webhook_secret')
+    if workers > stream_partitions:
+        raise click.BadParameter('must not exceed --stream_partitions', param_hint='--workers')
+
     config = Config(
         pg_connection=pg_connection,
         redis_connection=redis_connection,
         telegram_bot_service_config=TelegramBotServiceConfig(
-            app_name=app_name,
+            app_name=poetry_info()['name'],
             token=telegram_bot_token,
-            proxy=telegram_bot_proxy
+            proxy=telegram_bot_proxy,
+            mode=mode,
+            webhook_url=webhook_url,
+            webhook_host=webhook_host,
+            webhook_port=webhook_port,
+            webhook_path=webhook_path,
+            webhook_secret=webhook_secret,
+            update_workers=update_workers,
+            update_queue_size=update_queue_size,
+            role='ingress' if workers else 'all',
+            workers=workers,
+            stream_partitions=stream_partitions,
+            callback_edit_in_place=callback_edit_in_place,
+            inline_cache_time=inline_cache_time,
+            order_notification_role=order_notification_role,
+            order_draft_ttl=order_draft_ttl,
+            reminder_lead=reminder_lead,
+            metrics_host=metrics_host,
+            metrics_port=metrics_port
         ),
         logging_params=logging_params(debug),
         develop=develop,
         debug=debug,
         docker=docker,
-        environment=environment
+        environment=environment,
+        pg_pool_min_size=pg_pool_min_size,
+        pg_pool_max_size=pg_pool_max_size,
+        pg_statement_cache_size=pg_statement_cache_size,
+        pg_max_inactive_connection_lifetime=pg_max_inactive_connection_lifetime,
+        pg_command_timeout=pg_command_timeout,
+        redis_pool_min_size=redis_pool_min_size,
+        redis_pool_max_size=redis_pool_max_size,
+        redis_connect_timeout=redis_connect_timeout,
+        redis_keepalive=redis_keepalive or None,
+        redis_unix_socket=redis_unix_socket,
+        prices_url=prices_url,
+        prices_sync_interval=prices_sync_interval,
+        query_trace_sample_rate=query_trace_sample_rate,
+        query_stats_sample_rate=query_stats_sample_rate,
+        profile_startup=profile_startup
     )
 
-    logging.config.dictConfig(config.logging_params)
-
-    loop = asyncio.get_event_loop()
-    loop.set_exception_handler(exception_handler)
-    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
-        loop.add_signal_handler(sig, stop_loop, loop)
-
-    loop.create_task(app.main(config, loop))
-    loop.run_forever()
+    processes = start_workers(config)
+    try:
+        run(config, asyncio.get_event_loop())
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 
 if __name__ == '__main__':
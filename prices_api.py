@@ -1,18 +1,241 @@
-import requests
-
-from database import Item, Order, User
-
-response = requests.get('http://194.67.110.125:8080/prices')
-if response == 200:
-    future_db = response.json()
-    counter = 0
-    for item in future_db:
-        item_time_quantity = future_db[counter]['timeEntity']['time']
-        item_time_description = future_db[counter]['timeEntity']['name']
-        item_price = future_db[counter]['value']
-        item_category = future_db[counter]['categoryEntity']['name']
-        item_subcategory = future_db[counter]['subCategoryEntity']['name']
-        item = future_db[counter]['subCategoryEntity']['categories']['name']
-        new_item =
-        counter += 0
+import asyncio
+import codecs
+import hashlib
+import json
+import logging
+import time
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
 
+import aiohttp
+import click
+
+from database import Category, Item, SubCategory, db
+
+
+logger = logging.getLogger('prices_api')
+
+default_prices_url = 'http://194.67.110.125:8080/prices'
+
+CENT = Decimal('0.01')
+
+_json_whitespace = ' \t\n\r'
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    started = finished = False
+    async for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        position = 0
+        while not finished:
+            while position < len(buffer) and buffer[position] in _json_whitespace + ',':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Price feed is not a JSON array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                finished = True
+                break
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            # A number cut by a chunk boundary decodes as well, so a value only counts once its delimiter arrived
+            delimiter = end
+            while delimiter < len(buffer) and buffer[delimiter] in _json_whitespace:
+                delimiter += 1
+            if delimiter == len(buffer) or buffer[delimiter] not in ',]':
+                break
+            position = end
+            yield value
+        buffer = buffer[position:]
+    if not finished:
+        raise ValueError('Price feed ended unexpectedly')
+
+
+class FeedItem(NamedTuple):
+    data: str
+    name: str
+    price: Decimal
+    rental_time: Optional[int]
+    rental_unit: str
+    category: str
+    subcategory: str
+
+    @property
+    def content_hash(self) -> bytes:
+        return content_hash(*self[1:])
+
+
+def feed_item(entry: Dict) -> FeedItem:
+    time_quantity = entry['timeEntity']['time']
+    time_description = entry['timeEntity']['name']
+    category = entry['categoryEntity']['name']
+    subcategory = entry['subCategoryEntity']['name']
+    item_name = entry['subCategoryEntity']['categories']['name']
+    key = '\x1f'.join(str(part) for part in (category, subcategory, item_name, time_quantity, time_description))
+    return FeedItem(
+        data=hashlib.blake2b(key.encode(), digest_size=8).hexdigest(),
+        name=item_name,
+        price=Decimal(str(entry['value'])).quantize(CENT),
+        rental_time=int(time_quantity) if time_quantity is not None else None,
+        rental_unit=time_description or '',
+        category=category,
+        subcategory=subcategory
+    )
+
+
+def content_hash(*fields) -> bytes:
+    return hashlib.blake2b('\x1f'.join(str(field) for field in fields).encode(), digest_size=8).digest()
+
+
+def current_items_query():
+    return db.select([
+        Item.data, Item.name, Item.price, Item.rental_time, Item.rental_unit,
+        Category.name.label('category'), SubCategory.name.label('subcategory')
+    ]).select_from(
+        Item.outerjoin(Category, Category.id == Item.category_id).outerjoin(
+            SubCategory, SubCategory.id == Item.subcategory_id
+        )
+    )
+
+
+class PriceFeed:
+    def __init__(
+        self,
+        url: str = default_prices_url,
+        interval: float = 3600,
+        timeout: float = 60,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.loop = loop or asyncio.get_event_loop()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self.run_periodically())
+
+    async def close(self):
+        # A sync cancelled inside the upsert transaction is rolled back
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def fetch(self) -> Dict[str, FeedItem]:
+        items = {}
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self.url) as response:
+                response.raise_for_status()
+                async for entry in iter_json_array(response.content.iter_chunked(64 * 1024)):
+                    try:
+                        item = feed_item(entry)
+                    except (KeyError, TypeError, ValueError, ArithmeticError):
+                        logger.warning('Skip malformed price entry %r', entry)
+                        continue
+                    items[item.data] = item
+        return items
+
+    async def sync(self) -> Dict[str, int]:
+        started = time.perf_counter()
+        feed = await self.fetch()
+        current = {
+            row.data: content_hash(row.name, row.price, row.rental_time, row.rental_unit, row.category, row.subcategory)
+            for row in await current_items_query().gino.all()
+        }
+        changed = [item for item in feed.values() if current.get(item.data) != item.content_hash]
+        # An empty feed is an upstream failure rather than a sold out catalog, nothing is removed then
+        removed = [data for data in current if data not in feed] if feed else []
+        if changed or removed:
+            await self._upsert(changed, removed)
+        stats = {
+            'feed': len(feed),
+            'changed': len(changed),
+            'removed': len(removed),
+            'elapsed_ms': int((time.perf_counter() - started) * 1000)
+        }
+        logger.info('Prices synced: %s', stats)
+        return stats
+
+    async def run_periodically(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Prices sync failed')
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    async def _upsert(items: List[FeedItem], removed: List[str]):
+        """Writes the new and changed items and deletes the ones gone from the feed in one transaction.
+
+        Orders keep the item name, not a reference, so deleted items do not affect them.
+        """
+        async with db.transaction() as transaction:
+            raw_connection = transaction.connection.raw_connection
+            if removed:
+                await raw_connection.execute('DELETE FROM items WHERE data = ANY($1::varchar[])', removed)
+            if not items:
+                return
+            await raw_connection.execute("""
+                CREATE TEMP TABLE items_feed (
+                    data varchar, name varchar, price numeric(12, 2), rental_time integer, rental_unit varchar,
+                    category varchar, subcategory varchar
+                ) ON COMMIT DROP
+            """)
+            await raw_connection.copy_records_to_table('items_feed', records=items, columns=FeedItem._fields)
+            await raw_connection.execute("""
+                INSERT INTO categories (name)
+                SELECT DISTINCT category FROM items_feed
+                ON CONFLICT (name) DO NOTHING
+            """)
+            await raw_connection.execute("""
+                INSERT INTO subcategories (category_id, name)
+                SELECT DISTINCT c.id, f.subcategory FROM items_feed f JOIN categories c ON c.name = f.category
+                ON CONFLICT (category_id, name) DO NOTHING
+            """)
+            await raw_connection.execute("""
+                INSERT INTO items (data, name, price, rental_time, rental_unit, category_id, subcategory_id)
+                SELECT f.data, f.name, f.price, f.rental_time, f.rental_unit, c.id, s.id
+                FROM items_feed f
+                JOIN categories c ON c.name = f.category
+                JOIN subcategories s ON s.category_id = c.id AND s.name = f.subcategory
+                ON CONFLICT (data) DO UPDATE
+                SET name = EXCLUDED.name, price = EXCLUDED.price, rental_time = EXCLUDED.rental_time,
+                    rental_unit = EXCLUDED.rental_unit, category_id = EXCLUDED.category_id,
+                    subcategory_id = EXCLUDED.subcategory_id, update_datetime = now()
+            """)
+
+
+@click.command()
+@click.option('--prices_url', envvar='PRICES_URL', type=str, default=default_prices_url, help='Prices API URL')
+@click.argument('pg_connection', envvar='PG_CONNECTION', type=str)
+def main(prices_url: str, pg_connection: str):
+    logging.basicConfig(level=logging.INFO)
+
+    async def sync_once():
+        await db.set_bind(pg_connection)
+        try:
+            await PriceFeed(prices_url).sync()
+        finally:
+            await db.pop_bind().close()
+
+    asyncio.get_event_loop().run_until_complete(sync_once())
+
+
+if __name__ == '__main__':
+    main()
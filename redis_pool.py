@@ -0,0 +1,137 @@
+import asyncio
+import socket
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Deque, Dict, Optional
+
+import aioredis
+from aioredis.pool import ConnectionsPool
+from aioredis.util import parse_url
+
+
+def _percentile(values: Deque[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class CommandScope:
+    """Counts the commands of one unit of work, e.g. a bot update, set through ``current_command_scope``."""
+
+    __slots__ = ('commands', 'time')
+
+    def __init__(self):
+        self.commands = 0
+        self.time = 0.0
+
+
+current_command_scope: ContextVar[Optional[CommandScope]] = ContextVar('current_command_scope', default=None)
+
+
+class RedisPool(ConnectionsPool):
+    """aioredis pool with TCP keepalive and usage stats.
+
+    Plain commands are multiplexed over free connections; blocking commands and pipelines acquire a
+    connection exclusively, so ``waiting`` and acquire latency show when the pool is too small.
+    """
+
+    def __init__(self, *args, keepalive: Optional[int] = 60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keepalive = keepalive
+        self.commands = 0
+        self.acquired = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self._command_latencies: Deque[float] = deque(maxlen=1024)
+        self._acquire_latencies: Deque[float] = deque(maxlen=1024)
+
+    def execute(self, command, *args, **kwargs):
+        started = time.monotonic()
+        self.commands += 1
+        future = asyncio.ensure_future(super().execute(command, *args, **kwargs))
+        future.add_done_callback(partial(self._command_done, current_command_scope.get(), started))
+        return future
+
+    def _command_done(self, scope: Optional[CommandScope], started: float, _):
+        elapsed = time.monotonic() - started
+        self._command_latencies.append(elapsed)
+        if scope is not None:
+            scope.commands += 1
+            scope.time += elapsed
+
+    async def acquire(self, command=None, args=()):
+        started = time.monotonic()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            conn = await super().acquire(command, args)
+        finally:
+            self.waiting -= 1
+        self.acquired += 1
+        self._acquire_latencies.append(time.monotonic() - started)
+        return conn
+
+    async def _create_new_connection(self, address):
+        conn = await super()._create_new_connection(address)
+        sock = conn._writer.transport.get_extra_info('socket')
+        if self.keepalive and sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, self.keepalive // 3))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        return conn
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': self.size,
+            'free': self.freesize,
+            'max_size': self.maxsize,
+            'commands': self.commands,
+            'acquired': self.acquired,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'command_p50': _percentile(self._command_latencies, 0.5),
+            'command_p99': _percentile(self._command_latencies, 0.99),
+            'acquire_p50': _percentile(self._acquire_latencies, 0.5),
+            'acquire_p99': _percentile(self._acquire_latencies, 0.99)
+        }
+
+
+async def create_redis(
+    url: str,
+    min_size: int = 1,
+    max_size: int = 10,
+    connect_timeout: Optional[float] = 5.0,
+    keepalive: Optional[int] = 60,
+    unix_socket: Optional[str] = None
+) -> aioredis.Redis:
+    """Creates the shared Redis client from a redis://, rediss:// or unix:// URL.
+
+    ``unix_socket`` replaces the host and port of the URL while keeping its db and password.
+    """
+    address, options = parse_url(url)
+    pool = RedisPool(
+        unix_socket or address,
+        options.get('db'),
+        options.get('password'),
+        options.get('encoding'),
+        minsize=min_size,
+        maxsize=max_size,
+        ssl=options.get('ssl'),
+        create_connection_timeout=options.get('timeout', connect_timeout),
+        keepalive=keepalive
+    )
+    try:
+        await pool._fill_free(override_min=False)
+    except Exception:
+        pool.close()
+        await pool.wait_closed()
+        raise
+    return aioredis.Redis(pool)
+
+
+async def close_redis(redis: aioredis.Redis):
+    redis.close()
+    await redis.wait_closed()
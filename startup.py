@@ -0,0 +1,26 @@
+import logging
+import time
+from typing import List, Tuple
+
+
+# Taken when main.py starts importing, so the first phase covers all module imports
+process_started = time.perf_counter()
+
+
+class StartupProfile:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.phases: List[Tuple[str, float]] = []
+        self._last = process_started
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+        if self.enabled:
+            logging.info('Startup phase %s took %.3fs', phase, self.phases[-1][1])
+
+    def report(self):
+        if self.enabled:
+            logging.info('Startup took %.3fs: %s', self._last - process_started,
+                         ', '.join(f'{phase} {duration:.3f}s' for phase, duration in self.phases))
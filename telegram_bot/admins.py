@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.utils.exceptions import BadRequest, Unauthorized
+
+from database import Admin, ChangeListener, NotificationDelivery
+
+from .identity import IDENTITIES_CHANNEL
+from .outbound import NOTIFICATION, OutboundDispatcher
+
+
+logger = logging.getLogger('telegram_bot_service.admins')
+
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class AdminRoster:
+    """In-memory list of admins, reloaded lazily after the admins table changes."""
+
+    def __init__(self, change_listener: Optional[ChangeListener] = None):
+        self._admins: Optional[Tuple[Admin, ...]] = None
+        self._lock = asyncio.Lock()
+        self.invalidations = 0
+        if change_listener is not None:
+            # The channel also carries user changes, reloading a handful of admins for them is cheap
+            change_listener.subscribe(IDENTITIES_CHANNEL, self._on_identities_changed)
+
+    async def admins(self, role: Optional[str] = None) -> Tuple[Admin, ...]:
+        admins = self._admins
+        if admins is None:
+            async with self._lock:
+                if self._admins is None:
+                    invalidations = self.invalidations
+                    admins = tuple(await Admin.query.order_by(Admin.create_datetime).gino.all())
+                    if invalidations == self.invalidations:
+                        self._admins = admins
+                else:
+                    admins = self._admins
+        return admins if role is None else tuple(admin for admin in admins if admin.role == role)
+
+    def invalidate(self):
+        self.invalidations += 1
+        self._admins = None
+
+    def _on_identities_changed(self, payload: Optional[str]):
+        self.invalidate()
+
+
+class AdminNotifier:
+    """Fans a notification out to all admins at once.
+
+    Every recipient is retried on its own, so one unreachable admin neither delays nor fails the others;
+    the outcome per recipient is written to ``notification_deliveries``. The retries here are the only ones,
+    the outbox is asked not to retry network errors itself.
+    """
+
+    def __init__(
+        self,
+        outbox: OutboundDispatcher,
+        roster: AdminRoster,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._outbox = outbox
+        self._roster = roster
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._tasks: Set[asyncio.Task] = set()
+        self.sent = 0
+        self.failed = 0
+
+    def notify(self, text: str, role: Optional[str] = None, order_id: Optional[str] = None) -> asyncio.Task:
+        task = self.loop.create_task(self._notify(text, role, order_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {'sent': self.sent, 'failed': self.failed}
+
+    async def _notify(self, text: str, role: Optional[str], order_id: Optional[str]) -> List[Dict]:
+        admins = await self._roster.admins(role)
+        if not admins:
+            logger.warning('No admins with role %s to notify', role)
+            return []
+        deliveries = await asyncio.gather(*(self._deliver(admin.telegram_id, text) for admin in admins))
+        for delivery in deliveries:
+            delivery['order_id'] = order_id
+        try:
+            await NotificationDelivery.insert().gino.status(*deliveries)
+        except Exception:
+            logger.exception('Notification delivery log write failed')
+        return deliveries
+
+    async def _deliver(self, telegram_id: str, text: str) -> Dict:
+        error = None
+        for attempt in range(1, self._max_retries + 1):
+            try:
+                await self._outbox.send_message(int(telegram_id), text, priority=NOTIFICATION, max_retries=0)
+            except (BadRequest, Unauthorized) as permanent:
+                # Chat not found, bot blocked and the like will not be fixed by a retry
+                error = permanent
+                break
+            except Exception as transient:
+                error = transient
+                if attempt < self._max_retries:
+                    await asyncio.sleep(self._retry_delay * 2 ** (attempt - 1))
+            else:
+                self.sent += 1
+                logger.info('Notification delivered to admin %s in %s attempts', telegram_id, attempt)
+                return {'telegram_id': telegram_id, 'status': SENT, 'attempts': attempt, 'error': None}
+        self.failed += 1
+        logger.warning('Notification to admin %s failed after %s attempts: %r', telegram_id, attempt, error)
+        return {'telegram_id': telegram_id, 'status': FAILED, 'attempts': attempt, 'error': repr(error)}
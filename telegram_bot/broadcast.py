@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional
+
+from aiogram import Bot
+from aioredis import ReplyError
+
+from database import User, db
+
+from .outbound import BULK, OutboundDispatcher
+
+
+logger = logging.getLogger('telegram_bot_service.broadcast')
+
+RUNNING = 'running'
+DONE = 'done'
+STOPPED = 'stopped'
+
+# Extends the lock ARGV[2] seconds if it still holds the token ARGV[1] of this run
+REFRESH_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+# Deletes the lock and the active job pointer KEYS[2] if the lock still holds the token ARGV[1] of this run
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[2])
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+SCRIPT_SHAS = {
+    script: hashlib.sha1(script.encode()).hexdigest() for script in (REFRESH_LOCK_SCRIPT, RELEASE_LOCK_SCRIPT)
+}
+
+
+class LockLost(Exception):
+    pass
+
+
+def recipients_query(after_id: Optional[str] = None):
+    query = db.select([User.id, User.telegram_id]).where(User.telegram_id.isnot(None))
+    if after_id:
+        query = query.where(User.id > after_id)
+    return query.order_by(User.id)
+
+
+def progress_text(job: Dict[str, str]) -> str:
+    sent, failed, total = int(job['sent']), int(job['failed']), int(job['total'])
+    done = sent + failed
+    elapsed = max(time.time() - float(job['started']), 1e-6)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate else 0
+    status = {RUNNING: 'идет', DONE: 'завершена', STOPPED: 'остановлена'}[job['status']]
+    return (f'Рассылка {status}: {done} из {total}\n'
+            f'Доставлено: {sent}, ошибок: {failed}\n'
+            f'Скорость: {rate:.1f} сообщ./с, осталось ~{int(eta // 60)} мин {int(eta % 60)} с')
+
+
+class Broadcaster:
+    """Sends a message to every registered user as a resumable background job.
+
+    Users are streamed in ``id`` order through a server-side cursor, which is reopened from the last
+    checkpoint every ``cursor_lifetime`` seconds so no transaction stays open for the whole broadcast.
+    After each batch is delivered the last sent ``id`` and the counters are checkpointed in Redis; a job
+    interrupted by a crash or restart continues from there and re-sends at most one batch.
+
+    The lock holds a token of the run that took it and is only extended or released by that run. A run that
+    stalled past ``lock_ttl`` and finds another token at its next checkpoint stops without writing.
+    """
+
+    def __init__(
+        self,
+        redis,
+        bot: Bot,
+        outbox: OutboundDispatcher,
+        key_prefix: str = 'broadcast',
+        batch_size: int = 100,
+        cursor_lifetime: float = 60,
+        progress_interval: float = 10,
+        lock_ttl: int = 120,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._redis = redis
+        self._bot = bot
+        self._outbox = outbox
+        self._key_prefix = key_prefix
+        self._batch_size = batch_size
+        self._cursor_lifetime = cursor_lifetime
+        self._progress_interval = progress_interval
+        self._lock_ttl = lock_ttl
+        self._token: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, text: str, admin_chat_id: int) -> Optional[str]:
+        if self.running or not await self._lock():
+            return None
+        job_id = uuid.uuid4().hex
+        total = await db.select([db.func.count()]).select_from(User).where(User.telegram_id.isnot(None)).gino.scalar()
+        progress = await self._outbox.send_message(admin_chat_id, 'Рассылка запускается...')
+        job = {
+            'text': text,
+            'admin_chat_id': str(admin_chat_id),
+            'progress_message_id': str(progress.message_id),
+            'last_id': '',
+            'sent': '0',
+            'failed': '0',
+            'total': str(total),
+            'started': str(time.time()),
+            'status': RUNNING
+        }
+        await self._redis.hmset_dict(self._job_key(job_id), job)
+        await self._redis.set(self._active_key, job_id)
+        self._task = self.loop.create_task(self._run(job_id, job))
+        return job_id
+
+    async def resume(self):
+        """Continues an interrupted broadcast.
+
+        While another process holds the lock, including this one before a restart within ``lock_ttl``, the
+        lock is retried in the background until it is free or the job has ended.
+        """
+        if not await self._try_resume():
+            self._task = self.loop.create_task(self._resume_later())
+
+    async def _try_resume(self) -> bool:
+        job_id = await self._redis.get(self._active_key, encoding='utf-8')
+        if job_id is None:
+            return True
+        if not await self._lock():
+            return False
+        job = await self._redis.hgetall(self._job_key(job_id), encoding='utf-8')
+        if job.get('status') != RUNNING:
+            await self._finish(job_id)
+            return True
+        logger.info('Resuming broadcast %s after %s', job_id, job['last_id'] or 'start')
+        self._task = self.loop.create_task(self._run(job_id, job))
+        return True
+
+    async def _resume_later(self):
+        while True:
+            await asyncio.sleep(self._lock_ttl / 4)
+            try:
+                if await self._try_resume():
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Broadcast resume failed')
+
+    async def stop(self) -> bool:
+        job_id = await self._redis.get(self._active_key, encoding='utf-8')
+        if job_id is None:
+            return False
+        # The running job notices the status change at its next checkpoint, possibly in another process
+        await self._redis.hset(self._job_key(job_id), 'status', STOPPED)
+        return True
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @property
+    def _active_key(self) -> str:
+        return f'{self._key_prefix}:active'
+
+    @property
+    def _lock_key(self) -> str:
+        return f'{self._key_prefix}:lock'
+
+    def _job_key(self, job_id: str) -> str:
+        return f'{self._key_prefix}:{job_id}'
+
+    async def _lock(self) -> bool:
+        # Only one process runs a broadcast, the lock expires if that process dies
+        token = uuid.uuid4().hex
+        if not await self._redis.set(self._lock_key, token, expire=self._lock_ttl,
+                                     exist=self._redis.SET_IF_NOT_EXIST):
+            return False
+        self._token = token
+        return True
+
+    async def _refresh_lock(self):
+        if not await self._eval(REFRESH_LOCK_SCRIPT, [self._lock_key], [self._token, self._lock_ttl]):
+            raise LockLost()
+
+    async def _finish(self, job_id: str):
+        if not await self._eval(RELEASE_LOCK_SCRIPT, [self._lock_key, self._active_key], [self._token]):
+            raise LockLost()
+        await self._redis.expire(self._job_key(job_id), 7 * 24 * 3600)
+
+    async def _eval(self, script: str, keys: List[str], args: List):
+        try:
+            return await self._redis.evalsha(SCRIPT_SHAS[script], keys=keys, args=args)
+        except ReplyError as error:
+            if not str(error).startswith('NOSCRIPT'):
+                raise
+            return await self._redis.eval(script, keys=keys, args=args)
+
+    async def _run(self, job_id: str, job: Dict[str, str]):
+        reported = 0.0
+        try:
+            while job['status'] == RUNNING:
+                batches = 0
+                cursor = self._batches(job['last_id'])
+                try:
+                    async for batch in cursor:
+                        batches += 1
+                        await self._send(job, batch)
+                        await self._checkpoint(job_id, job)
+                        if job['status'] != RUNNING:
+                            break
+                        if time.monotonic() - reported >= self._progress_interval:
+                            reported = time.monotonic()
+                            self._report(job)
+                finally:
+                    # Ends the cursor transaction right away instead of when the generator is collected
+                    await cursor.aclose()
+                if not batches and job['status'] == RUNNING:
+                    await self._refresh_lock()
+                    job['status'] = DONE
+                    await self._redis.hset(self._job_key(job_id), 'status', DONE)
+            self._report(job)
+            logger.info('Broadcast %s %s: sent=%s failed=%s', job_id, job['status'], job['sent'], job['failed'])
+            await self._finish(job_id)
+        except asyncio.CancelledError:
+            raise
+        except LockLost:
+            logger.warning('Broadcast %s lock was taken over by another run, this one stops', job_id)
+        except Exception:
+            logger.exception('Broadcast %s failed, it is resumed on the next start', job_id)
+
+    async def _batches(self, after_id: str) -> AsyncIterator[List]:
+        started = time.monotonic()
+        async with db.transaction(readonly=True):
+            cursor = await recipients_query(after_id).gino.iterate()
+            while time.monotonic() - started < self._cursor_lifetime:
+                rows = await cursor.many(self._batch_size)
+                if not rows:
+                    return
+                yield rows
+
+    async def _send(self, job: Dict[str, str], batch: List):
+        results = await asyncio.gather(*(self._deliver(row.telegram_id, job['text']) for row in batch),
+                                       return_exceptions=True)
+        failed = sum(isinstance(result, Exception) for result in results)
+        job['sent'] = str(int(job['sent']) + len(results) - failed)
+        job['failed'] = str(int(job['failed']) + failed)
+        job['last_id'] = str(batch[-1].id)
+
+    async def _deliver(self, telegram_id: str, text: str):
+        return await self._outbox.send_message(int(telegram_id), text, priority=BULK)
+
+    async def _checkpoint(self, job_id: str, job: Dict[str, str]):
+        # A run whose lock expired must not overwrite the progress of the run that took over
+        await self._refresh_lock()
+        key = self._job_key(job_id)
+        pipeline = self._redis.pipeline()
+        pipeline.hmset_dict(key, {'last_id': job['last_id'], 'sent': job['sent'], 'failed': job['failed']})
+        pipeline.hget(key, 'status', encoding='utf-8')
+        _, status = await pipeline.execute()
+        job['status'] = status or STOPPED
+
+    def _report(self, job: Dict[str, str]):
+        chat_id = int(job['admin_chat_id'])
+        edit = partial(self._bot.edit_message_text, chat_id=chat_id, message_id=int(job['progress_message_id']))
+        self._outbox.call(chat_id, edit, progress_text(job), priority=BULK)
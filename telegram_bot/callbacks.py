@@ -0,0 +1,50 @@
+import asyncio
+from functools import partial
+from typing import Any, Awaitable, List, Optional
+
+from aiogram import Bot
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
+
+from .outbound import INTERACTIVE, OutboundDispatcher
+
+
+class CallbackResponder:
+    """Answers callback queries with as few sequential Bot API round trips as possible.
+
+    ``ack`` answers the query once and runs the handler's independent calls (DB queries, markup removal)
+    concurrently with it. ``reply`` either sends a new message through the outbox or, in edit in place
+    mode, replaces the message the button belongs to. Edits name the bot explicitly, outbox workers run
+    outside the update context where ``Message.edit_text`` finds its bot.
+    """
+
+    def __init__(self, bot: Bot, outbox: OutboundDispatcher, edit_in_place: bool = False):
+        self._bot = bot
+        self._outbox = outbox
+        self.edit_in_place = edit_in_place
+
+    async def ack(self, callback_query: CallbackQuery, *aws: Awaitable, cache_time: Optional[int] = None,
+                  close_markup: bool = True) -> List[Any]:
+        calls = [callback_query.answer(cache_time=cache_time)]
+        if close_markup and not self.edit_in_place and callback_query.message is not None:
+            calls.append(callback_query.message.edit_reply_markup(reply_markup=None))
+        results = await asyncio.gather(*calls, *aws)
+        return results[len(calls):]
+
+    def reply(self, callback_query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+              priority: int = INTERACTIVE) -> asyncio.Future:
+        if self.edit_in_place and callback_query.message is not None:
+            return self.edit(callback_query, text, reply_markup=reply_markup, priority=priority)
+        return self._outbox.send_message(callback_query.from_user.id, text, priority=priority,
+                                         reply_markup=reply_markup)
+
+    def edit(self, callback_query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+             priority: int = INTERACTIVE) -> asyncio.Future:
+        message = callback_query.message
+        edit = partial(self._bot.edit_message_text, chat_id=message.chat.id, message_id=message.message_id)
+        return self._outbox.call(message.chat.id, edit, text, reply_markup=reply_markup, priority=priority)
+
+    def edit_markup(self, callback_query: CallbackQuery, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                    priority: int = INTERACTIVE) -> asyncio.Future:
+        message = callback_query.message
+        edit = partial(self._bot.edit_message_reply_markup, chat_id=message.chat.id, message_id=message.message_id)
+        return self._outbox.call(message.chat.id, edit, reply_markup=reply_markup, priority=priority)
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from database import Category, ChangeListener, Item, SubCategory, db
+
+from .keyboard import catalog_item_data, catalog_level_data, get_kb_catalog_level
+
+
+logger = logging.getLogger('telegram_bot_service.catalog')
+
+ITEMS_CHANNEL = 'items_changed'
+OTHER = 'Другое'
+
+
+def other_last(name: str) -> Tuple[bool, str]:
+    # Items without a category or subcategory are grouped under OTHER at the end of the list
+    return name == OTHER, name
+
+
+class CatalogTree:
+    """Category → subcategory → item navigation over the items of one catalog snapshot.
+
+    Buttons address categories, subcategories and items by their position, so callback data stays a few
+    bytes long whatever the names are. The positions are only valid for the tree they were taken from,
+    which ``tag``, a hash of the tree contents, identifies in every process. Keyboards are built on the
+    first request of a page and shared until the snapshot is replaced; they must not be mutated.
+    """
+
+    def __init__(self, items: Sequence[Item], categories: Dict[str, str], subcategories: Dict[str, str],
+                 page_size: int = 8):
+        self.page_size = page_size
+        groups: Dict[str, Dict[str, List[int]]] = {}
+        for index, item in enumerate(items):
+            category = categories.get(str(item.category_id), OTHER)
+            subcategory = subcategories.get(str(item.subcategory_id), OTHER)
+            groups.setdefault(category, {}).setdefault(subcategory, []).append(index)
+        self.items = items
+        self.categories: List[Tuple[str, List[Tuple[str, List[int]]]]] = [
+            (category, [(subcategory, groups[category][subcategory])
+                        for subcategory in sorted(groups[category], key=other_last)])
+            for category in sorted(groups, key=other_last)
+        ]
+        digest = hashlib.blake2b(digest_size=4)
+        for category, subcategories_items in self.categories:
+            for subcategory, indexes in subcategories_items:
+                digest.update('\x1f'.join((category, subcategory, *(items[i].data for i in indexes))).encode())
+        self.tag = digest.hexdigest()
+        self._markups: Dict[Tuple[Optional[int], Optional[int], int], InlineKeyboardMarkup] = {}
+        self.hits = 0
+        self.builds = 0
+
+    def title(self, category: Optional[int] = None, subcategory: Optional[int] = None) -> str:
+        if category is None:
+            return 'Выберите категорию инвентаря:'
+        name, subcategories = self.categories[category]
+        if subcategory is None:
+            return f'{name}. Выберите подкатегорию:'
+        return f'{name} / {subcategories[subcategory][0]}. Выберите интересующий вас инвентарь:'
+
+    def locate(self, data: str) -> Optional[Tuple[str, str, str]]:
+        """Callback data of the category, subcategory and item buttons leading to the item ``data``."""
+        for category, (_, subcategories) in enumerate(self.categories):
+            for subcategory, (_, indexes) in enumerate(subcategories):
+                for index in indexes:
+                    if self.items[index].data == data:
+                        return (
+                            catalog_level_data(self.tag, category),
+                            catalog_level_data(self.tag, category, subcategory),
+                            catalog_item_data(self.tag, index)
+                        )
+        return None
+
+    async def markup(self, category: Optional[int] = None, subcategory: Optional[int] = None,
+                     page: int = 0) -> Optional[InlineKeyboardMarkup]:
+        """The keyboard of a level page, None for positions that are not in this tree."""
+        key = (category, subcategory, page)
+        markup = self._markups.get(key)
+        if markup is not None:
+            self.hits += 1
+            return markup
+        buttons = self._buttons(category, subcategory)
+        if buttons is None or page < 0 or (page and page * self.page_size >= len(buttons)):
+            return None
+        markup = await get_kb_catalog_level(buttons, page, self.page_size, self.tag, category, subcategory)
+        self._markups[key] = markup
+        self.builds += 1
+        return markup
+
+    def _buttons(self, category: Optional[int], subcategory: Optional[int]) -> Optional[List[Tuple[str, str]]]:
+        if category is None:
+            return [(name, catalog_level_data(self.tag, index)) for index, (name, _) in enumerate(self.categories)]
+        if not 0 <= category < len(self.categories):
+            return None
+        subcategories = self.categories[category][1]
+        if subcategory is None:
+            return [(name, catalog_level_data(self.tag, category, index))
+                    for index, (name, _) in enumerate(subcategories)]
+        if not 0 <= subcategory < len(subcategories):
+            return None
+        indexes = subcategories[subcategory][1]
+        return [(self.items[index].title, catalog_item_data(self.tag, index)) for index in indexes]
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    items: Tuple[Item, ...]
+    items_by_data: Dict[str, Item]
+    tree: CatalogTree
+
+
+class Catalog:
+    def __init__(self, change_listener: Optional[ChangeListener] = None, page_size: int = 8):
+        self.page_size = page_size
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.invalidations = 0
+        if change_listener is not None:
+            change_listener.subscribe(ITEMS_CHANNEL, self._on_items_changed)
+
+    async def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        self.misses += 1
+        async with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            invalidations = self.invalidations
+            snapshot = await self._build()
+            # Keep a snapshot only if the items did not change while it was being loaded
+            if invalidations == self.invalidations:
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        self.invalidations += 1
+        self._snapshot = None
+
+    def stats(self) -> Dict[str, int]:
+        snapshot = self._snapshot
+        return {
+            'version': self._version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rebuilds': self.rebuilds,
+            'invalidations': self.invalidations,
+            'keyboard_hits': snapshot.tree.hits if snapshot is not None else 0,
+            'keyboard_builds': snapshot.tree.builds if snapshot is not None else 0
+        }
+
+    async def _build(self) -> CatalogSnapshot:
+        items = tuple(await Item.query.order_by(Item.name, Item.price).gino.all())
+        categories = {str(row.id): row.name for row in await db.select([Category.id, Category.name]).gino.all()}
+        subcategories = {
+            str(row.id): row.name for row in await db.select([SubCategory.id, SubCategory.name]).gino.all()
+        }
+        self._version += 1
+        self.rebuilds += 1
+        logger.debug('Catalog rebuilt: %s items, %s', len(items), self.stats())
+        return CatalogSnapshot(
+            version=self._version,
+            items=items,
+            items_by_data={item.data: item for item in items},
+            tree=CatalogTree(items, categories, subcategories, self.page_size)
+        )
+
+    def _on_items_changed(self, payload: Optional[str]):
+        logger.debug('Items changed (%s), catalog invalidated', payload)
+        self.invalidate()
@@ -0,0 +1,216 @@
+import asyncio
+import copy
+import logging
+from typing import Callable, Dict, List, Optional, Union
+
+import msgpack
+from aiogram.dispatcher.storage import BaseStorage
+
+from .cache import LRUCache
+
+
+logger = logging.getLogger('telegram_bot_service.fsm_storage')
+
+ChatId = Union[str, int, None]
+TransitionListener = Callable[[Optional[str], Optional[str]], None]
+
+STATE = 's'
+DATA = 'd'
+BUCKET = 'b'
+
+
+class TieredRedisStorage(BaseStorage):
+    """FSM storage with an in-process L1 in front of Redis.
+
+    Every chat/user pair is one msgpack record (state, data and bucket) under a single key with a TTL, so
+    abandoned flows expire. Reads missing L1 are coalesced into one MGET per loop iteration; writes only
+    touch L1 and are flushed write-behind through a pipeline every ``flush_interval`` seconds and on close.
+
+    L1 is only correct while every chat is handled by a single process (``chat_affinity``), e.g. stream
+    workers owning their partitions. Without it records are not cached and writes go to Redis before the
+    handler continues; concurrent reads and writes are still coalesced into one MGET and one pipeline.
+    """
+
+    def __init__(
+        self,
+        redis,
+        prefix: str = 'fsm',
+        cache_size: int = 10000,
+        cache_ttl: float = 600,
+        state_ttl: int = 86400,
+        flush_interval: float = 0.05,
+        chat_affinity: bool = True,
+        transition_listener: Optional[TransitionListener] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._redis = redis
+        self._prefix = prefix
+        self._state_ttl = state_ttl
+        self._flush_interval = flush_interval
+        self._chat_affinity = chat_affinity
+        self._local: LRUCache[Dict] = LRUCache(cache_size, cache_ttl)
+        self._dirty: Dict[str, Dict] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._read_batch: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._transition_listener = transition_listener
+        self.redis_reads = 0
+        self.redis_flushes = 0
+
+    def key(self, chat: ChatId, user: ChatId) -> str:
+        return f'{self._prefix}:{chat}:{user}'
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._local.stats(), 'dirty': len(self._dirty), 'redis_reads': self.redis_reads,
+                'redis_flushes': self.redis_flushes}
+
+    async def get_state(self, *, chat: ChatId = None, user: ChatId = None,
+                        default: Optional[str] = None) -> Optional[str]:
+        record = await self._get(chat, user)
+        return record.get(STATE, default)
+
+    async def get_data(self, *, chat: ChatId = None, user: ChatId = None, default: Optional[Dict] = None) -> Dict:
+        record = await self._get(chat, user)
+        return copy.deepcopy(record.get(DATA, default or {}))
+
+    async def set_state(self, *, chat: ChatId = None, user: ChatId = None, state: Optional[str] = None):
+        record = await self._get(chat, user)
+        self._transition(record.get(STATE), state)
+        await self._put(chat, user, {**record, STATE: state})
+
+    async def set_data(self, *, chat: ChatId = None, user: ChatId = None, data: Dict = None):
+        record = await self._get(chat, user)
+        await self._put(chat, user, {**record, DATA: copy.deepcopy(data or {})})
+
+    async def update_data(self, *, chat: ChatId = None, user: ChatId = None, data: Dict = None, **kwargs):
+        record = await self._get(chat, user)
+        updated = copy.deepcopy(record.get(DATA, {}))
+        updated.update(data or {}, **kwargs)
+        await self._put(chat, user, {**record, DATA: updated})
+
+    async def reset_state(self, *, chat: ChatId = None, user: ChatId = None, with_data: Optional[bool] = True):
+        record = await self._get(chat, user)
+        self._transition(record.get(STATE), None)
+        await self._put(chat, user, {**record, STATE: None, **({DATA: {}} if with_data else {})})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: ChatId = None, user: ChatId = None, default: Optional[Dict] = None) -> Dict:
+        record = await self._get(chat, user)
+        return copy.deepcopy(record.get(BUCKET, default or {}))
+
+    async def set_bucket(self, *, chat: ChatId = None, user: ChatId = None, bucket: Dict = None):
+        record = await self._get(chat, user)
+        await self._put(chat, user, {**record, BUCKET: copy.deepcopy(bucket or {})})
+
+    async def update_bucket(self, *, chat: ChatId = None, user: ChatId = None, bucket: Dict = None, **kwargs):
+        record = await self._get(chat, user)
+        updated = copy.deepcopy(record.get(BUCKET, {}))
+        updated.update(bucket or {}, **kwargs)
+        await self._put(chat, user, {**record, BUCKET: updated})
+
+    async def reset_bucket(self, *, chat: ChatId = None, user: ChatId = None):
+        await self.set_bucket(chat=chat, user=user, bucket={})
+
+    async def flush(self):
+        # Pipelines may run on different pool connections, so flushes are serialized to keep writes ordered
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            pipeline = self._redis.pipeline()
+            for key, record in dirty.items():
+                if record:
+                    pipeline.set(key, msgpack.packb(record, use_bin_type=True), expire=self._state_ttl)
+                else:
+                    pipeline.delete(key)
+            try:
+                await pipeline.execute()
+                self.redis_flushes += 1
+            except Exception:
+                # Records written again meanwhile are newer than the failed ones
+                for key, record in dirty.items():
+                    self._dirty.setdefault(key, record)
+                raise
+
+    def _transition(self, previous: Optional[str], state: Optional[str]):
+        if self._transition_listener is not None and previous != state:
+            self._transition_listener(previous, state)
+
+    async def _get(self, chat: ChatId, user: ChatId) -> Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        key = self.key(chat, user)
+        record = self._dirty.get(key)
+        if record is None and self._chat_affinity:
+            record = self._local.get(key)
+        if record is None:
+            record = await self._load(key)
+        return record
+
+    async def _put(self, chat: ChatId, user: ChatId, record: Dict):
+        chat, user = self.check_address(chat=chat, user=user)
+        key = self.key(chat, user)
+        # Records without state, data and bucket are deleted from Redis instead of stored
+        record = {field: value for field, value in record.items() if value}
+        self._dirty[key] = record
+        if not self._chat_affinity:
+            await self.flush()
+            return
+        self._local.set(key, record)
+        if self._flush_task is None:
+            self._flush_task = self.loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self._flush_interval)
+        finally:
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('FSM storage flush failed, %s records kept for the next one', len(self._dirty))
+            if self._flush_task is None:
+                self._flush_task = self.loop.create_task(self._flush_later())
+
+    def _load(self, key: str) -> asyncio.Future:
+        future = self._loading.get(key)
+        if future is None:
+            future = self._loading[key] = self.loop.create_future()
+            if not self._read_batch:
+                # The task runs on the next loop iteration and picks up every key requested until then
+                self.loop.create_task(self._read())
+            self._read_batch.append(key)
+        return future
+
+    async def _read(self):
+        keys, self._read_batch = self._read_batch, []
+        try:
+            values = await self._redis.mget(*keys)
+            self.redis_reads += 1
+        except Exception as error:
+            for key in keys:
+                self._loading.pop(key).set_exception(error)
+            return
+        for key, value in zip(keys, values):
+            future = self._loading.pop(key)
+            # A write that happened while the read was in flight wins over the stored record
+            record = self._dirty.get(key)
+            if record is None and self._chat_affinity:
+                record = self._local.get(key)
+            if record is None:
+                record = msgpack.unpackb(value, raw=False) if value is not None else {}
+                if self._chat_affinity:
+                    self._local.set(key, record)
+            future.set_result(record)
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+import msgpack
+from sqlalchemy import literal
+
+from database import Admin, ChangeListener, User, db
+
+from .cache import LRUCache
+
+
+logger = logging.getLogger('telegram_bot_service.identity')
+
+IDENTITIES_CHANNEL = 'identities_changed'
+ROLE_ADMIN = 'admin'
+ROLE_USER = 'user'
+
+
+@dataclass(frozen=True)
+class Identity:
+    telegram_id: str
+    admin_name: Optional[str] = None
+    user_name: Optional[str] = None
+    phone_number: Optional[str] = None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.admin_name is not None
+
+    @property
+    def is_user(self) -> bool:
+        return self.user_name is not None
+
+
+def identity_query(telegram_id: str):
+    admins = db.select([
+        literal(ROLE_ADMIN).label('role'),
+        Admin.name.label('name'),
+        literal('').label('phone_number')
+    ]).where(Admin.telegram_id == telegram_id)
+    users = db.select([
+        literal(ROLE_USER).label('role'),
+        User.name.label('name'),
+        User.phone_number.label('phone_number')
+    ]).where(User.telegram_id == telegram_id)
+    return admins.union_all(users)
+
+
+class IdentityResolver:
+    """Resolves chats to admins and users through an in-process LRU, Redis and the database.
+
+    Changes are announced on ``identities_changed`` and drop the affected entries from both caches. When the
+    listener (re)connects, notifications may have been missed, so the LRU is cleared and the Redis entries
+    are abandoned by moving to the next key version, a counter shared in Redis.
+    """
+
+    def __init__(
+        self,
+        redis=None,
+        key_prefix: str = 'identity',
+        cache_size: int = 10000,
+        cache_ttl: float = 300,
+        change_listener: Optional[ChangeListener] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._redis = redis
+        self._key_prefix = key_prefix
+        self._cache_ttl = cache_ttl
+        self._local: LRUCache[Identity] = LRUCache(cache_size, cache_ttl)
+        self._version: Optional[asyncio.Task] = None
+        self._bump_version = False
+        self.redis_hits = 0
+        self.db_queries = 0
+        if change_listener is not None:
+            change_listener.subscribe(IDENTITIES_CHANNEL, self._on_identities_changed)
+
+    async def resolve(self, telegram_id: Union[int, str]) -> Identity:
+        telegram_id = str(telegram_id)
+        identity = self._local.get(telegram_id)
+        if identity is not None:
+            return identity
+
+        identity = await self._redis_get(telegram_id)
+        if identity is not None:
+            self.redis_hits += 1
+            self._local.set(telegram_id, identity)
+            return identity
+
+        self.db_queries += 1
+        identity = Identity(telegram_id=telegram_id)
+        for row in await identity_query(telegram_id).gino.all():
+            if row.role == ROLE_ADMIN and identity.admin_name is None:
+                identity = Identity(telegram_id, row.name, identity.user_name, identity.phone_number)
+            elif row.role == ROLE_USER and identity.user_name is None:
+                identity = Identity(telegram_id, identity.admin_name, row.name, row.phone_number)
+        await self.store(identity)
+        return identity
+
+    async def store(self, identity: Identity):
+        self._local.set(identity.telegram_id, identity)
+        if self._redis is None:
+            return
+        value = msgpack.packb([identity.admin_name, identity.user_name, identity.phone_number])
+        try:
+            await self._redis.set(await self._key(identity.telegram_id), value, expire=int(self._cache_ttl))
+        except Exception:
+            logger.exception('Identity cache write failed')
+
+    async def invalidate(self, telegram_id: Union[int, str]):
+        telegram_id = str(telegram_id)
+        self._local.pop(telegram_id)
+        if self._redis is None:
+            return
+        try:
+            await self._redis.delete(await self._key(telegram_id))
+        except Exception:
+            logger.exception('Identity cache invalidation failed')
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._local.stats(), 'redis_hits': self.redis_hits, 'db_queries': self.db_queries}
+
+    async def _key(self, telegram_id: str) -> str:
+        if self._version is None or self._version.done() and self._version.exception() is not None:
+            self._version = self.loop.create_task(self._load_version())
+        return f'{self._key_prefix}:{await self._version}:{telegram_id}'
+
+    async def _load_version(self) -> int:
+        version_key = f'{self._key_prefix}:version'
+        if not self._bump_version:
+            return int(await self._redis.get(version_key) or 0)
+        version = await self._redis.incr(version_key)
+        self._bump_version = False
+        return version
+
+    async def _redis_get(self, telegram_id: str) -> Optional[Identity]:
+        if self._redis is None:
+            return None
+        try:
+            value = await self._redis.get(await self._key(telegram_id))
+        except Exception:
+            logger.exception('Identity cache read failed')
+            return None
+        if value is None:
+            return None
+        admin_name, user_name, phone_number = msgpack.unpackb(value)
+        return Identity(telegram_id, admin_name, user_name, phone_number)
+
+    def _on_identities_changed(self, payload: Optional[str]):
+        if payload is None:
+            self._local.clear()
+            self._bump_version = True
+            self._version = None
+            return
+        self.loop.create_task(self.invalidate(payload))
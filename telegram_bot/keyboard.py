@@ -1,6 +1,25 @@
+from datetime import datetime, timedelta
+from typing import Optional, Sequence, Tuple
+from uuid import UUID
+
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import tuple_
+
+from database import Order, User, db
 
-from database import Item, Order, User
+
+EPOCH = datetime(1970, 1, 1)
+ORDERS_PAGE_PREFIX = 'orders'
+ORDER_PREFIX = 'order'
+ORDER_STATUS_PREFIX = 'status'
+ORDER_STATUSES = {'t': Order.IN_TREATMENT, 'p': Order.IN_PROGRESS, 'd': Order.DONE, 'c': Order.CANCELED}
+ORDER_STATUS_CODES = {status: code for code, status in ORDER_STATUSES.items()}
+ORDER_STATUS_FILTERS = (('t', 'Новые'), ('p', 'В процессе'), ('d', 'Сделано'), ('c', 'Отменено'))
+ORDER_STATUS_TITLES = {
+    Order.IN_TREATMENT: 'Новая', Order.IN_PROGRESS: 'В процессе', Order.DONE: 'Сделано', Order.CANCELED: 'Отменено'
+}
+CATALOG_PREFIX = 'cat'
+CATALOG_ITEM_PREFIX = 'itm'
 
 
 async def get_kb_menu_for_customer():
@@ -18,31 +37,155 @@ async def get_kb_menu_for_admin():
     return inline_kb_menu
 
 
-async def get_kb_orders_menu():
+def encode_orders_cursor(create_datetime: datetime, order_id: str) -> str:
+    return f'{(create_datetime - EPOCH) // timedelta(microseconds=1):x}:{UUID(str(order_id)).hex}'
+
+
+def decode_orders_cursor(cursor: str) -> Tuple[datetime, str]:
+    timestamp, order_id = cursor.split(':')
+    return EPOCH + timedelta(microseconds=int(timestamp, 16)), str(UUID(order_id))
+
+
+def order_details_query(order_id: str):
+    return db.select([
+        Order.id, Order.create_datetime, Order.ordered_item, Order.status, User.name.label('user_name'),
+        User.phone_number.label('phone_number')
+    ]).select_from(
+        Order.outerjoin(User, User.telegram_id == Order.telegram_id)
+    ).where(Order.id == order_id)
+
+
+def orders_page_query(status: str, cursor: Optional[str] = None, forward: bool = True, limit: int = 10):
+    query = db.select([
+        Order.id, Order.create_datetime, Order.ordered_item, User.name.label('user_name')
+    ]).select_from(
+        Order.outerjoin(User, User.telegram_id == Order.telegram_id)
+    ).where(Order.status == status)
+    if cursor is not None:
+        key = tuple_(*decode_orders_cursor(cursor))
+        query = query.where(tuple_(Order.create_datetime, Order.id) < key if forward else
+                            tuple_(Order.create_datetime, Order.id) > key)
+    if forward:
+        query = query.order_by(Order.create_datetime.desc(), Order.id.desc())
+    else:
+        query = query.order_by(Order.create_datetime.asc(), Order.id.asc())
+    return query.limit(limit)
+
+
+async def get_kb_orders_menu(
+    status: str = Order.IN_TREATMENT,
+    cursor: Optional[str] = None,
+    forward: bool = True,
+    page_size: int = 10
+):
+    rows = await orders_page_query(status, cursor, forward, page_size + 1).gino.all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+    has_next = has_more if forward else cursor is not None
+    has_prev = cursor is not None if forward else has_more
+
+    status_code = ORDER_STATUS_CODES[status]
     inline_kb = InlineKeyboardMarkup(row_width=1)
-    all_orders = await Order.query.gino.all()
-    for order in all_orders:
-        user_data = await User.query.where(User.telegram_id == order.telegram_id).gino.first()
-        user_name = user_data.name.split(' ')
-        user_nick = user_name[0]
-        inline_kb.add(InlineKeyboardButton(f'{user_nick}: {order.ordered_item}', callback_data=f'{order.id}'))
+    for order in rows:
+        user_nick = (order.user_name or '').split(' ')[0]
+        inline_kb.add(InlineKeyboardButton(
+            f'{user_nick}: {order.ordered_item}',
+            callback_data=f'{ORDER_PREFIX}:{status_code}:{UUID(str(order.id)).hex}'
+        ))
+
+    navigation = []
+    if rows and has_prev:
+        first = encode_orders_cursor(rows[0].create_datetime, rows[0].id)
+        navigation.append(InlineKeyboardButton('<<', callback_data=f'{ORDERS_PAGE_PREFIX}:{status_code}:p:{first}'))
+    if rows and has_next:
+        last = encode_orders_cursor(rows[-1].create_datetime, rows[-1].id)
+        navigation.append(InlineKeyboardButton('>>', callback_data=f'{ORDERS_PAGE_PREFIX}:{status_code}:n:{last}'))
+    if navigation:
+        inline_kb.row(*navigation)
+    inline_kb.row(*(
+        InlineKeyboardButton(title, callback_data=f'{ORDERS_PAGE_PREFIX}:{code}:n')
+        for code, title in ORDER_STATUS_FILTERS if code != status_code
+    ))
     return inline_kb
 
 
-async def get_kb_status_menu():
-    inline_btn_in_progress = InlineKeyboardButton('В процессе', callback_data='in_progress')
-    inline_btn_done = InlineKeyboardButton('Сделано', callback_data='done')
-    inline_btn_canceled = InlineKeyboardButton('Отменено', callback_data='canceled')
+def parse_orders_page(callback_data: str) -> Tuple[str, Optional[str], bool]:
+    _, status_code, direction, *cursor = callback_data.split(':', 3)
+    return ORDER_STATUSES[status_code], cursor[0] if cursor else None, direction == 'n'
+
+
+def parse_order(callback_data: str) -> Tuple[str, str]:
+    _, status_code, order_id = callback_data.split(':')
+    return ORDER_STATUSES[status_code], str(UUID(order_id))
+
+
+def parse_order_status(callback_data: str) -> Tuple[str, str, str]:
+    _, status_code, new_status_code, order_id = callback_data.split(':')
+    return ORDER_STATUSES[status_code], ORDER_STATUSES[new_status_code], str(UUID(order_id))
+
+
+async def get_kb_status_menu(order_id: str, status: str):
+    status_code = ORDER_STATUS_CODES[status]
+    order_hex = UUID(str(order_id)).hex
     inline_kb_menu = InlineKeyboardMarkup(row_width=1)
-    inline_kb_menu.add(inline_btn_in_progress, inline_btn_done, inline_btn_canceled)
+    for new_status in Order.TRANSITIONS.get(status, ()):
+        inline_kb_menu.add(InlineKeyboardButton(
+            ORDER_STATUS_TITLES[new_status],
+            callback_data=f'{ORDER_STATUS_PREFIX}:{status_code}:{ORDER_STATUS_CODES[new_status]}:{order_hex}'
+        ))
+    inline_kb_menu.add(InlineKeyboardButton('К списку заявок', callback_data=f'{ORDERS_PAGE_PREFIX}:{status_code}:n'))
     return inline_kb_menu
 
 
-async def get_kb_items_to_book():
+def catalog_level_data(tag: str, category: Optional[int] = None, subcategory: Optional[int] = None,
+                       page: int = 0) -> str:
+    path = ':'.join('' if index is None else str(index) for index in (category, subcategory))
+    return f'{CATALOG_PREFIX}:{tag}:{path}:{page}'
+
+
+def catalog_item_data(tag: str, item: int) -> str:
+    return f'{CATALOG_ITEM_PREFIX}:{tag}:{item}'
+
+
+def parse_catalog_level(callback_data: str) -> Tuple[str, Optional[int], Optional[int], int]:
+    _, tag, category, subcategory, page = callback_data.split(':')
+    return tag, int(category) if category else None, int(subcategory) if subcategory else None, int(page)
+
+
+def parse_catalog_item(callback_data: str) -> Tuple[str, int]:
+    _, tag, item = callback_data.split(':')
+    return tag, int(item)
+
+
+async def get_kb_catalog_level(
+    buttons: Sequence[Tuple[str, str]],
+    page: int,
+    page_size: int,
+    tag: str,
+    category: Optional[int] = None,
+    subcategory: Optional[int] = None
+):
     inline_kb = InlineKeyboardMarkup(row_width=1)
-    all_items = await Item.query.gino.all()
-    for item in all_items:
-        inline_kb.add(InlineKeyboardButton(f'{item.name}', callback_data=f'{item.data}'))
+    for title, callback_data in buttons[page * page_size:(page + 1) * page_size]:
+        inline_kb.add(InlineKeyboardButton(title, callback_data=callback_data))
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(
+            '<<', callback_data=catalog_level_data(tag, category, subcategory, page - 1)
+        ))
+    if (page + 1) * page_size < len(buttons):
+        navigation.append(InlineKeyboardButton(
+            '>>', callback_data=catalog_level_data(tag, category, subcategory, page + 1)
+        ))
+    if navigation:
+        inline_kb.row(*navigation)
+    if subcategory is not None:
+        inline_kb.add(InlineKeyboardButton('Назад', callback_data=catalog_level_data(tag, category)))
+    elif category is not None:
+        inline_kb.add(InlineKeyboardButton('Назад', callback_data=catalog_level_data(tag)))
     return inline_kb
 
 
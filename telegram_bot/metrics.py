@@ -0,0 +1,214 @@
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import CallbackQuery, InlineQuery, Message, Update
+from aiohttp import web
+
+from database import QueryScope, current_query_scope
+from redis_pool import CommandScope, current_command_scope
+
+
+logger = logging.getLogger('telegram_bot_service.metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNHANDLED = 'unhandled'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Collector = Callable[[], Dict[str, float]]
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> Iterable[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), total
+
+
+class HandlerMetrics:
+    __slots__ = ('calls', 'errors', 'latency', 'db_queries', 'redis_commands', 'redis_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.db_queries = 0
+        self.redis_commands = 0
+        self.redis_time = 0.0
+
+
+class UpdateScope:
+    __slots__ = ('started', 'handler', 'failed', 'queries', 'commands')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler = UNHANDLED
+        self.failed = False
+        self.queries = QueryScope()
+        self.commands = CommandScope()
+
+
+_current_update: ContextVar[Optional[UpdateScope]] = ContextVar('current_update', default=None)
+
+
+class BotMetrics:
+    """Per-handler counters and latency histograms rendered in the Prometheus text format.
+
+    Recording is a few additions per update, so the metrics are cheap enough to stay on under full load.
+    """
+
+    def __init__(self, tracked_states: Iterable[str] = ()):
+        self.handlers: Dict[str, HandlerMetrics] = {}
+        self.transitions: Dict[Tuple[str, str], int] = {}
+        self._tracked_states = frozenset(tracked_states)
+        self._collectors: List[Tuple[str, Collector]] = []
+
+    def add_collector(self, prefix: str, collector: Collector):
+        """Exports the numeric values of ``collector()`` as gauges named ``{prefix}_{key}``."""
+        self._collectors.append((prefix, collector))
+
+    def record_update(self, scope: UpdateScope):
+        metrics = self.handlers.get(scope.handler)
+        if metrics is None:
+            metrics = self.handlers[scope.handler] = HandlerMetrics()
+        metrics.calls += 1
+        metrics.errors += scope.failed
+        metrics.latency.observe(time.perf_counter() - scope.started)
+        metrics.db_queries += scope.queries.queries
+        metrics.redis_commands += scope.commands.commands
+        metrics.redis_time += scope.commands.time
+
+    def record_transition(self, previous: Optional[str], state: Optional[str]):
+        if previous not in self._tracked_states and state not in self._tracked_states:
+            return
+        key = (previous or '', state or '')
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def render(self) -> str:
+        lines = []
+        counters = (
+            ('bot_handler_calls_total', 'Updates processed by the handler', 'calls'),
+            ('bot_handler_errors_total', 'Updates the handler failed on', 'errors'),
+            ('bot_handler_db_queries_total', 'DB queries made while processing the updates', 'db_queries'),
+            ('bot_handler_redis_commands_total', 'Redis commands sent while processing the updates', 'redis_commands'),
+            ('bot_handler_redis_seconds_total', 'Time spent waiting for Redis replies', 'redis_time')
+        )
+        for name, help_text, attribute in counters:
+            lines.extend((f'# HELP {name} {help_text}', f'# TYPE {name} counter'))
+            for handler, metrics in self.handlers.items():
+                lines.append(f'{name}{{handler="{handler}"}} {getattr(metrics, attribute)}')
+
+        name = 'bot_handler_duration_seconds'
+        lines.extend((f'# HELP {name} Update processing time by handler', f'# TYPE {name} histogram'))
+        for handler, metrics in self.handlers.items():
+            for bound, count in metrics.latency.cumulative():
+                lines.append(f'{name}_bucket{{handler="{handler}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{handler="{handler}"}} {metrics.latency.sum}')
+            lines.append(f'{name}_count{{handler="{handler}"}} {metrics.latency.count}')
+
+        name = 'bot_fsm_transitions_total'
+        lines.extend((f'# HELP {name} FSM state changes', f'# TYPE {name} counter'))
+        for (previous, state), count in self.transitions.items():
+            lines.append(f'{name}{{from="{previous}",to="{state}"}} {count}')
+
+        for prefix, collector in self._collectors:
+            try:
+                values = collector()
+            except Exception:
+                logger.exception('Metrics collector %s failed', prefix)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.extend((f'# TYPE {prefix}_{key} gauge', f'{prefix}_{key} {value}'))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Attributes every update, with its DB queries and Redis commands, to the handler that processed it."""
+
+    def __init__(self, metrics: BotMetrics):
+        super().__init__()
+        self._metrics = metrics
+
+    async def on_pre_process_update(self, update: Update, data: dict):
+        scope = UpdateScope()
+        data['_metrics_tokens'] = (
+            _current_update.set(scope),
+            current_query_scope.set(scope.queries),
+            current_command_scope.set(scope.commands)
+        )
+
+    async def on_process_message(self, message: Message, data: dict):
+        self._handler_started()
+
+    async def on_process_callback_query(self, callback_query: CallbackQuery, data: dict):
+        self._handler_started()
+
+    async def on_process_inline_query(self, inline_query: InlineQuery, data: dict):
+        self._handler_started()
+
+    async def on_pre_process_error(self, update: Update, exception: BaseException, data: dict):
+        scope = _current_update.get()
+        if scope is not None:
+            scope.failed = True
+
+    async def on_post_process_update(self, update: Update, results: list, data: dict):
+        tokens = data.pop('_metrics_tokens', None)
+        if tokens is None:
+            return
+        self._metrics.record_update(_current_update.get())
+        update_token, query_token, command_token = tokens
+        current_command_scope.reset(command_token)
+        current_query_scope.reset(query_token)
+        _current_update.reset(update_token)
+
+    @staticmethod
+    def _handler_started():
+        scope = _current_update.get()
+        handler = current_handler.get(None)
+        if scope is not None and handler is not None:
+            scope.handler = handler.__name__.lstrip('_')
+
+
+class MetricsServer:
+    def __init__(self, metrics: BotMetrics, host: str = '127.0.0.1', port: int = 9100, path: str = '/metrics'):
+        self._metrics = metrics
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info('Metrics server listening on %s:%s%s', self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._metrics.render().encode(), headers={'Content-Type': CONTENT_TYPE})
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import Order
+
+
+logger = logging.getLogger('telegram_bot_service.orders')
+
+
+class DraftSweeper:
+    """Deletes order drafts that were never confirmed.
+
+    Drafts are removed in batches of ``batch_size`` so no single statement holds many row locks.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        interval: float = 600,
+        batch_size: int = 500,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._ttl = ttl
+        self._interval = interval
+        self._batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.deleted = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def sweep(self) -> int:
+        before = datetime.utcnow() - timedelta(seconds=self._ttl)
+        deleted = 0
+        while True:
+            status, _ = await Order.stale_drafts_query(before, self._batch_size).gino.status()
+            batch = int(status.split()[-1])
+            deleted += batch
+            if batch < self._batch_size:
+                break
+        self.deleted += deleted
+        if deleted:
+            logger.info('Deleted %s stale order drafts', deleted)
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Order drafts sweep failed')
+            await asyncio.sleep(self._interval)
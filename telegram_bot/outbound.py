@@ -0,0 +1,279 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import NetworkError, RetryAfter
+
+
+logger = logging.getLogger('telegram_bot_service.outbound')
+
+INTERACTIVE = 0
+NOTIFICATION = 1
+BULK = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        """The bucket refilled and is not blocked, dropping it is the same as keeping it."""
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class OutboundJob:
+    __slots__ = ('chat_id', 'method', 'args', 'kwargs', 'priority', 'max_retries', 'future', 'created', 'attempts')
+
+    def __init__(self, chat_id: int, method: Callable[..., Awaitable], args: Tuple, kwargs: Dict, priority: int,
+                 max_retries: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.max_retries = max_retries
+        self.future = future
+        self.created = time.monotonic()
+        self.attempts = 0
+
+
+class OutboundDispatcher:
+    """Sends Bot API requests from background workers within Telegram flood limits.
+
+    Requests to one chat are sent one at a time in submission order and are limited by a per-chat token
+    bucket; all requests share a global bucket. Ready requests are sent by priority, so interactive
+    replies overtake notifications and broadcasts. Buckets of chats with nothing to send are dropped every
+    ``sweep_interval`` seconds once they have refilled, so memory does not grow with the number of chats.
+    ``close`` stops taking requests and sends the queued ones for up to ``drain_timeout`` seconds; requests
+    still unsent then fail, so nobody waits on them forever.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 8,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        sweep_interval: float = 60,
+        drain_timeout: float = 10,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._bot = bot
+        self._workers = workers
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._sweep_interval = sweep_interval
+        self._drain_timeout = drain_timeout
+        self._ready: List[Tuple[int, int, OutboundJob]] = []
+        self._ready_event = asyncio.Event()
+        self._sequence = itertools.count()
+        self._chats: Dict[int, Deque[OutboundJob]] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._pending: Set[OutboundJob] = set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._closing = False
+        self._tasks: List[asyncio.Task] = []
+        self._latencies: Deque[float] = deque(maxlen=1024)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        self._tasks = [self.loop.create_task(self._work()) for _ in range(self._workers)]
+        self._tasks.append(self.loop.create_task(self._sweep()))
+
+    async def close(self):
+        self._closing = True
+        if self._pending and self._tasks:
+            try:
+                await asyncio.wait_for(self._drained.wait(), self._drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning('Outbox closed with %s requests unsent', len(self._pending))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in list(self._pending):
+            self._complete(job, error=RuntimeError('Outbox closed before the request was sent'))
+
+    def send_message(self, chat_id: int, text: str, priority: int = INTERACTIVE, max_retries: Optional[int] = None,
+                     **kwargs) -> asyncio.Future:
+        return self.call(chat_id, self._bot.send_message, chat_id, text, priority=priority, max_retries=max_retries,
+                         **kwargs)
+
+    def call(self, chat_id: Optional[int], method: Callable[..., Awaitable], *args, priority: int = INTERACTIVE,
+             max_retries: Optional[int] = None, **kwargs) -> asyncio.Future:
+        """Queues ``method(*args, **kwargs)``; network errors are retried ``max_retries`` times (default of the
+        dispatcher), flood limits are always waited out."""
+        future = self.loop.create_future()
+        future.add_done_callback(self._log_failure)
+        if self._closing:
+            future.set_exception(RuntimeError('Outbox is closed'))
+            return future
+        job = OutboundJob(chat_id, method, args, kwargs, priority,
+                          self._max_retries if max_retries is None else max_retries, future)
+        self._pending.add(job)
+        self._drained.clear()
+        pending = self._chats.get(chat_id)
+        if pending is None:
+            # No request to this chat is queued or in flight, the job can go straight to the ready heap
+            self._chats[chat_id] = deque()
+            self._push(job)
+        else:
+            pending.append(job)
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._ready) + sum(len(pending) for pending in self._chats.values())
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def percentile(q: float) -> float:
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+
+        return {
+            'queue_depth': self.queue_depth,
+            'active_chats': len(self._chats),
+            'chat_buckets': len(self._chat_buckets),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'latency_p50': percentile(0.5),
+            'latency_p95': percentile(0.95),
+            'latency_p99': percentile(0.99)
+        }
+
+    def _push(self, job: OutboundJob):
+        heapq.heappush(self._ready, (job.priority, next(self._sequence), job))
+        self._ready_event.set()
+
+    def _push_later(self, job: OutboundJob, delay: float):
+        self.loop.call_later(delay, self._push, job)
+
+    def _finish(self, job: OutboundJob):
+        pending = self._chats.get(job.chat_id)
+        if pending:
+            self._push(pending.popleft())
+        else:
+            self._chats.pop(job.chat_id, None)
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if chat_id not in self._chats and bucket.idle(now)
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+        return len(idle)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            self.sweep()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def _next_job(self) -> OutboundJob:
+        while not self._ready:
+            self._ready_event.clear()
+            await self._ready_event.wait()
+        return heapq.heappop(self._ready)[2]
+
+    async def _work(self):
+        while True:
+            job = await self._next_job()
+            chat_bucket = self._chat_bucket(job.chat_id)
+            delay = chat_bucket.delay()
+            if delay > 0:
+                self._push_later(job, delay)
+                continue
+            while True:
+                delay = self._global_bucket.delay()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self._global_bucket.take()
+            chat_bucket.take()
+            await self._send(job)
+
+    async def _send(self, job: OutboundJob):
+        job.attempts += 1
+        try:
+            result = await job.method(*job.args, **job.kwargs)
+        except RetryAfter as error:
+            logger.warning('Flood limit for chat %s, retry after %s s', job.chat_id, error.timeout)
+            # A 429 on a chat method is that chat's limit, other chats keep being served
+            if job.chat_id is None:
+                self._global_bucket.block(error.timeout)
+            self._chat_bucket(job.chat_id).block(error.timeout)
+            self.retried += 1
+            self._push_later(job, error.timeout)
+            return
+        except NetworkError as error:
+            if job.attempts <= job.max_retries:
+                self.retried += 1
+                self._push_later(job, 2 ** job.attempts)
+                return
+            self._complete(job, error=error)
+        except Exception as error:
+            self._complete(job, error=error)
+        else:
+            self._complete(job, result=result)
+
+    def _complete(self, job: OutboundJob, result: Any = None, error: Optional[BaseException] = None):
+        if job not in self._pending:
+            return
+        self._pending.discard(job)
+        if not self._pending:
+            self._drained.set()
+        self._latencies.append(time.monotonic() - job.created)
+        if error is None:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        else:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        self._finish(job)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning('Outbound request failed: %r', future.exception())
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import msgpack
+from aioredis import ReplyError
+
+from .outbound import NOTIFICATION, OutboundDispatcher
+
+
+logger = logging.getLogger('telegram_bot_service.reminders')
+
+RENTAL_UNITS = (
+    ('мин', timedelta(minutes=1)),
+    ('ч', timedelta(hours=1)),
+    ('сут', timedelta(days=1)),
+    ('д', timedelta(days=1)),
+    ('нед', timedelta(weeks=1)),
+    ('мес', timedelta(days=30))
+)
+
+# Returns the expired leases to the due set, then moves up to ARGV[2] due jobs to the in-flight set with the
+# lease deadline ARGV[3] and returns them as id, payload pairs. One script, so no two pollers get the same job.
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(expired) do
+    redis.call('ZADD', KEYS[1], ARGV[1], id)
+    redis.call('ZREM', KEYS[2], id)
+end
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local claimed = {}
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    local payload = redis.call('HGET', KEYS[3], id)
+    if payload then
+        redis.call('ZADD', KEYS[2], ARGV[3], id)
+        claimed[#claimed + 1] = id
+        claimed[#claimed + 1] = payload
+    end
+end
+return claimed
+"""
+CLAIM_SCRIPT_SHA = hashlib.sha1(CLAIM_SCRIPT.encode()).hexdigest()
+
+
+def rental_duration(rental_time: Optional[int], rental_unit: str) -> Optional[timedelta]:
+    """Parses price feed durations such as ``1 час``, ``3 часа`` or ``2 суток``, None if the unit is unknown."""
+    if not rental_time:
+        return None
+    unit = rental_unit.strip().lower()
+    for prefix, duration in RENTAL_UNITS:
+        if unit.startswith(prefix):
+            return duration * rental_time
+    return None
+
+
+class ReminderScheduler:
+    """One-shot messages delivered at a given time, kept in Redis so they survive restarts.
+
+    Fire times are the scores of a sorted set and payloads live in a hash next to it, so scheduling is
+    O(log n) and a poll is O(log n + batch) however many timers are pending. Every replica polls; a Lua
+    script claims due jobs atomically by moving them to an in-flight set with a lease. Jobs are removed
+    as soon as the batch is queued on the outbox, so slow deliveries cannot outlive the lease and fire twice;
+    a job whose poller died before queueing fires again when its lease expires, one still queued when the
+    process dies is lost.
+    """
+
+    def __init__(
+        self,
+        redis,
+        outbox: OutboundDispatcher,
+        key_prefix: str = 'reminders',
+        batch_size: int = 100,
+        poll_interval: float = 1,
+        lease: float = 60,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._redis = redis
+        self._outbox = outbox
+        self._due_key = f'{key_prefix}:due'
+        self._in_flight_key = f'{key_prefix}:in_flight'
+        self._jobs_key = f'{key_prefix}:jobs'
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._lease = lease
+        self._task: Optional[asyncio.Task] = None
+        self.scheduled = 0
+        self.delivered = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def schedule(self, job_id: str, fire_at: float, chat_id: int, text: str):
+        """Schedules ``text`` to ``chat_id`` at the unix time ``fire_at``, replacing a job with the same id."""
+        transaction = self._redis.multi_exec()
+        transaction.hset(self._jobs_key, job_id, msgpack.packb({'chat_id': chat_id, 'text': text}, use_bin_type=True))
+        transaction.zadd(self._due_key, fire_at, job_id)
+        transaction.zrem(self._in_flight_key, job_id)
+        await transaction.execute()
+        self.scheduled += 1
+
+    async def cancel(self, *job_ids: str):
+        if not job_ids:
+            return
+        transaction = self._redis.multi_exec()
+        transaction.zrem(self._due_key, *job_ids)
+        transaction.zrem(self._in_flight_key, *job_ids)
+        transaction.hdel(self._jobs_key, *job_ids)
+        await transaction.execute()
+
+    async def claim(self) -> List[Tuple[str, Dict]]:
+        now = time.time()
+        keys = [self._due_key, self._in_flight_key, self._jobs_key]
+        args = [now, self._batch_size, now + self._lease]
+        try:
+            reply = await self._redis.evalsha(CLAIM_SCRIPT_SHA, keys=keys, args=args)
+        except ReplyError as error:
+            if not str(error).startswith('NOSCRIPT'):
+                raise
+            reply = await self._redis.eval(CLAIM_SCRIPT, keys=keys, args=args)
+        return [
+            (job_id.decode(), msgpack.unpackb(payload, raw=False))
+            for job_id, payload in zip(reply[::2], reply[1::2])
+        ]
+
+    async def poll(self) -> int:
+        jobs = await self.claim()
+        if not jobs:
+            return 0
+        deliveries = [
+            self._outbox.send_message(job['chat_id'], job['text'], priority=NOTIFICATION) for _, job in jobs
+        ]
+        await self._ack([job_id for job_id, _ in jobs])
+        # Waiting for the deliveries keeps the next batch from piling up on the outbox
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+        for (job_id, job), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                # Blocked bots and deleted chats would fail again, the reminder is dropped like any other message
+                logger.warning('Reminder %s to %s failed: %r', job_id, job['chat_id'], result)
+                self.failed += 1
+            else:
+                self.delivered += 1
+        return len(jobs)
+
+    def stats(self) -> Dict[str, int]:
+        return {'scheduled': self.scheduled, 'delivered': self.delivered, 'failed': self.failed}
+
+    async def pending(self) -> int:
+        return await self._redis.zcard(self._due_key)
+
+    async def _ack(self, job_ids: Sequence[str]):
+        transaction = self._redis.multi_exec()
+        transaction.zrem(self._in_flight_key, *job_ids)
+        transaction.hdel(self._jobs_key, *job_ids)
+        await transaction.execute()
+
+    async def _run(self):
+        while True:
+            try:
+                # A full batch means more jobs are probably due, the next one is claimed right away
+                if await self.poll() == self._batch_size:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Reminders poll failed')
+            await asyncio.sleep(self._poll_interval)
@@ -0,0 +1,175 @@
+import asyncio
+import csv
+import io
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Sequence, Set
+
+import aiofiles
+import aiofiles.os
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from database import Order, User, db
+
+from .keyboard import ORDER_STATUS_TITLES
+from .outbound import NOTIFICATION, OutboundDispatcher
+
+
+logger = logging.getLogger('telegram_bot_service.reports')
+
+CSV = 'csv'
+XLSX = 'xlsx'
+REPORT_COLUMNS = ('Дата', 'Статус', 'Инвентарь', 'ФИО', 'Телефон', 'Рост', 'Вес', 'Telegram ID')
+
+
+def orders_report_query(start: datetime, end: datetime):
+    return db.select([
+        Order.create_datetime, Order.status, Order.ordered_item, Order.telegram_id, User.name, User.phone_number,
+        User.height, User.weight
+    ]).select_from(
+        Order.outerjoin(User, User.telegram_id == Order.telegram_id)
+    ).where(
+        (Order.create_datetime >= start) & (Order.create_datetime < end) & (Order.status != Order.DRAFT)
+    ).order_by(Order.create_datetime, Order.id)
+
+
+class OrderReporter:
+    """Exports orders created in a date range and sends the file to the admin who asked for it.
+
+    Rows are streamed through a server-side cursor in batches of ``batch_size`` and appended to a temporary
+    file, so memory does not grow with the report size. File writes run in threads, and only
+    ``concurrency`` reports hold a database connection at a time.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        outbox: OutboundDispatcher,
+        date_time_format: str,
+        batch_size: int = 1000,
+        concurrency: int = 2,
+        max_size: int = 50 * 1024 * 1024,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._bot = bot
+        self._outbox = outbox
+        self._date_time_format = date_time_format
+        self._batch_size = batch_size
+        self._max_size = max_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def xlsx_available() -> bool:
+        try:
+            import xlsxwriter  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def request(self, chat_id: int, start: datetime, end: datetime, report_format: str = CSV) -> asyncio.Task:
+        task = self.loop.create_task(self._run(chat_id, start, end, report_format))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, chat_id: int, start: datetime, end: datetime, report_format: str):
+        fd, path = tempfile.mkstemp(suffix=f'.{report_format}')
+        os.close(fd)
+        try:
+            async with self._semaphore:
+                write = self._write_xlsx if report_format == XLSX else self._write_csv
+                rows = await write(path, start, end)
+            size = (await aiofiles.os.stat(path)).st_size
+            if size > self._max_size:
+                await self._outbox.send_message(
+                    chat_id, f'Отчет слишком большой ({size // (1024 * 1024)} МБ), выберите период короче.'
+                )
+                return
+            document = InputFile(path, filename=f'orders_{start:%Y%m%d}_{end:%Y%m%d}.{report_format}')
+            try:
+                await self._outbox.call(chat_id, self._bot.send_document, chat_id, document,
+                                        caption=f'Заявок в отчете: {rows}', priority=NOTIFICATION)
+            finally:
+                document.file.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Orders report for %s failed', chat_id)
+            self._outbox.send_message(chat_id, 'Не удалось сформировать отчет, попробуйте позже.')
+        finally:
+            await aiofiles.os.remove(path)
+
+    async def _batches(self, start: datetime, end: datetime) -> AsyncIterator[List]:
+        async with db.transaction(readonly=True):
+            cursor = await orders_report_query(start, end).gino.iterate()
+            while True:
+                rows = await cursor.many(self._batch_size)
+                if not rows:
+                    return
+                yield rows
+
+    def _format(self, row) -> List[str]:
+        return [
+            row.create_datetime.strftime(self._date_time_format),
+            ORDER_STATUS_TITLES.get(row.status, row.status),
+            row.ordered_item,
+            row.name or '',
+            row.phone_number or '',
+            row.height or '',
+            row.weight or '',
+            row.telegram_id or ''
+        ]
+
+    async def _write_csv(self, path: str, start: datetime, end: datetime) -> int:
+        written = 0
+        # The BOM makes Excel open the Cyrillic text as UTF-8
+        async with aiofiles.open(path, 'w', encoding='utf-8-sig', newline='') as file:
+            batches = self._batches(start, end)
+            try:
+                await file.write(self._csv_lines([REPORT_COLUMNS]))
+                async for rows in batches:
+                    await file.write(self._csv_lines(self._format(row) for row in rows))
+                    written += len(rows)
+            finally:
+                await batches.aclose()
+        return written
+
+    @staticmethod
+    def _csv_lines(rows: Iterable[Sequence[str]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    async def _write_xlsx(self, path: str, start: datetime, end: datetime) -> int:
+        import xlsxwriter
+
+        # constant_memory flushes every finished row to disk, batches of rows are written in executor threads
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Заявки')
+        worksheet.write_row(0, 0, REPORT_COLUMNS)
+        written = 0
+        batches = self._batches(start, end)
+        try:
+            async for rows in batches:
+                await self.loop.run_in_executor(None, self._write_rows, worksheet, written + 1,
+                                                [self._format(row) for row in rows])
+                written += len(rows)
+        finally:
+            await batches.aclose()
+            await self.loop.run_in_executor(None, workbook.close)
+        return written
+
+    @staticmethod
+    def _write_rows(worksheet, first_row: int, rows: List[List[str]]):
+        for index, row in enumerate(rows):
+            worksheet.write_row(first_row + index, 0, row)
@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Generic, Hashable, List, Mapping, Optional, Set, Tuple, TypeVar
+
+from database import Item
+
+from .catalog import Catalog, CatalogSnapshot, CatalogTree
+
+
+K = TypeVar('K', bound=Hashable)
+
+_separators_re = re.compile(r'[\W_]+')
+
+
+def normalize(text: str) -> str:
+    return _separators_re.sub(' ', text.lower().replace('ё', 'е')).strip()
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex(Generic[K]):
+    """In-memory full text index over short documents such as item names.
+
+    Every query word matches the document words it is a prefix of; a query word that is no prefix of anything
+    matches the words sharing enough trigrams with it, so typos still find something. All query words must
+    match. Trigrams index distinct words rather than documents, which keeps fuzzy lookups cheap for large
+    catalogs. Documents are added and removed one by one, ``sync`` applies only the difference to a new set.
+    """
+
+    def __init__(self, min_similarity: float = 0.3):
+        self.min_similarity = min_similarity
+        self._texts: Dict[K, str] = {}
+        self._sources: Dict[K, str] = {}
+        self._postings: Dict[str, Set[K]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        # Distinct words and documents in alphabetical order, sorted again on the first search after a change
+        self._sorted_words: Optional[List[str]] = []
+        self._sorted_keys: List[K] = []
+        self._sorted_texts: List[str] = []
+        self._ranks: Optional[Dict[K, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, key: K, text: str):
+        if key in self._texts:
+            self.remove(key)
+        normalized = normalize(text)
+        self._texts[key] = normalized
+        self._sources[key] = text
+        self._ranks = None
+        for word in set(normalized.split()):
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                for trigram in trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+                self._sorted_words = None
+            postings.add(key)
+
+    def remove(self, key: K):
+        normalized = self._texts.pop(key, None)
+        if normalized is None:
+            return
+        del self._sources[key]
+        self._ranks = None
+        for word in set(normalized.split()):
+            postings = self._postings[word]
+            postings.discard(key)
+            if postings:
+                continue
+            del self._postings[word]
+            for trigram in trigrams(word):
+                words = self._trigrams[trigram]
+                words.discard(word)
+                if not words:
+                    del self._trigrams[trigram]
+            self._sorted_words = None
+
+    def sync(self, documents: Mapping[K, str]) -> Tuple[int, int]:
+        """Makes the index hold exactly ``documents``, returns how many were (re)indexed and removed."""
+        removed = [key for key in self._texts if key not in documents]
+        for key in removed:
+            self.remove(key)
+        changed = [(key, text) for key, text in documents.items() if self._sources.get(key) != text]
+        for key, text in changed:
+            self.add(key, text)
+        # Sorting here keeps the cost off the first query after a catalog change
+        self._words()
+        self._rank()
+        return len(changed), len(removed)
+
+    def search(self, query: str, limit: int = 50, offset: int = 0) -> List[K]:
+        normalized = normalize(query)
+        matched: Optional[Set[K]] = None
+        # Long words are the most selective, the intersection shrinks fastest starting with them
+        for word in sorted(normalized.split(), key=len, reverse=True):
+            keys = self._prefixed(word) or self._similar(word)
+            matched = keys if matched is None else matched & keys
+            if not matched:
+                return []
+        if matched is None:
+            return []
+        # Documents starting with the query go first, the rest in alphabetical order. The former are a contiguous
+        # run of the sorted documents, so ranking needs no per-document Python code.
+        ranks = self._rank()
+        wanted = offset + limit
+        first = bisect_left(self._sorted_texts, normalized)
+        last = bisect_left(self._sorted_texts, normalized + '\uffff')
+        results = [key for key in self._sorted_keys[first:last] if key in matched][:wanted]
+        if len(results) < wanted:
+            results.extend(heapq.nsmallest(wanted - len(results), matched.difference(results), key=ranks.__getitem__))
+        return results[offset:]
+
+    def _rank(self) -> Dict[K, int]:
+        if self._ranks is None:
+            self._sorted_keys = sorted(self._texts, key=self._texts.__getitem__)
+            self._sorted_texts = [self._texts[key] for key in self._sorted_keys]
+            self._ranks = {key: rank for rank, key in enumerate(self._sorted_keys)}
+        return self._ranks
+
+    def _words(self) -> List[str]:
+        if self._sorted_words is None:
+            self._sorted_words = sorted(self._postings)
+        return self._sorted_words
+
+    def _prefixed(self, prefix: str) -> Set[K]:
+        words = self._words()
+        keys: Set[K] = set()
+        index = bisect_left(words, prefix)
+        while index < len(words) and words[index].startswith(prefix):
+            keys |= self._postings[words[index]]
+            index += 1
+        return keys
+
+    def _similar(self, word: str) -> Set[K]:
+        if len(word) < 3:
+            return set()
+        word_trigrams = trigrams(word)
+        shared: Counter = Counter()
+        for trigram in word_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        keys: Set[K] = set()
+        for candidate, count in shared.items():
+            if count / (len(word_trigrams) + len(trigrams(candidate)) - count) >= self.min_similarity:
+                keys |= self._postings[candidate]
+        return keys
+
+
+def catalog_documents(tree: CatalogTree) -> Dict[str, str]:
+    """Searchable text of every item: its name, category and subcategory."""
+    return {
+        tree.items[index].data: f'{tree.items[index].name} {category} {subcategory}'
+        for category, subcategories in tree.categories
+        for subcategory, indexes in subcategories
+        for index in indexes
+    }
+
+
+class CatalogSearch:
+    """Searches the catalog items by name, category and subcategory, the index follows the catalog snapshots.
+
+    Index updates run in a thread: the first build of a large index takes seconds, later catalog changes are
+    applied incrementally. Searches wait while the index is being changed.
+    """
+
+    def __init__(
+        self,
+        catalog: Catalog,
+        min_similarity: float = 0.3,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._catalog = catalog
+        self._index: SearchIndex[str] = SearchIndex(min_similarity)
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self.syncs = 0
+
+    async def search(self, query: str, limit: int = 50, offset: int = 0) -> List[Item]:
+        snapshot = await self._catalog.snapshot()
+        if snapshot.version > self._version or self._lock.locked():
+            await self._sync(snapshot)
+        if not normalize(query):
+            return list(snapshot.items[offset:offset + limit])
+        items = (snapshot.items_by_data.get(data) for data in self._index.search(query, limit, offset))
+        return [item for item in items if item is not None]
+
+    async def _sync(self, snapshot: CatalogSnapshot):
+        async with self._lock:
+            if snapshot.version <= self._version:
+                return
+            await self.loop.run_in_executor(None, self._apply, snapshot.tree)
+            self._version = snapshot.version
+            self.syncs += 1
+
+    def _apply(self, tree: CatalogTree):
+        self._index.sync(catalog_documents(tree))
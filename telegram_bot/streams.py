@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aioredis.errors import ReplyError
+
+from .updates import update_chat_id
+
+
+logger = logging.getLogger('telegram_bot_service.streams')
+
+
+def stream_key(prefix: str, partition: int) -> str:
+    return f'{prefix}:{partition}'
+
+
+def next_stream_id(message_id: bytes) -> str:
+    milliseconds, sequence = message_id.decode().split('-')
+    return f'{milliseconds}-{int(sequence) + 1}'
+
+
+def worker_partitions(partitions: int, workers: int, worker_index: int) -> List[int]:
+    return [partition for partition in range(partitions) if partition % workers == worker_index]
+
+
+class UpdateStreamProducer:
+    def __init__(self, redis, prefix: str = 'updates', partitions: int = 64, max_len: int = 100000):
+        self._redis = redis
+        self.prefix = prefix
+        self.partitions = partitions
+        self.max_len = max_len
+
+    async def put(self, update: Update):
+        chat_id = update_chat_id(update)
+        partition = (chat_id if chat_id is not None else update.update_id) % self.partitions
+        await self._redis.xadd(
+            stream_key(self.prefix, partition),
+            {'update': json.dumps(update.to_python())},
+            max_len=self.max_len,
+            exact_len=False
+        )
+
+
+class UpdateStreamConsumer:
+    """Consumes a set of update partitions through a Redis consumer group.
+
+    Each partition is owned by exactly one worker and processed sequentially, so updates of a chat stay
+    ordered. Entries are acked only after the dispatcher is done with them and ``before_ack`` (the FSM
+    storage flush) has returned, once per batch; after a crash the worker replays its pending entries.
+    Every ``claim_interval`` seconds the pending lists are paged through and entries other consumers have
+    left idle for ``claim_idle_ms`` are claimed, so a crashed worker's updates are processed even if it
+    never comes back.
+    """
+
+    def __init__(
+        self,
+        redis,
+        dispatcher: Dispatcher,
+        partitions: Iterable[int],
+        consumer: str,
+        prefix: str = 'updates',
+        group: str = 'workers',
+        batch_size: int = 100,
+        block_ms: int = 5000,
+        claim_idle_ms: int = 60000,
+        claim_interval: float = 30,
+        before_ack: Optional[Callable[[], Awaitable]] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._redis = redis
+        self._dispatcher = dispatcher
+        self._streams = [stream_key(prefix, partition) for partition in partitions]
+        self.consumer = consumer
+        self.group = group
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self._before_ack = before_ack
+        self._task: Optional[asyncio.Task] = None
+        self.processed = 0
+        self.failed = 0
+        self.claimed = 0
+
+    def start(self):
+        Bot.set_current(self._dispatcher.bot)
+        Dispatcher.set_current(self._dispatcher)
+        self._task = self.loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        for stream in self._streams:
+            try:
+                await self._redis.xgroup_create(stream, self.group, latest_id='0', mkstream=True)
+            except ReplyError as error:
+                if 'BUSYGROUP' not in str(error):
+                    raise
+        logger.info('Consuming %s update streams', len(self._streams))
+
+        for stream in self._streams:
+            await self._replay(stream)
+
+        next_claim = 0.0
+        while True:
+            try:
+                if self.loop.time() >= next_claim:
+                    next_claim = self.loop.time() + self.claim_interval
+                    for stream in self._streams:
+                        await self._claim_stale(stream)
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Update stream read failed')
+                await asyncio.sleep(1)
+
+    async def _replay(self, stream: str):
+        # Entries delivered to this worker before a restart
+        while True:
+            messages = await self._redis.xread_group(
+                self.group, self.consumer, [stream], count=self.batch_size, latest_ids=['0']
+            )
+            if not messages:
+                break
+            await self._process(stream, [(message_id, fields) for _, message_id, fields in messages])
+
+    async def _claim_stale(self, stream: str):
+        # Entries left behind by crashed consumers or consumers of a previous partitioning. Young entries and
+        # our own do not stop the scan, the pending list is paged through to its end.
+        start = '-'
+        while True:
+            pending = await self._redis.xpending(stream, self.group, start, '+', self.batch_size)
+            if not pending:
+                return
+            stale = [message_id for message_id, owner, idle, _ in pending
+                     if owner.decode() != self.consumer and idle >= self.claim_idle_ms]
+            if stale:
+                claimed = await self._redis.xclaim(stream, self.group, self.consumer, self.claim_idle_ms, *stale)
+                self.claimed += len(claimed)
+                await self._process(stream, claimed)
+            if len(pending) < self.batch_size:
+                return
+            start = next_stream_id(pending[-1][0])
+
+    async def _consume(self):
+        # A blocking read must not hold a connection the pool multiplexes other commands over
+        with await self._redis as redis:
+            messages = await redis.xread_group(
+                self.group, self.consumer, self._streams,
+                timeout=self.block_ms, count=self.batch_size, latest_ids=['>'] * len(self._streams)
+            )
+        batches: Dict[str, List[Tuple[bytes, Dict]]] = defaultdict(list)
+        for stream, message_id, fields in messages:
+            batches[stream.decode() if isinstance(stream, bytes) else stream].append((message_id, fields))
+        # Partitions are independent, entries within a partition are processed in order
+        await asyncio.gather(*(self._process(stream, batch) for stream, batch in batches.items()))
+
+    async def _process(self, stream: str, messages: List[Tuple[bytes, Dict]]):
+        for message_id, fields in messages:
+            if fields:
+                try:
+                    update = Update(**json.loads(fields[b'update']))
+                    await self._dispatcher.updates_handler.notify(update)
+                    self.processed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception('Update %s from %s failed', message_id, stream)
+        if not messages:
+            return
+        # State written by the handlers must be in Redis before the entries are gone from the stream
+        if self._before_ack is not None:
+            await self._before_ack()
+        await self._redis.xack(stream, self.group, *(message_id for message_id, _ in messages))
@@ -1,21 +1,40 @@
 import asyncio
 import logging
-from dataclasses import dataclass
-from typing import Optional
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
 
 from aiogram import Bot, Dispatcher
-from aiogram.contrib.fsm_storage.redis import RedisStorage
+from aiogram.bot.api import TELEGRAM_PRODUCTION, Methods, TelegramAPIServer
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import CallbackQuery, Message
-from aiogram.utils.executor import Executor
+from aiogram.types import CallbackQuery, InlineQuery, InlineQueryResultArticle, InputTextMessageContent, Message
+from aiogram.utils.payload import generate_payload
 
-from database import Admin, User, Item, Order
+from database import ChangeListener, User, Order
 
+from .admins import AdminNotifier, AdminRoster
+from .broadcast import Broadcaster
+from .callbacks import CallbackResponder
+from .catalog import Catalog, CatalogTree
+from .fsm_storage import TieredRedisStorage
+from .identity import IdentityResolver
 from .keyboard import (
-    get_kb_order, get_kb_out_links, get_kb_items_to_book, get_kb_menu_for_customer, get_kb_menu_for_admin,
-    get_kb_orders_menu
+    CATALOG_ITEM_PREFIX, CATALOG_PREFIX, ORDER_PREFIX, ORDER_STATUS_PREFIX, ORDER_STATUS_TITLES, ORDERS_PAGE_PREFIX,
+    get_kb_order, get_kb_out_links, get_kb_menu_for_customer, get_kb_menu_for_admin, get_kb_orders_menu,
+    get_kb_status_menu, order_details_query, parse_catalog_item, parse_catalog_level, parse_order, parse_order_status,
+    parse_orders_page
 )
+from .metrics import BotMetrics, MetricsMiddleware, MetricsServer
+from .orders import DraftSweeper
+from .reminders import ReminderScheduler, rental_duration
+from .reports import CSV, XLSX, OrderReporter
+from .search import CatalogSearch
+from .outbound import OutboundDispatcher
+from .streams import UpdateStreamConsumer, UpdateStreamProducer, worker_partitions
+from .updates import UpdateWorkerPool, poll_updates, prepare_polling
+from .webhook import UpdateSink, WebhookServer
 
 
 logger = logging.getLogger('telegram_bot_service')
@@ -26,8 +45,47 @@ class TelegramBotServiceConfig:
     app_name: str = 'telegram_bot'
     token: str = ''
     proxy: Optional[str] = None
+    api_server: Optional[str] = None
     date_time_format = '%d/%m/%Y %H:%M UTC'
     date_time_format_report = '%d-%m-%Y'
+    identity_cache_size: int = 10000
+    identity_cache_ttl: int = 300
+    orders_page_size: int = 10
+    catalog_page_size: int = 8
+    mode: str = 'polling'
+    webhook_url: Optional[str] = None
+    webhook_host: str = '0.0.0.0'
+    webhook_port: int = 8080
+    webhook_path: str = '/webhook'
+    webhook_secret: Optional[str] = None
+    update_workers: int = 16
+    update_queue_size: int = 1000
+    role: str = 'all'
+    workers: int = 0
+    worker_index: int = 0
+    stream_partitions: int = 64
+    stream_max_len: int = 100000
+    outbound_workers: int = 8
+    outbound_global_rate: float = 30
+    outbound_chat_rate: float = 1
+    outbound_chat_burst: float = 3
+    callback_edit_in_place: bool = False
+    inline_cache_time: int = 300
+    inline_results: int = 50
+    fsm_cache_size: int = 10000
+    fsm_cache_ttl: int = 600
+    fsm_state_ttl: int = 86400
+    fsm_flush_interval: float = 0.05
+    order_notification_role: Optional[str] = None
+    broadcast_batch_size: int = 100
+    report_batch_size: int = 1000
+    report_max_size: int = 50 * 1024 * 1024
+    order_draft_ttl: int = 3600
+    order_draft_sweep_interval: float = 600
+    reminder_lead: int = 3600
+    reminder_poll_interval: float = 1
+    metrics_host: str = '127.0.0.1'
+    metrics_port: Optional[int] = None
 
 
 default_telegram_bot_service_config = TelegramBotServiceConfig()
@@ -50,73 +108,298 @@ class Book(StatesGroup):
 class TelegramBotService:
     def __init__(
         self,
-        redis_host,
-        redis_port,
-        redis_db,
-        redis_password,
+        redis,
         config: TelegramBotServiceConfig = default_telegram_bot_service_config,
+        change_listener: Optional[ChangeListener] = None,
         loop: Optional[asyncio.AbstractEventLoop] = None
     ):
         self._config = config
         self.loop = loop or asyncio.get_event_loop()
-        self.redis_host = redis_host
-        self.redis_port = int(redis_port)
-        self.redis_db = int(redis_db)
-        self.redis_password = redis_password
-        self._storage = RedisStorage(
-            host=self.redis_host,
-            port=self.redis_port,
-            db=self.redis_db,
-            password=self.redis_password
+        self._metrics = BotMetrics(tracked_states=Registration.all_states_names + Book.all_states_names)
+        self._metrics_server: Optional[MetricsServer] = None
+        self._storage = TieredRedisStorage(
+            redis,
+            prefix=f'{self._config.app_name}:fsm',
+            cache_size=self._config.fsm_cache_size,
+            cache_ttl=self._config.fsm_cache_ttl,
+            state_ttl=self._config.fsm_state_ttl,
+            flush_interval=self._config.fsm_flush_interval,
+            # Stream workers own their partitions and polling runs in one process; webhook replicas share chats
+            chat_affinity=self._config.role == 'worker' or self._config.mode != 'webhook',
+            transition_listener=self._metrics.record_transition,
+            loop=self.loop
         )
 
         self._bot = Bot(
             token=self._config.token,
             proxy=self._config.proxy,
+            server=TelegramAPIServer.from_base(self._config.api_server) if self._config.api_server
+            else TELEGRAM_PRODUCTION,
             loop=self.loop
         )
         self._dispatcher = Dispatcher(self._bot, loop=self.loop, storage=self._storage)
-        self._executor = Executor(self._dispatcher, skip_updates=True, loop=self.loop)
+        self._redis = redis
+        self._update_workers: Optional[UpdateWorkerPool] = None
+        self._polling: Optional[asyncio.Task] = None
+        self._stream_consumer: Optional[UpdateStreamConsumer] = None
+        self._webhook_server: Optional[WebhookServer] = None
+        self._outbox = OutboundDispatcher(
+            self._bot,
+            workers=self._config.outbound_workers,
+            global_rate=self._config.outbound_global_rate,
+            chat_rate=self._config.outbound_chat_rate,
+            chat_burst=self._config.outbound_chat_burst,
+            loop=self.loop
+        )
+        self._callbacks = CallbackResponder(self._bot, self._outbox, edit_in_place=self._config.callback_edit_in_place)
+        self._catalog = Catalog(change_listener, page_size=self._config.catalog_page_size)
+        self._search = CatalogSearch(self._catalog, loop=self.loop)
+        self._admins = AdminRoster(change_listener)
+        self._notifier = AdminNotifier(self._outbox, self._admins, loop=self.loop)
+        self._broadcaster = Broadcaster(
+            redis,
+            self._bot,
+            self._outbox,
+            key_prefix=f'{self._config.app_name}:broadcast',
+            batch_size=self._config.broadcast_batch_size,
+            loop=self.loop
+        )
+        self._reporter = OrderReporter(
+            self._bot,
+            self._outbox,
+            date_time_format=self._config.date_time_format,
+            batch_size=self._config.report_batch_size,
+            max_size=self._config.report_max_size,
+            loop=self.loop
+        )
+        self._draft_sweeper = DraftSweeper(
+            ttl=self._config.order_draft_ttl,
+            interval=self._config.order_draft_sweep_interval,
+            loop=self.loop
+        )
+        self._reminders = ReminderScheduler(
+            redis,
+            self._outbox,
+            key_prefix=f'{self._config.app_name}:reminders',
+            poll_interval=self._config.reminder_poll_interval,
+            loop=self.loop
+        )
+        self._identities = IdentityResolver(
+            redis=redis,
+            key_prefix=f'{self._config.app_name}:identity',
+            cache_size=self._config.identity_cache_size,
+            cache_ttl=self._config.identity_cache_ttl,
+            change_listener=change_listener,
+            loop=self.loop
+        )
+        self._metrics.add_collector('bot_outbound', self._outbox.stats)
+        self._metrics.add_collector('bot_fsm_storage', self._storage.stats)
+        self._metrics.add_collector('bot_catalog', self._catalog.stats)
+        self._metrics.add_collector('bot_admin_notifications', self._notifier.stats)
+        self._metrics.add_collector('bot_reminders', self._reminders.stats)
+
+    @property
+    def catalog(self) -> Catalog:
+        return self._catalog
+
+    @property
+    def identities(self) -> IdentityResolver:
+        return self._identities
+
+    @property
+    def dispatcher(self) -> Dispatcher:
+        return self._dispatcher
+
+    @property
+    def notifier(self) -> AdminNotifier:
+        return self._notifier
+
+    @property
+    def storage(self) -> TieredRedisStorage:
+        return self._storage
+
+    @property
+    def outbox(self) -> OutboundDispatcher:
+        return self._outbox
+
+    @property
+    def metrics(self) -> BotMetrics:
+        return self._metrics
+
+    async def start_handlers(self):
+        """Makes the dispatcher ready to process updates without starting to receive them."""
+        self._dispatcher.middleware.setup(MetricsMiddleware(self._metrics))
+        self._register_handlers()
+        if self._config.role != 'ingress':
+            self._outbox.start()
+            await self._broadcaster.resume()
+
+    async def run_bot_task(self, startup_mark: Optional[Callable[[str], None]] = None):
+        mark = startup_mark or (lambda phase: None)
+        await self.start_handlers()
+        mark('handlers')
+        if self._config.metrics_port:
+            self._metrics_server = MetricsServer(
+                self._metrics,
+                host=self._config.metrics_host,
+                port=self._config.metrics_port
+            )
+            await self._metrics_server.start()
+        if self._config.role != 'ingress':
+            self._reminders.start()
+        if self._config.role == 'worker':
+            self._start_stream_worker()
+            mark('stream worker')
+            return
 
-    async def run_bot_task(self):
+        self._draft_sweeper.start()
+
+        sink = None
+        if self._config.role == 'ingress':
+            sink = UpdateStreamProducer(
+                self._redis,
+                prefix=self._streams_prefix,
+                partitions=self._config.stream_partitions,
+                max_len=self._config.stream_max_len
+            ).put
+        if self._config.mode == 'webhook':
+            await self._start_webhook(sink)
+            mark('webhook')
+        else:
+            await self._start_polling(sink)
+            mark('first poll')
+
+    async def close(self):
+        if self._webhook_server is not None:
+            await self._webhook_server.stop()
+        if self._polling is not None:
+            self._polling.cancel()
+            await asyncio.gather(self._polling, return_exceptions=True)
+        if self._stream_consumer is not None:
+            await self._stream_consumer.stop()
+        if self._update_workers is not None:
+            await self._update_workers.close()
+        await self._draft_sweeper.close()
+        await self._reminders.close()
+        await self._reporter.close()
+        await self._broadcaster.close()
+        await self._notifier.close()
+        await self._outbox.close()
+        # Pending FSM writes must reach Redis before the process exits
+        await self._storage.close()
+        await self._bot.session.close()
+        if self._metrics_server is not None:
+            await self._metrics_server.stop()
+
+    @property
+    def _streams_prefix(self) -> str:
+        return f'{self._config.app_name}:updates'
+
+    def _start_update_workers(self) -> UpdateSink:
+        self._update_workers = UpdateWorkerPool(
+            self._dispatcher,
+            workers=self._config.update_workers,
+            queue_size=self._config.update_queue_size,
+            loop=self.loop
+        )
+        self._update_workers.start()
+        return self._update_workers.put
+
+    async def _start_polling(self, sink: Optional[UpdateSink] = None):
         logger.info('Bot polling started')
+        if sink is None:
+            sink = self._start_update_workers()
+        await prepare_polling(self._dispatcher)
+        first_poll = self.loop.create_future()
+        self._polling = self.loop.create_task(poll_updates(self._dispatcher, sink, first_poll=first_poll))
+        # Startup counts as done when the first getUpdates returned, not when the request was sent
+        await first_poll
+
+    async def _start_webhook(self, sink: Optional[UpdateSink] = None):
+        logger.info('Bot webhook started')
+        if sink is None:
+            sink = self._start_update_workers()
+        self._webhook_server = WebhookServer(
+            sink,
+            host=self._config.webhook_host,
+            port=self._config.webhook_port,
+            path=self._config.webhook_path,
+            secret_token=self._config.webhook_secret
+        )
+        await self._webhook_server.start()
+        # Bot.set_webhook of aiogram 2.12 has no secret_token parameter, the method is called directly
+        await self._bot.request(Methods.SET_WEBHOOK, generate_payload(
+            url=self._config.webhook_url,
+            max_connections=self._config.update_workers,
+            drop_pending_updates=True,
+            secret_token=self._config.webhook_secret
+        ))
+
+    def _start_stream_worker(self):
+        logger.info('Bot stream worker %s/%s started', self._config.worker_index + 1, self._config.workers)
+        self._stream_consumer = UpdateStreamConsumer(
+            self._redis,
+            self._dispatcher,
+            partitions=worker_partitions(self._config.stream_partitions, self._config.workers,
+                                         self._config.worker_index),
+            consumer=f'worker-{self._config.worker_index}',
+            prefix=self._streams_prefix,
+            before_ack=self._storage.flush,
+            loop=self.loop
+        )
+        self._stream_consumer.start()
 
+    def _register_handlers(self):
         self._dispatcher.register_message_handler(self._bot_start, commands=['start'])
         self._dispatcher.register_message_handler(self._show_menu, commands=['menu'], state='*')
+        self._dispatcher.register_message_handler(self._broadcast, commands=['broadcast'], state='*')
+        self._dispatcher.register_message_handler(self._broadcast_stop, commands=['broadcast_stop'], state='*')
+        self._dispatcher.register_message_handler(self._report, commands=['report'], state='*')
 
         self._dispatcher.register_message_handler(self._registration_step_1, state=Registration.step_1)
 
+        self._dispatcher.register_inline_handler(self._inline_search, state='*')
+
         self._dispatcher.register_callback_query_handler(self._show_links, text='links')
         self._dispatcher.register_callback_query_handler(self._book, text='book')
-        # self._dispatcher.register_callback_query_handler(self._edit_order, text='show_orders')
+        self._dispatcher.register_callback_query_handler(self._show_orders, text='show_orders', state='*')
+        self._dispatcher.register_callback_query_handler(
+            self._show_orders_page, text_startswith=f'{ORDERS_PAGE_PREFIX}:', state='*'
+        )
+        self._dispatcher.register_callback_query_handler(
+            self._show_order, text_startswith=f'{ORDER_PREFIX}:', state='*'
+        )
+        self._dispatcher.register_callback_query_handler(
+            self._set_order_status, text_startswith=f'{ORDER_STATUS_PREFIX}:', state='*'
+        )
 
-        self._dispatcher.register_callback_query_handler(self._book_step_1, state=Book.step_1)
+        self._dispatcher.register_callback_query_handler(
+            self._book_navigate, text_startswith=f'{CATALOG_PREFIX}:', state=Book.step_1
+        )
+        self._dispatcher.register_callback_query_handler(
+            self._book_step_1, text_startswith=f'{CATALOG_ITEM_PREFIX}:', state=Book.step_1
+        )
         self._dispatcher.register_callback_query_handler(self._book_step_2_1, text='done', state=Book.step_2)
         self._dispatcher.register_callback_query_handler(self._book_step_2_2, text='cancel', state=Book.step_2)
 
-        self._executor._prepare_polling()
-        await self._executor._startup_polling()
-        self.loop.create_task(self._dispatcher.start_polling(reset_webhook=True))
-
     async def _bot_start(self, message: Message):
         telegram_id = message.chat.id
 
-        check_admin = await Admin.query.where(Admin.telegram_id == str(telegram_id)).gino.first()
-        if check_admin:
-            await message.answer(f'Здравствуй, {check_admin.name}')
-            await self._bot.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
+        identity = await self._identities.resolve(telegram_id)
+        if identity.is_admin:
+            self._outbox.send_message(telegram_id, f'Здравствуй, {identity.admin_name}')
+            self._outbox.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
             return
 
-        check_user = await User.query.where(User.telegram_id == str(telegram_id)).gino.first()
-        if check_user:
-            await message.answer(f'Здравствуйте, {check_user.name}')
-            await self._bot.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
+        if identity.is_user:
+            self._outbox.send_message(telegram_id, f'Здравствуйте, {identity.user_name}')
+            self._outbox.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
 
-        if all([(not check_user), (not check_admin)]):
-            await message.answer('Здравствуйте, мы с Вами не знакомы. \n'
-                                 'Введите ваше ФИО, номер телефона, рост и вес.')
+        if all([(not identity.is_user), (not identity.is_admin)]):
+            self._outbox.send_message(telegram_id, 'Здравствуйте, мы с Вами не знакомы. \n'
+                                                   'Введите ваше ФИО, номер телефона, рост и вес.')
             example_registration = ' '.join(['Пример:', 'Иванов Иван Иванович', '+79020007126', '175', '80'])
-            await self._bot.send_message(
+            self._outbox.send_message(
                 chat_id=telegram_id,
                 text=example_registration
             )
@@ -127,45 +410,163 @@ class TelegramBotService:
 
         state = self._dispatcher.current_state(user=telegram_id)
         await state.reset_state()
-        check_admin = await Admin.query.where(Admin.telegram_id == str(telegram_id)).gino.first()
-        if check_admin:
+        identity = await self._identities.resolve(telegram_id)
+        if identity.is_admin:
             inline_menu = await get_kb_menu_for_admin()
-            await message.answer('Здравствуйте, админстратор. Выберите интересующий вас пункт из меню ниже:',
-                                 reply_markup=inline_menu)
+            self._outbox.send_message(telegram_id,
+                                      'Здравствуйте, админстратор. Выберите интересующий вас пункт из меню ниже:',
+                                      reply_markup=inline_menu)
 
-        check_customer = await User.query.where(User.telegram_id == str(telegram_id)).gino.first()
-        if check_customer:
+        if identity.is_user:
             inline_menu = await get_kb_menu_for_customer()
-            await message.answer('Выберите интересующий вас пункт из меню ниже:',
-                                 reply_markup=inline_menu)
+            self._outbox.send_message(telegram_id, 'Выберите интересующий вас пункт из меню ниже:',
+                                      reply_markup=inline_menu)
 
-        if all([(not check_customer), (not check_admin)]):
-            await message.answer('Здравствуйте, мы с Вами не знакомы. \n'
-                                 'Введите ваше ФИО, номер телефона, рост и вес.')
+        if all([(not identity.is_user), (not identity.is_admin)]):
+            self._outbox.send_message(telegram_id, 'Здравствуйте, мы с Вами не знакомы. \n'
+                                                   'Введите ваше ФИО, номер телефона, рост и вес.')
             example_registration = ' '.join(['Пример:', 'Иванов Иван Иванович', '+79020007126', '175', '80'])
-            await self._bot.send_message(
+            self._outbox.send_message(
                 chat_id=telegram_id,
                 text=example_registration
             )
             await Registration.step_1.set()
 
-    # async def _edit_order(self, callback_query: CallbackQuery):
-    #     telegram_id = callback_query.id
-    #
-    #     await callback_query.answer(cache_time=60)
-    #     await self._bot.answer_callback_query(callback_query.id)
-    #     await callback_query.message.edit_reply_markup(reply_markup=None)
-    #
-    #     inline_menu = await get_kb_orders_menu()
-    #     await self._bot.send_message(telegram_id, 'Выберите интересующую вас заявку:',
-    #                                  reply_markup=inline_menu)
+    async def _broadcast(self, message: Message):
+        telegram_id = message.chat.id
+
+        identity = await self._identities.resolve(telegram_id)
+        if not identity.is_admin:
+            return
+        text = message.get_args()
+        if not text:
+            self._outbox.send_message(telegram_id, 'Введите текст рассылки после команды: /broadcast <текст>')
+            return
+        if await self._broadcaster.start(text, telegram_id) is None:
+            self._outbox.send_message(telegram_id, 'Рассылка уже идет. Остановить: /broadcast_stop')
+
+    async def _broadcast_stop(self, message: Message):
+        telegram_id = message.chat.id
+
+        identity = await self._identities.resolve(telegram_id)
+        if not identity.is_admin:
+            return
+        if await self._broadcaster.stop():
+            self._outbox.send_message(telegram_id, 'Рассылка будет остановлена.')
+        else:
+            self._outbox.send_message(telegram_id, 'Нет активной рассылки.')
+
+    async def _report(self, message: Message):
+        telegram_id = message.chat.id
+
+        identity = await self._identities.resolve(telegram_id)
+        if not identity.is_admin:
+            return
+        args = message.get_args().split()
+        report_format = args.pop().lower() if args and args[-1].lower() in (CSV, XLSX) else CSV
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        try:
+            dates = [datetime.strptime(arg, self._config.date_time_format_report) for arg in args]
+        except ValueError:
+            dates = None
+        if dates is None or len(dates) > 2:
+            example = today.strftime(self._config.date_time_format_report)
+            self._outbox.send_message(telegram_id, f'Введите период отчета: /report <с> [по] [csv|xlsx], '
+                                                   f'например /report {example} {example} xlsx')
+            return
+        if report_format == XLSX and not self._reporter.xlsx_available():
+            self._outbox.send_message(telegram_id, 'Отчет в XLSX недоступен, отправляю CSV.')
+            report_format = CSV
+        # Without dates the report covers the last 30 days, the end date is included
+        start = dates[0] if dates else today - timedelta(days=30)
+        end = (dates[-1] if dates else today) + timedelta(days=1)
+        self._outbox.send_message(telegram_id, 'Формирую отчет, файл придет отдельным сообщением.')
+        self._reporter.request(telegram_id, start, end, report_format)
+
+    async def _show_orders(self, callback_query: CallbackQuery):
+        telegram_id = callback_query.from_user.id
+
+        identity, = await self._callbacks.ack(callback_query, self._identities.resolve(telegram_id))
+        if not identity.is_admin:
+            return
+        inline_menu = await get_kb_orders_menu(page_size=self._config.orders_page_size)
+        self._callbacks.reply(callback_query, 'Выберите интересующую вас заявку:', reply_markup=inline_menu)
+
+    async def _show_orders_page(self, callback_query: CallbackQuery):
+        telegram_id = callback_query.from_user.id
+
+        status, cursor, forward = parse_orders_page(callback_query.data)
+        identity, = await self._callbacks.ack(callback_query, self._identities.resolve(telegram_id), close_markup=False)
+        if not identity.is_admin:
+            return
+        inline_menu = await get_kb_orders_menu(status, cursor, forward, page_size=self._config.orders_page_size)
+        self._callbacks.edit_markup(callback_query, reply_markup=inline_menu)
+
+    async def _show_order(self, callback_query: CallbackQuery):
+        telegram_id = callback_query.from_user.id
+
+        _, order_id = parse_order(callback_query.data)
+        identity, = await self._callbacks.ack(callback_query, self._identities.resolve(telegram_id))
+        if not identity.is_admin:
+            return
+        order = await order_details_query(order_id).gino.first()
+        if order is None:
+            self._callbacks.reply(callback_query, 'Заявка не найдена.')
+            return
+        order_text = f"""
+Заявка от {order.create_datetime.strftime(self._config.date_time_format)}
+Заказчик: {order.user_name or '-'}, {order.phone_number or '-'}
+Инвентарь: {order.ordered_item}
+Статус: {ORDER_STATUS_TITLES.get(order.status, order.status)}"""
+        self._callbacks.reply(callback_query, order_text,
+                              reply_markup=await get_kb_status_menu(order.id, order.status))
+
+    async def _set_order_status(self, callback_query: CallbackQuery):
+        telegram_id = callback_query.from_user.id
+
+        status, new_status, order_id = parse_order_status(callback_query.data)
+        identity, = await self._callbacks.ack(callback_query, self._identities.resolve(telegram_id))
+        if not identity.is_admin:
+            return
+        order = await Order.transition(order_id, status, new_status)
+        if order is None:
+            self._callbacks.reply(callback_query, 'Статус заявки уже изменен, откройте ее заново из списка.')
+            return
+        self._callbacks.reply(callback_query, f'Статус заявки на {order.ordered_item}: '
+                                              f'{ORDER_STATUS_TITLES[new_status]}.')
+        if new_status == Order.IN_PROGRESS:
+            await self._schedule_reminders(order)
+        elif status == Order.IN_PROGRESS:
+            await self._reminders.cancel(*self._reminder_ids(order))
+
+    @staticmethod
+    def _reminder_ids(order: Order) -> Tuple[str, str]:
+        return f'{order.id}:ending', f'{order.id}:due'
+
+    async def _schedule_reminders(self, order: Order):
+        # The rental starts when the order goes in progress and lasts as long as the booked item's rental time
+        duration = rental_duration(order.rental_time, order.rental_unit)
+        if duration is None or order.telegram_id is None:
+            return
+        ending_id, due_id = self._reminder_ids(order)
+        chat_id = int(order.telegram_id)
+        due = time.time() + duration.total_seconds()
+        lead = self._config.reminder_lead
+        if duration.total_seconds() > 2 * lead:
+            await self._reminders.schedule(
+                ending_id, due - lead, chat_id,
+                f'Напоминание: аренда «{order.ordered_item}» закончится через {lead // 60} мин.'
+            )
+        await self._reminders.schedule(
+            due_id, due, chat_id, f'Срок аренды «{order.ordered_item}» истек. Пожалуйста, верните инвентарь.'
+        )
 
     async def _registration_step_1(self, message: Message, state: FSMContext):
         telegram_id = message.chat.id
 
         message_user = message.text.split(' ')
         if len(message_user) != 6:
-            await message.answer('Введите как показано в примере')
+            self._outbox.send_message(telegram_id, 'Введите как показано в примере')
             return
         name_message_user = message_user[0]+' '+message_user[1]+' '+message_user[2]
         phone_number_message_user = message_user[3]
@@ -179,6 +580,8 @@ class TelegramBotService:
             weight=weight_message_user,
             telegram_id=str(telegram_id)
         )
+        identity = await self._identities.resolve(telegram_id)
+        await self._identities.store(replace(identity, user_name=new_user.name, phone_number=new_user.phone_number))
 
         result = f"""
 Данные успешно сохранены!
@@ -187,91 +590,118 @@ class TelegramBotService:
 Ваш вес: {new_user.weight} кг
 Ваш рост: {new_user.height} см"""
 
-        await self._bot.send_message(telegram_id, result)
-        await self._bot.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
+        self._outbox.send_message(telegram_id, result)
+        self._outbox.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
         await state.finish()
 
     async def _show_links(self, callback_query: CallbackQuery):
-        telegram_id = callback_query.from_user.id
-
-        await callback_query.answer(cache_time=60)
-        await self._bot.answer_callback_query(callback_query.id)
-        await callback_query.message.edit_reply_markup(reply_markup=None)
-
-        inline_kb = await get_kb_out_links()
-        await self._bot.send_message(telegram_id, 'Мы в соцсетях!',
-                                     reply_markup=inline_kb)
+        inline_kb, = await self._callbacks.ack(callback_query, get_kb_out_links(), cache_time=60)
+        self._callbacks.reply(callback_query, 'Мы в соцсетях!', reply_markup=inline_kb)
+
+    async def _inline_search(self, inline_query: InlineQuery):
+        offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+        limit = self._config.inline_results
+        items = await self._search.search(inline_query.query, limit=limit, offset=offset)
+        results = [
+            InlineQueryResultArticle(
+                id=str(item.id),
+                title=item.title,
+                description=item.price_text,
+                input_message_content=InputTextMessageContent(f'{item.title}\nСтоимость: {item.price_text}')
+            )
+            for item in items
+        ]
+        # The answer has no chat to rate limit and the user is waiting for it, so it skips the outbox
+        await inline_query.answer(
+            results,
+            cache_time=self._config.inline_cache_time,
+            next_offset=str(offset + limit) if len(items) == limit else ''
+        )
 
     async def _book(self, callback_query: CallbackQuery):
-        telegram_id = callback_query.from_user.id
+        tree, _ = await self._callbacks.ack(
+            callback_query, self._catalog_tree(), Book.step_1.set(), cache_time=60
+        )
+        self._callbacks.reply(callback_query, tree.title(), reply_markup=await tree.markup())
 
-        await callback_query.answer(cache_time=60)
-        await self._bot.answer_callback_query(callback_query.id)
-        await callback_query.message.edit_reply_markup(reply_markup=None)
+    async def _catalog_tree(self) -> CatalogTree:
+        return (await self._catalog.snapshot()).tree
 
-        inline_kb = await get_kb_items_to_book()
-        await self._bot.send_message(telegram_id, 'Выберите интересующий вас инвентарь:',
-                                     reply_markup=inline_kb)
+    async def _book_navigate(self, callback_query: CallbackQuery):
+        tag, category, subcategory, page = parse_catalog_level(callback_query.data)
+        tree, = await self._callbacks.ack(callback_query, self._catalog_tree(), close_markup=False)
+        inline_kb = await tree.markup(category, subcategory, page) if tag == tree.tag else None
+        if inline_kb is None:
+            await self._catalog_changed(callback_query, tree)
+            return
+        # Navigation edits the message in place, every tap is served from the memoized keyboards
+        self._callbacks.edit(callback_query, tree.title(category, subcategory), reply_markup=inline_kb)
 
-        await Book.step_1.set()
+    async def _catalog_changed(self, callback_query: CallbackQuery, tree: CatalogTree):
+        self._callbacks.reply(callback_query, f'Каталог обновился. {tree.title()}', reply_markup=await tree.markup())
 
-    async def _book_step_1(self, callback_query: CallbackQuery):
-        call = callback_query.data
+    async def _book_step_1(self, callback_query: CallbackQuery, state: FSMContext):
         telegram_id = callback_query.from_user.id
 
-        await callback_query.answer(cache_time=60)
-        await self._bot.answer_callback_query(callback_query.id)
-        await callback_query.message.edit_reply_markup(reply_markup=None)
-
-        inline_kb = await get_kb_order()
-
-        item_data = await Item.query.where(Item.data == str(call)).gino.first()
-        item_name = item_data.name
-        item_price = item_data.price
-
-        await Order.create(
-            telegram_id=str(telegram_id),
-            ordered_item=item_name,
-            status='in treatment'
+        tag, index = parse_catalog_item(callback_query.data)
+        tree, inline_kb = await self._callbacks.ack(callback_query, self._catalog_tree(), get_kb_order(), cache_time=60)
+        if tag != tree.tag or not 0 <= index < len(tree.items):
+            await self._catalog_changed(callback_query, tree)
+            return
+        item_data = tree.items[index]
+        item_name = item_data.title
+        item_price = item_data.price_text
+
+        order, _ = await asyncio.gather(
+            Order.create(
+                telegram_id=str(telegram_id),
+                ordered_item=item_name,
+                status=Order.DRAFT,
+                rental_time=item_data.rental_time,
+                rental_unit=item_data.rental_unit
+            ),
+            Book.step_2.set()
         )
+        # The confirmation handlers act on this draft by primary key
+        await state.update_data(order_id=str(order.id))
 
-        await self._bot.send_message(telegram_id, f'Вы выбрали: {item_name}.\n'
-                                                  f'Стоимость бронирования этого инвентаря: {item_price}.\n'
-                                                  f'Хотите подать заявку?',
-                                     reply_markup=inline_kb)
-        await Book.step_2.set()
+        self._callbacks.reply(callback_query, f'Вы выбрали: {item_name}.\n'
+                                              f'Стоимость бронирования этого инвентаря: {item_price}.\n'
+                                              f'Хотите подать заявку?',
+                              reply_markup=inline_kb)
 
     async def _book_step_2_1(self, callback_query: CallbackQuery, state: FSMContext):
         telegram_id = callback_query.from_user.id
 
-        await callback_query.answer(cache_time=60)
-        await self._bot.answer_callback_query(callback_query.id)
-        await callback_query.message.edit_reply_markup(reply_markup=None)
-
-        right_order = await Order.query.where(Order.telegram_id == str(telegram_id)).gino.first()
-        user_data = await User.query.where(User.telegram_id == str(telegram_id)).gino.first()
+        data = await state.get_data()
+        right_order, user_data = await self._callbacks.ack(
+            callback_query,
+            Order.transition(data.get('order_id'), Order.DRAFT, Order.IN_TREATMENT),
+            self._identities.resolve(telegram_id),
+            cache_time=60
+        )
+        if right_order is None:
+            self._callbacks.reply(callback_query, 'Заявка устарела. Введите команду /menu и выберите инвентарь заново.')
+            await state.finish()
+            return
 
-        await self._bot.send_message(telegram_id, 'Заявка подана. Ожидайте звонка!')
+        self._callbacks.reply(callback_query, 'Заявка подана. Ожидайте звонка!')
         order_text = f"""
 Поступила заявка. Информация о заказчике:
-Имя: {user_data.name}.
+Имя: {user_data.user_name}.
 Номер телефона: {user_data.phone_number}.
 Заявка на следующий инвентарь: {right_order.ordered_item}.
 Заказчик ждет вашего звонка!"""
-        await self._bot.send_message(227448700, order_text)
+        self._notifier.notify(order_text, role=self._config.order_notification_role, order_id=right_order.id)
         await state.finish()
 
     async def _book_step_2_2(self, callback_query: CallbackQuery, state: FSMContext):
         telegram_id = callback_query.from_user.id
 
-        await callback_query.answer(cache_time=60)
-        await self._bot.answer_callback_query(callback_query.id)
-        await callback_query.message.edit_reply_markup(reply_markup=None)
-
-        await self._bot.send_message(telegram_id, 'Заявка сброшена.')
-        await self._bot.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
+        data = await state.get_data()
+        await self._callbacks.ack(callback_query, Order.discard_draft(data.get('order_id')), cache_time=60)
 
-        wrong_order = await Order.query.where(Order.telegram_id == str(telegram_id)).gino.first()
-        wrong_order.delete()
+        self._callbacks.reply(callback_query, 'Заявка сброшена.')
+        self._outbox.send_message(telegram_id, 'Введите команду /menu посмотреть список доступных функций')
 
         await state.finish()
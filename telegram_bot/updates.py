@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+logger = logging.getLogger('telegram_bot_service.updates')
+
+
+def update_chat_id(update: Update) -> Optional[int]:
+    message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+    if message is not None:
+        return message.chat.id
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for event in (update.inline_query, update.chosen_inline_result, update.shipping_query, update.pre_checkout_query):
+        if event is not None:
+            return event.from_user.id
+    return None
+
+
+class UpdateWorkerPool:
+    """Processes updates concurrently while keeping updates of one chat in order.
+
+    Every chat is pinned to one worker by its id, so handlers of one chat never overlap and FSM
+    transitions stay consistent. Bounded queues push back on the receiver when workers fall behind.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        workers: int = 16,
+        queue_size: int = 1000,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.loop = loop or asyncio.get_event_loop()
+        self._dispatcher = dispatcher
+        self._queues: List[asyncio.Queue] = [
+            asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)
+        ]
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self):
+        Bot.set_current(self._dispatcher.bot)
+        Dispatcher.set_current(self._dispatcher)
+        self._tasks = [self.loop.create_task(self._work(queue)) for queue in self._queues]
+
+    async def put(self, update: Update):
+        chat_id = update_chat_id(update)
+        queue = self._queues[(chat_id if chat_id is not None else update.update_id) % len(self._queues)]
+        await queue.put(update)
+
+    async def close(self):
+        for queue in self._queues:
+            await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                # notify() runs the update middlewares, process_update() alone would skip them
+                await self._dispatcher.updates_handler.notify(update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception('Update %s failed', update.update_id)
+            finally:
+                queue.task_done()
+
+
+async def prepare_polling(dispatcher: Dispatcher):
+    await dispatcher.bot.delete_webhook()
+    await dispatcher.skip_updates()
+
+
+async def poll_updates(dispatcher: Dispatcher, sink: Callable[[Update], Awaitable[None]], timeout: int = 20,
+                       limit: int = 100, error_delay: float = 5.0, first_poll: Optional[asyncio.Future] = None):
+    """Long polls getUpdates into ``sink``; ``first_poll`` is resolved once the first request returned."""
+    offset = None
+    while True:
+        try:
+            # The first request does not wait for new updates, so startup is not held up by an idle bot
+            poll_timeout = 0 if first_poll is not None and not first_poll.done() else timeout
+            updates = await dispatcher.bot.get_updates(offset=offset, limit=limit, timeout=poll_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Get updates failed, retry in %s s', error_delay)
+            if first_poll is not None and not first_poll.done():
+                first_poll.set_result(False)
+            await asyncio.sleep(error_delay)
+            continue
+        if first_poll is not None and not first_poll.done():
+            first_poll.set_result(True)
+        for update in updates:
+            await sink(update)
+        if updates:
+            offset = updates[-1].update_id + 1
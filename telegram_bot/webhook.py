@@ -0,0 +1,60 @@
+import hmac
+import logging
+from typing import Awaitable, Callable, Optional
+
+from aiogram.types import Update
+from aiohttp import web
+
+
+logger = logging.getLogger('telegram_bot_service.webhook')
+
+UpdateSink = Callable[[Update], Awaitable[None]]
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and hands them to ``sink``.
+
+    With ``secret_token`` set, requests without the same token in the ``X-Telegram-Bot-Api-Secret-Token``
+    header, which Telegram sends when the webhook was registered with it, are rejected.
+    """
+
+    def __init__(self, sink: UpdateSink, host: str = '0.0.0.0', port: int = 8080, path: str = '/webhook',
+                 secret_token: Optional[str] = None):
+        self._sink = sink
+        self.host = host
+        self.port = port
+        self.path = path
+        self._secret_token = secret_token
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info('Webhook server listening on %s:%s%s', self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self._secret_token is not None and not hmac.compare_digest(
+            request.headers.get(SECRET_TOKEN_HEADER, '').encode(), self._secret_token.encode()
+        ):
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Valid JSON that is no object is as malformed as broken JSON, a 500 would make Telegram redeliver it
+        if not isinstance(payload, dict):
+            return web.Response(status=400)
+        update = Update(**payload)
+        # Telegram only needs a 200, the update is processed after the response is sent
+        await self._sink(update)
+        return web.Response()
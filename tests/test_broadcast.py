@@ -0,0 +1,43 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from redis_pool import close_redis, create_redis
+from telegram_bot.broadcast import Broadcaster, LockLost
+
+
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+
+
+def test_stalled_run_neither_extends_nor_releases_a_lock_taken_over():
+    async def run():
+        try:
+            redis = await create_redis(REDIS_URL, connect_timeout=1)
+        except (OSError, asyncio.TimeoutError) as error:
+            pytest.skip(f'Redis is not available at {REDIS_URL}: {error!r}')
+        prefix = f'test:{uuid.uuid4().hex}'
+        stalled = Broadcaster(redis, None, None, key_prefix=prefix, lock_ttl=60)
+        current = Broadcaster(redis, None, None, key_prefix=prefix, lock_ttl=60)
+        try:
+            assert await stalled._lock()
+            assert not await current._lock()
+            # The stalled run's lock expires and the other run takes it
+            await redis.delete(f'{prefix}:lock')
+            assert await current._lock()
+            await redis.set(f'{prefix}:active', 'job')
+            with pytest.raises(LockLost):
+                await stalled._refresh_lock()
+            with pytest.raises(LockLost):
+                await stalled._finish('job')
+            assert await redis.get(f'{prefix}:lock', encoding='utf-8') == current._token
+            assert await redis.get(f'{prefix}:active', encoding='utf-8') == 'job'
+            await current._refresh_lock()
+            await current._finish('job')
+            return await redis.exists(f'{prefix}:lock', f'{prefix}:active')
+        finally:
+            await redis.delete(f'{prefix}:lock', f'{prefix}:active')
+            await close_redis(redis)
+
+    assert asyncio.run(run()) == 0
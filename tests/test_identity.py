@@ -0,0 +1,42 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from redis_pool import close_redis, create_redis
+from telegram_bot.identity import Identity, IdentityResolver
+
+
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+
+
+def test_listener_reconnect_abandons_redis_entries():
+    async def run():
+        try:
+            redis = await create_redis(REDIS_URL, connect_timeout=1)
+        except (OSError, asyncio.TimeoutError) as error:
+            pytest.skip(f'Redis is not available at {REDIS_URL}: {error!r}')
+        prefix = f'test:{uuid.uuid4().hex}'
+        try:
+            resolver = IdentityResolver(redis, key_prefix=prefix)
+            other = IdentityResolver(redis, key_prefix=prefix)
+            await resolver.store(Identity('1', admin_name='Админ'))
+            before = (await resolver._redis_get('1'), await other._redis_get('1'))
+            # The listener reconnected, changes made in between were never announced
+            resolver._on_identities_changed(None)
+            after = (resolver._local.get('1'), await resolver._redis_get('1'))
+            # A process started later shares the new key version
+            joined = IdentityResolver(redis, key_prefix=prefix)
+            await resolver.store(Identity('1', user_name='Клиент'))
+            return before, after, await joined._redis_get('1')
+        finally:
+            keys = await redis.keys(f'{prefix}:*')
+            if keys:
+                await redis.delete(*keys)
+            await close_redis(redis)
+
+    before, after, joined = asyncio.run(run())
+    assert before == (Identity('1', admin_name='Админ'), Identity('1', admin_name='Админ'))
+    assert after == (None, None)
+    assert joined == Identity('1', user_name='Клиент')
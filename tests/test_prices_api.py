@@ -0,0 +1,194 @@
+import asyncio
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import prices_api
+from prices_api import PriceFeed, content_hash, feed_item, iter_json_array
+
+
+def entry(name: str, value=100, category: str = 'Велосипеды', subcategory: str = 'Горные', time=1, unit='час'):
+    return {
+        'value': value,
+        'timeEntity': {'time': time, 'name': unit},
+        'categoryEntity': {'name': category},
+        'subCategoryEntity': {'name': subcategory, 'categories': {'name': name}}
+    }
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def collect(chunks) -> list:
+    return [value async for value in iter_json_array(chunks)]
+
+
+FEED = [entry('Stels Navigator'), entry('Шлем «Защита»', value=12.5), {'nested': [1, {'a': ']'}]}, 'строка', 7]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 1 << 20])
+def test_iter_json_array_chunk_boundaries(size):
+    data = json.dumps(FEED, ensure_ascii=False, indent=2).encode()
+    assert asyncio.run(collect(chunked(data, size))) == FEED
+
+
+def test_iter_json_array_empty_and_whitespace():
+    assert asyncio.run(collect(chunked(b' \n[ ]\n', 1))) == []
+    assert asyncio.run(collect(chunked(b'[1 , 2,3]', 2))) == [1, 2, 3]
+
+
+@pytest.mark.parametrize('chunks', [
+    [b'[12', b'34]'],
+    [b'[12', b'34, -5', b'6.7', b'5e', b'1, tr', b'ue, nu', b'll, 1', b'0 ]'],
+    [b'["ab', b'c", 98', b'7', b'6', b'5', b'\n', b']'],
+])
+def test_iter_json_array_scalars_split_across_chunks(chunks):
+    async def split():
+        for chunk in chunks:
+            yield chunk
+
+    assert asyncio.run(collect(split())) == json.loads(b''.join(chunks))
+
+
+@pytest.mark.parametrize('data', [b'', b'[', b'[1, 2', b'[{"value": 1', '[{"name": "Шлем'.encode()[:-1]])
+def test_iter_json_array_truncated_feed(data):
+    with pytest.raises(ValueError, match='ended unexpectedly'):
+        asyncio.run(collect(chunked(data, 3)))
+
+
+def test_iter_json_array_not_an_array():
+    with pytest.raises(ValueError, match='not a JSON array'):
+        asyncio.run(collect(chunked(b'{"value": 1}', 4)))
+
+
+def test_feed_item():
+    item = feed_item(entry('Stels Navigator', value=99.999, time='3', unit='часа'))
+    assert item.name == 'Stels Navigator'
+    assert item.price == Decimal('100.00')
+    assert item.rental_time == 3
+    assert item.rental_unit == 'часа'
+    assert (item.category, item.subcategory) == ('Велосипеды', 'Горные')
+    assert len(item.data) == 16
+    assert item.content_hash == content_hash(item.name, item.price, 3, 'часа', 'Велосипеды', 'Горные')
+
+
+def test_feed_item_key_ignores_price():
+    assert feed_item(entry('Stels', value=100)).data == feed_item(entry('Stels', value=150)).data
+    assert feed_item(entry('Stels')).data != feed_item(entry('Stels', subcategory='Детские')).data
+    assert feed_item(entry('Stels')).data != feed_item(entry('Stels', time=2)).data
+
+
+def test_feed_item_malformed():
+    with pytest.raises(KeyError):
+        feed_item({'value': 1})
+    no_time = entry('Stels', time=None, unit=None)
+    assert (feed_item(no_time).rental_time, feed_item(no_time).rental_unit) == (None, '')
+
+
+async def serve_feed(body: bytes) -> TestServer:
+    async def prices(request: web.Request) -> web.Response:
+        return web.Response(body=body, content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/prices', prices)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_fetch_skips_malformed_entries():
+    async def fetch():
+        server = await serve_feed(json.dumps([entry('Stels'), {'value': 1}, entry('Шлем')]).encode())
+        try:
+            return await PriceFeed(str(server.make_url('/prices'))).fetch()
+        finally:
+            await server.close()
+
+    items = asyncio.run(fetch())
+    assert sorted(item.name for item in items.values()) == ['Stels', 'Шлем']
+
+
+def test_fetch_truncated_feed_fails():
+    async def fetch():
+        server = await serve_feed(json.dumps([entry('Stels'), entry('Шлем')]).encode()[:-20])
+        try:
+            await PriceFeed(str(server.make_url('/prices'))).fetch()
+        finally:
+            await server.close()
+
+    with pytest.raises(ValueError):
+        asyncio.run(fetch())
+
+
+def current_row(item) -> SimpleNamespace:
+    return SimpleNamespace(**item._asdict())
+
+
+def sync(monkeypatch, feed: list, current: list) -> tuple:
+    calls = []
+
+    class Query:
+        class gino:
+            @staticmethod
+            async def all():
+                return current
+
+    async def upsert(items, removed):
+        calls.append((sorted(item.name for item in items), sorted(removed)))
+
+    monkeypatch.setattr(prices_api, 'current_items_query', Query)
+    monkeypatch.setattr(PriceFeed, '_upsert', staticmethod(upsert))
+
+    async def run():
+        server = await serve_feed(json.dumps(feed).encode())
+        try:
+            return await PriceFeed(str(server.make_url('/prices'))).sync()
+        finally:
+            await server.close()
+
+    return asyncio.run(run()), calls
+
+
+def test_sync_writes_changed_and_removes_missing_items(monkeypatch):
+    unchanged, repriced, gone = feed_item(entry('Stels')), feed_item(entry('Шлем')), feed_item(entry('Самокат'))
+    current = [current_row(unchanged), current_row(repriced._replace(price=Decimal('1.00'))), current_row(gone)]
+    stats, calls = sync(monkeypatch, [entry('Stels'), entry('Шлем'), entry('Палатка')], current)
+    assert calls == [(['Палатка', 'Шлем'], [gone.data])]
+    assert (stats['feed'], stats['changed'], stats['removed']) == (3, 2, 1)
+
+
+def test_sync_unchanged_feed_writes_nothing(monkeypatch):
+    stats, calls = sync(monkeypatch, [entry('Stels')], [current_row(feed_item(entry('Stels')))])
+    assert calls == []
+    assert (stats['changed'], stats['removed']) == (0, 0)
+
+
+def test_sync_empty_feed_keeps_catalog(monkeypatch):
+    stats, calls = sync(monkeypatch, [], [current_row(feed_item(entry('Stels')))])
+    assert calls == []
+    assert stats['removed'] == 0
+
+
+def test_close_cancels_the_periodic_sync(monkeypatch):
+    async def run():
+        started = asyncio.Event()
+
+        async def sync(self):
+            started.set()
+            await asyncio.sleep(3600)
+
+        monkeypatch.setattr(PriceFeed, 'sync', sync)
+        feed = PriceFeed('http://127.0.0.1:1/prices', interval=0)
+        feed.start()
+        await asyncio.wait_for(started.wait(), 1)
+        task = feed._task
+        await feed.close()
+        return task.cancelled(), feed._task
+
+    assert asyncio.run(run()) == (True, None)
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Dict, List, Tuple
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message, Update
+
+from redis_pool import close_redis, create_redis
+from telegram_bot.streams import (
+    UpdateStreamConsumer, UpdateStreamProducer, next_stream_id, stream_key, worker_partitions
+)
+
+
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+PARTITIONS = 4
+
+
+def message_update(update_id: int, chat_id: int) -> Update:
+    return Update(**{
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': str(update_id)
+        }
+    })
+
+
+def with_redis(test):
+    """Runs ``test(redis, prefix)`` against a local Redis, skips when there is none."""
+    async def run():
+        try:
+            redis = await create_redis(REDIS_URL, connect_timeout=1)
+        except (OSError, asyncio.TimeoutError) as error:
+            pytest.skip(f'Redis is not available at {REDIS_URL}: {error!r}')
+        prefix = f'test:{uuid.uuid4().hex}'
+        try:
+            return await test(redis, prefix)
+        finally:
+            keys = await redis.keys(f'{prefix}:*')
+            if keys:
+                await redis.delete(*keys)
+            await close_redis(redis)
+
+    return asyncio.run(run())
+
+
+def recording_dispatcher(handled: Dict[int, List[int]]) -> Dispatcher:
+    dp = Dispatcher(Bot(TOKEN))
+
+    async def handler(message: Message):
+        handled.setdefault(message.chat.id, []).append(message.message_id)
+
+    dp.register_message_handler(handler)
+    return dp
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+async def pending_count(redis, prefix: str, group: str = 'workers') -> int:
+    total = 0
+    for partition in range(PARTITIONS):
+        total += (await redis.xpending(stream_key(prefix, partition), group))[0]
+    return total
+
+
+def test_next_stream_id():
+    assert next_stream_id(b'1526569495631-0') == '1526569495631-1'
+    assert next_stream_id(b'7-41') == '7-42'
+
+
+def test_worker_partitions_cover_every_partition_once():
+    owned = [worker_partitions(10, 3, index) for index in range(3)]
+    assert sorted(partition for partitions in owned for partition in partitions) == list(range(10))
+
+
+def test_producer_keeps_a_chat_in_one_partition_in_order():
+    async def test(redis, prefix):
+        producer = UpdateStreamProducer(redis, prefix=prefix, partitions=PARTITIONS)
+        sent: Dict[int, List[int]] = {}
+        for update_id in range(1, 41):
+            chat_id = 100 + update_id % 7
+            sent.setdefault(chat_id, []).append(update_id)
+            await producer.put(message_update(update_id, chat_id))
+        streams: Dict[int, List[Tuple[int, int]]] = {}
+        for partition in range(PARTITIONS):
+            for _, fields in await redis.xrange(stream_key(prefix, partition)):
+                message = Update.to_object(json.loads(fields[b'update'])).message
+                streams.setdefault(message.chat.id, []).append((partition, message.message_id))
+        return sent, streams
+
+    sent, streams = with_redis(test)
+    for chat_id, entries in streams.items():
+        assert {partition for partition, _ in entries} == {chat_id % PARTITIONS}
+        assert [update_id for _, update_id in entries] == sent[chat_id]
+
+
+def test_workers_process_chats_in_order_and_ack():
+    async def test(redis, prefix):
+        handled: Dict[int, List[int]] = {}
+        dp = recording_dispatcher(handled)
+        producer = UpdateStreamProducer(redis, prefix=prefix, partitions=PARTITIONS)
+        sent: Dict[int, List[int]] = {}
+        for update_id in range(1, 61):
+            chat_id = 200 + update_id % 9
+            sent.setdefault(chat_id, []).append(update_id)
+            await producer.put(message_update(update_id, chat_id))
+        consumers = [
+            UpdateStreamConsumer(redis, dp, worker_partitions(PARTITIONS, 2, index), f'worker-{index}',
+                                 prefix=prefix, batch_size=5, block_ms=50)
+            for index in range(2)
+        ]
+        for consumer in consumers:
+            consumer.start()
+        try:
+            await wait_for(lambda: sum(consumer.processed for consumer in consumers) == 60)
+        finally:
+            for consumer in consumers:
+                await consumer.stop()
+            await dp.bot.session.close()
+        return sent, handled, await pending_count(redis, prefix)
+
+    sent, handled, pending = with_redis(test)
+    assert handled == sent
+    assert pending == 0
+
+
+def test_stale_entries_of_another_consumer_are_claimed():
+    async def test(redis, prefix):
+        stream = stream_key(prefix, 0)
+        await redis.xgroup_create(stream, 'workers', latest_id='0', mkstream=True)
+        producer = UpdateStreamProducer(redis, prefix=prefix, partitions=1)
+        for update_id in range(1, 4):
+            await producer.put(message_update(update_id, 300))
+        for update_id in range(4, 9):
+            await producer.put(message_update(update_id, 301))
+        # A live consumer just took the first entries, a crashed one took the rest long ago. The young entries
+        # come first in the pending list and fill the first page.
+        await redis.xread_group('workers', 'alive', [stream], count=3, latest_ids=['>'])
+        dead = await redis.xread_group('workers', 'dead', [stream], count=5, latest_ids=['>'])
+        for _, message_id, _ in dead:
+            await redis.execute('XCLAIM', stream, 'workers', 'dead', 0, message_id, 'IDLE', 120000)
+
+        handled: Dict[int, List[int]] = {}
+        dp = recording_dispatcher(handled)
+        consumer = UpdateStreamConsumer(redis, dp, [0], 'worker-0', prefix=prefix, batch_size=2, block_ms=50,
+                                        claim_idle_ms=60000)
+        consumer.start()
+        try:
+            await wait_for(lambda: consumer.processed == 5)
+        finally:
+            await consumer.stop()
+            await dp.bot.session.close()
+        owners = {owner.decode(): int(count) for owner, count in (await redis.xpending(stream, 'workers'))[3]}
+        return handled, consumer.claimed, owners
+
+    handled, claimed, owners = with_redis(test)
+    assert handled == {301: [4, 5, 6, 7, 8]}
+    assert claimed == 5
+    assert owners == {'alive': 3}
+
+
+def test_stale_entries_are_claimed_while_running():
+    async def test(redis, prefix):
+        stream = stream_key(prefix, 0)
+        handled: Dict[int, List[int]] = {}
+        dp = recording_dispatcher(handled)
+        consumer = UpdateStreamConsumer(redis, dp, [0], 'worker-0', prefix=prefix, block_ms=50,
+                                        claim_idle_ms=100, claim_interval=0.1)
+        consumer.start()
+        try:
+            # Gives the worker time to create the group and block on its first read
+            await asyncio.sleep(0.2)
+            # Another worker takes an entry and crashes while this one keeps running. The entry is added and read
+            # in one transaction, the blocked read of the running worker must not get it first.
+            transaction = redis.multi_exec()
+            transaction.xadd(stream, {'update': json.dumps(message_update(1, 400).to_python())})
+            transaction.xread_group('workers', 'crashed', [stream], timeout=None, count=1, latest_ids=['>'])
+            await transaction.execute()
+            await wait_for(lambda: consumer.processed == 1)
+        finally:
+            await consumer.stop()
+            await dp.bot.session.close()
+        return handled, consumer.claimed, (await redis.xpending(stream, 'workers'))[0]
+
+    handled, claimed, pending = with_redis(test)
+    assert handled == {400: [1]}
+    assert (claimed, pending) == (1, 0)
@@ -0,0 +1,146 @@
+import asyncio
+import random
+from typing import Dict, List
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message, Update
+
+from telegram_bot.updates import UpdateWorkerPool, update_chat_id
+
+
+TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+def message_update(update_id: int, chat_id: int, text: str = '') -> Update:
+    return Update(**{
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': text or str(update_id)
+        }
+    })
+
+
+def dispatcher() -> Dispatcher:
+    return Dispatcher(Bot(TOKEN))
+
+
+def test_update_chat_id():
+    assert update_chat_id(message_update(1, 42)) == 42
+    callback = Update(**{'update_id': 2, 'callback_query': {
+        'id': '1', 'chat_instance': '1', 'from': {'id': 7, 'is_bot': False, 'first_name': 'Test'}
+    }})
+    assert update_chat_id(callback) == 7
+    assert update_chat_id(Update(update_id=3)) is None
+
+
+def test_updates_of_one_chat_are_processed_in_order_and_never_overlap():
+    async def run():
+        dp = dispatcher()
+        handled: Dict[int, List[int]] = {}
+        active = set()
+        overlaps = []
+        rnd = random.Random(1)
+
+        async def handler(message: Message):
+            if message.chat.id in active:
+                overlaps.append(message.chat.id)
+            active.add(message.chat.id)
+            await asyncio.sleep(rnd.random() / 100)
+            handled.setdefault(message.chat.id, []).append(message.message_id)
+            active.discard(message.chat.id)
+
+        dp.register_message_handler(handler)
+        pool = UpdateWorkerPool(dp, workers=4, queue_size=400)
+        pool.start()
+        sent: Dict[int, List[int]] = {}
+        for update_id in range(1, 201):
+            chat_id = rnd.choice((11, 12, 13, 14, 15, 16))
+            sent.setdefault(chat_id, []).append(update_id)
+            await pool.put(message_update(update_id, chat_id))
+        await pool.close()
+        await dp.bot.session.close()
+        return sent, handled, overlaps, pool.processed
+
+    sent, handled, overlaps, processed = asyncio.run(run())
+    assert handled == sent
+    assert overlaps == []
+    assert processed == 200
+
+
+def test_chats_are_processed_concurrently():
+    async def run():
+        dp = dispatcher()
+        gate = asyncio.Event()
+        started = []
+
+        async def handler(message: Message):
+            started.append(message.chat.id)
+            await gate.wait()
+
+        dp.register_message_handler(handler)
+        pool = UpdateWorkerPool(dp, workers=2, queue_size=10)
+        pool.start()
+        # Chats 1 and 2 land on different workers, the second one is not held up by the first
+        await pool.put(message_update(1, 1))
+        await pool.put(message_update(2, 2))
+        await asyncio.sleep(0.05)
+        gate.set()
+        await pool.close()
+        await dp.bot.session.close()
+        return started
+
+    assert sorted(asyncio.run(run())) == [1, 2]
+
+
+def test_full_queue_pushes_back_on_the_receiver():
+    async def run():
+        dp = dispatcher()
+        gate = asyncio.Event()
+
+        async def handler(message: Message):
+            await gate.wait()
+
+        dp.register_message_handler(handler)
+        pool = UpdateWorkerPool(dp, workers=1, queue_size=2)
+        pool.start()
+        # The worker holds the first update, the queue takes two more
+        for update_id in range(1, 4):
+            await pool.put(message_update(update_id, 5))
+            await asyncio.sleep(0)
+        blocked = asyncio.ensure_future(pool.put(message_update(4, 5)))
+        await asyncio.sleep(0.05)
+        was_blocked = not blocked.done()
+        queued = pool.queued
+        gate.set()
+        await asyncio.wait_for(blocked, 1)
+        await pool.close()
+        await dp.bot.session.close()
+        return was_blocked, queued, pool.processed
+
+    assert asyncio.run(run()) == (True, 2, 4)
+
+
+def test_failing_update_does_not_stop_the_worker():
+    async def run():
+        dp = dispatcher()
+        handled = []
+
+        async def handler(message: Message):
+            if message.text == 'fail':
+                raise RuntimeError('handler failed')
+            handled.append(message.message_id)
+
+        dp.register_message_handler(handler)
+        pool = UpdateWorkerPool(dp, workers=1, queue_size=10)
+        pool.start()
+        await pool.put(message_update(1, 5, 'fail'))
+        await pool.put(message_update(2, 5))
+        await pool.close()
+        await dp.bot.session.close()
+        return handled, pool.processed, pool.failed
+
+    assert asyncio.run(run()) == ([2], 1, 1)
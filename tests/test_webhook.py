@@ -0,0 +1,138 @@
+import asyncio
+import json
+import socket
+from typing import List, Optional, Tuple
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.types import Message, Update
+from aiohttp import web
+
+from telegram_bot.updates import UpdateWorkerPool
+from telegram_bot.webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+
+TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+UPDATE = {
+    'update_id': 10,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+        'text': '/start'
+    }
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def post(body: bytes, secret_token: Optional[str] = None, headers: Optional[dict] = None):
+    async def run():
+        received: List[Update] = []
+
+        async def sink(update: Update):
+            received.append(update)
+
+        port = free_port()
+        server = WebhookServer(sink, host='127.0.0.1', port=port, path='/webhook', secret_token=secret_token)
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f'http://127.0.0.1:{port}/webhook', data=body, headers=headers) as response:
+                    return response.status, received
+        finally:
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def test_update_is_handed_to_the_sink():
+    status, received = post(json.dumps(UPDATE).encode(), 'secret', {SECRET_TOKEN_HEADER: 'secret'})
+    assert status == 200
+    assert [(update.update_id, update.message.chat.id, update.message.text) for update in received] == [
+        (10, 42, '/start')
+    ]
+
+
+def test_missing_or_wrong_secret_token_is_rejected():
+    for headers in (None, {SECRET_TOKEN_HEADER: 'wrong'}, {SECRET_TOKEN_HEADER: ''}):
+        status, received = post(json.dumps(UPDATE).encode(), 'secret', headers)
+        assert (status, received) == (401, [])
+
+
+def test_without_secret_token_every_request_is_accepted():
+    status, received = post(json.dumps(UPDATE).encode())
+    assert status == 200
+    assert len(received) == 1
+
+
+def test_malformed_body_is_rejected():
+    for body in (b'{"update_id": ', b'[]', b'1', b'"x"', b'null'):
+        status, received = post(body, 'secret', {SECRET_TOKEN_HEADER: 'secret'})
+        assert (status, received) == (400, []), body
+
+
+class FakeBotAPI:
+    """Answers every Bot API method with a message and records the requests."""
+
+    def __init__(self):
+        self.requests: List[Tuple[str, dict]] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, port: int) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', port).start()
+        return f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests.append((request.match_info['method'], dict(await request.post())))
+        return web.json_response({'ok': True, 'result': UPDATE['message']})
+
+
+def test_webhook_update_is_answered_through_the_worker_pool():
+    async def run():
+        api = FakeBotAPI()
+        bot = Bot(TOKEN, server=TelegramAPIServer.from_base(await api.start(free_port())))
+        dp = Dispatcher(bot)
+        gate = asyncio.Event()
+
+        async def start(message: Message):
+            await gate.wait()
+            await message.answer('Добро пожаловать')
+
+        dp.register_message_handler(start, commands=['start'])
+        pool = UpdateWorkerPool(dp, workers=2, queue_size=10)
+        pool.start()
+        port = free_port()
+        server = WebhookServer(pool.put, host='127.0.0.1', port=port, path='/webhook', secret_token='secret')
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f'http://127.0.0.1:{port}/webhook', json=UPDATE,
+                                        headers={SECRET_TOKEN_HEADER: 'secret'}) as response:
+                    status = response.status
+            # The handler is still waiting, the webhook answered before processing finished
+            answered_first = not api.requests and pool.processed == 0
+            gate.set()
+            await pool.close()
+        finally:
+            await server.stop()
+            await bot.session.close()
+            await api.stop()
+        return status, answered_first, api.requests, pool.processed
+
+    status, answered_first, requests, processed = asyncio.run(run())
+    assert (status, answered_first, processed) == (200, True, 1)
+    assert requests == [('sendMessage', {'chat_id': '42', 'text': 'Добро пожаловать'})]